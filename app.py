@@ -1,20 +1,63 @@
 import os
+import sys
 import random
 import uuid
 import logging
-import grpc
+import threading
+import time
+import re
+import bisect
+import math
+import unicodedata
+import inspect
+import hashlib
+import hmac
+import gzip
+import mimetypes
+import importlib
+import secrets
+import sqlite3
+from collections import OrderedDict
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 
 logging.basicConfig(level=logging.WARNING)
 
-from flask import Flask, json, render_template, request, redirect, url_for, session, flash
+from flask import Flask, json, render_template, request, redirect, url_for, session, flash, send_from_directory, g, message_flashed, has_request_context, copy_current_request_context
 # 🚨 NOVA IMPORTAÇÃO: werkzeug.utils para nomes de arquivo seguros
 from werkzeug.utils import secure_filename 
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
-from datetime import datetime, timedelta
-from functools import wraps 
-# Importação necessária para usar o filtro moderno no Firestore
-from google.cloud.firestore_v1.base_query import FieldFilter 
+from werkzeug.security import safe_join
+from flask.sessions import SessionInterface, SecureCookieSession
+from itsdangerous import Signer, BadSignature
+import msgpack
+from datetime import datetime, timedelta, timezone
+from functools import wraps, lru_cache
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+
+class _ModuloSobDemanda:
+    """Módulo importado só no primeiro acesso a um atributo (submódulos também são resolvidos).
+
+    firebase_admin, google.cloud.firestore e gRPC somam centenas de milissegundos de import:
+    rotas que não usam o banco (/ajuda, /triagem...) e o cold start não pagam por eles.
+    """
+
+    def __init__(self, nome):
+        self._nome = nome
+        self._modulo = None
+
+    def __getattr__(self, atributo):
+        if self._modulo is None:
+            self._modulo = importlib.import_module(self._nome) # O lock de import já é thread-safe
+        try:
+            return getattr(self._modulo, atributo)
+        except AttributeError:
+            return importlib.import_module(f'{self._nome}.{atributo}')
+
+firebase_admin = _ModuloSobDemanda('firebase_admin')
+credentials = _ModuloSobDemanda('firebase_admin.credentials')
+# Também expõe o restante de google.cloud.firestore (FieldFilter, SERVER_TIMESTAMP...)
+firestore = _ModuloSobDemanda('firebase_admin.firestore')
+excecoes_google = _ModuloSobDemanda('google.api_core.exceptions')
 
 # ==========================================================
 # 1. INICIALIZAÇÃO DO FLASK E FIREBASE
@@ -33,43 +76,543 @@ if app.secret_key == 'default_fallback_for_dev_only' and os.environ.get('RENDER_
 
 # === FIM DA CORREÇÃO ===
 # !!! TROQUE POR UMA CHAVE MAIS SEGURA NA PRODUÇÃO !!!
-# 1. Verifica se o aplicativo Firebase Padrão já existe
-if not firebase_admin._apps:
-    FIREBASE_CREDENTIALS_JSON = os.environ.get('FIREBASE_CREDENTIALS_JSON')
+
+# O Firebase e o cliente do Firestore são criados no primeiro uso (ver 'db' e 'auth' na seção 1.2),
+# não no import: o cold start não espera credenciais nem gRPC, e com o gunicorn em modo preload
+# (gunicorn.conf.py) nenhuma conexão é aberta no master, já que canais gRPC não sobrevivem ao fork().
+firebase_app = None
+_firebase_lock = threading.Lock()
+CRED_PATH = 'firebase-admin-sdk.json'
+
+class FirebaseNaoConfigurado(RuntimeError):
+    """Credenciais do Firebase ausentes ou inválidas: erro de deploy, não uma falha passageira."""
+
+def verificar_credenciais_firebase():
+    """Falha no boot se não houver credenciais (variável de ambiente ou arquivo local).
+
+    Só confere se elas existem (sem importar o firebase_admin): o Firebase continua sendo
+    inicializado no primeiro uso. Um app do Firebase já inicializado no processo também vale.
+    """
+    if os.environ.get('FIREBASE_CREDENTIALS_JSON') or os.path.exists(CRED_PATH):
+        return
+    modulo = sys.modules.get('firebase_admin')
+    if modulo is not None and modulo._apps:
+        return
+    print("❌ ERRO CRÍTICO: Credenciais Firebase não encontradas.")
+    raise FirebaseNaoConfigurado("Credenciais Firebase ausentes. Configure a variável de ambiente.")
+
+def inicializar_firebase():
+    """Inicializa (uma vez por processo) o app padrão do Firebase Admin e o devolve.
+
+    Use garantir_firebase(), que serializa a primeira chamada entre as threads do worker.
+    """
+    # 1. Verifica se o aplicativo Firebase Padrão já existe
+    if not firebase_admin._apps:
+        FIREBASE_CREDENTIALS_JSON = os.environ.get('FIREBASE_CREDENTIALS_JSON')
     
-    if FIREBASE_CREDENTIALS_JSON:
-        # Opção A: Credenciais de ambiente (para Produção/Render)
-        try:
-            # Carrega o JSON da variável de ambiente como um dicionário
-            cred_dict = json.loads(FIREBASE_CREDENTIALS_JSON)
-            cred = credentials.Certificate(cred_dict)
-            firebase_app = firebase_admin.initialize_app(cred)
-            print("✅ Firebase inicializado com sucesso via Variável de Ambiente.")
-        except Exception as e:
-            print(f"❌ ERRO CRÍTICO ao inicializar Firebase via Variável de Ambiente: {e}")
-            raise
-    else:
-        # Opção B: Credenciais do arquivo local (para Desenvolvimento)
-        CRED_PATH = 'firebase-admin-sdk.json'
-        if os.path.exists(CRED_PATH):
+        if FIREBASE_CREDENTIALS_JSON:
+            # Opção A: Credenciais de ambiente (para Produção/Render)
             try:
-                cred = credentials.Certificate(CRED_PATH)
+                # Carrega o JSON da variável de ambiente como um dicionário
+                cred_dict = json.loads(FIREBASE_CREDENTIALS_JSON)
+                cred = credentials.Certificate(cred_dict)
                 firebase_app = firebase_admin.initialize_app(cred)
-                print("⏳ Firebase inicializado com sucesso via Arquivo Local.")
+                print("✅ Firebase inicializado com sucesso via Variável de Ambiente.")
             except Exception as e:
-                print(f"❌ ERRO CRÍTICO ao inicializar Firebase via Arquivo Local: {e}")
-                raise
+                print(f"❌ ERRO CRÍTICO ao inicializar Firebase via Variável de Ambiente: {e}")
+                raise FirebaseNaoConfigurado(str(e)) from e
         else:
-            # Nenhuma credencial encontrada
-            print("❌ ERRO CRÍTICO: Credenciais Firebase não encontradas.")
-            raise Exception("Credenciais Firebase ausentes. Configure a variável de ambiente.")
-else:
-    # Se já existir (caso o Gunicorn tenha feito a inicialização), usa a instância existente.
-    firebase_app = firebase_admin.get_app()
-    print("⚠️ Firebase já estava inicializado. Usando a instância existente.")
+            # Opção B: Credenciais do arquivo local (para Desenvolvimento)
+            if os.path.exists(CRED_PATH):
+                try:
+                    cred = credentials.Certificate(CRED_PATH)
+                    firebase_app = firebase_admin.initialize_app(cred)
+                    print("⏳ Firebase inicializado com sucesso via Arquivo Local.")
+                except Exception as e:
+                    print(f"❌ ERRO CRÍTICO ao inicializar Firebase via Arquivo Local: {e}")
+                    raise FirebaseNaoConfigurado(str(e)) from e
+            else:
+                # Nenhuma credencial encontrada
+                print("❌ ERRO CRÍTICO: Credenciais Firebase não encontradas.")
+                raise FirebaseNaoConfigurado("Credenciais Firebase ausentes. Configure a variável de ambiente.")
+    else:
+        # Se já existir (caso o Gunicorn tenha feito a inicialização), usa a instância existente.
+        firebase_app = firebase_admin.get_app()
+        print("⚠️ Firebase já estava inicializado. Usando a instância existente.")
+    return firebase_app
+
+def garantir_firebase():
+    """App do Firebase do processo, inicializado na primeira chamada (thread-safe)."""
+    global firebase_app
+    if firebase_app is None:
+        with _firebase_lock:
+            if firebase_app is None:
+                firebase_app = inicializar_firebase()
+    return firebase_app
+
+# Deploy sem credenciais não sobe (como antes da inicialização sob demanda): sem isso o app
+# rodaria com 'db' falso, mostrando o mock e "confirmando" pagamentos sem gravar nada.
+verificar_credenciais_firebase()
+
+# ==========================================================
+# 1.1 INSTRUMENTAÇÃO POR REQUISIÇÃO (FIRESTORE E AUTH)
+# ==========================================================
+
+# Cada requisição acumula suas operações em request.environ (compartilhado também com threads
+# que copiam o contexto da requisição); o total sai no cabeçalho Server-Timing e no log.
+METRICAS_ENVIRON = 'psicoajuda.metricas'
+LOG_REQUISICOES = os.environ.get('LOG_REQUISICOES', '1') == '1'
+log_requisicoes = logging.getLogger('psicoajuda.requisicoes')
+log_requisicoes.setLevel(logging.INFO)
+_metricas_lock = threading.Lock()
+
+# Métodos que só preparam escritas em batch/transação (a RPC é o commit)
+_ESCRITAS_PREPARADAS = {'set': 'escritas', 'create': 'escritas', 'update': 'escritas', 'delete': 'exclusoes'}
+_ESCRITAS_DIRETAS = dict(_ESCRITAS_PREPARADAS, add='escritas')
+_LEITURAS = {'get', 'stream', 'get_all'}
+_COMMITS = {'commit', '_commit'}
+
+def _novas_metricas():
+    return {
+        'firestore_rpcs': 0, 'firestore_ms': 0.0,
+        'leituras': 0, 'escritas': 0, 'exclusoes': 0,
+        'auth_rpcs': 0, 'auth_ms': 0.0,
+    }
+
+def _somar_metricas(**valores):
+    """Soma os valores às métricas da requisição atual, se houver."""
+    if not has_request_context():
+        return # CLI, listener do Firestore ou thread sem contexto
+    metricas = request.environ.get(METRICAS_ENVIRON)
+    if metricas is None:
+        return
+    with _metricas_lock:
+        for nome, valor in valores.items():
+            metricas[nome] += valor
+
+def _contar_documentos_firestore(**contagens):
+    """Soma leituras/escritas/exclusões à requisição atual e ao contador do Prometheus (seção 1.2)."""
+    for tipo, quantidade in contagens.items():
+        metrica_documentos_firestore.labels(tipo).inc(quantidade)
+    _somar_metricas(**contagens)
+
+def _registrar_operacao(servico, operacao, duracao, **contagens):
+    """Registra uma RPC de 'firestore' ou 'auth' com sua duração (e as contagens de documentos)."""
+    metrica_rpc_segundos.labels(servico, operacao).observe(duracao)
+    _somar_metricas(**{f'{servico}_rpcs': 1, f'{servico}_ms': duracao * 1000})
+    _contar_documentos_firestore(**contagens)
+
+def _desembrulhar(valor):
+    if isinstance(valor, _FirestoreInstrumentado):
+        return valor._alvo
+    if isinstance(valor, (list, tuple)):
+        return type(valor)(_desembrulhar(v) for v in valor)
+    return valor
+
+def _contar_documentos(resultado):
+    """Leituras cobradas por um resultado de get(): snapshot, lista de documentos ou de agregações."""
+    if isinstance(resultado, list):
+        if resultado and isinstance(resultado[0], list):
+            return 1 # Agregação (count/sum): uma leitura por lote de até 1000 entradas de índice
+        return max(1, len(resultado))
+    return 1
+
+def _iterar_medindo(iterador, operacao, inicio):
+    """Repassa os documentos de um stream e registra a RPC (tempo até esgotar e total lido) no fim."""
+    lidos = 0
+    try:
+        for item in iterador:
+            lidos += 1
+            yield item
+    finally:
+        _registrar_operacao('firestore', operacao, time.perf_counter() - inicio, leituras=max(1, lidos))
+
+class _FirestoreInstrumentado:
+    """Proxy do cliente do Firestore e dos objetos derivados (coleções, consultas, documentos, batches).
+
+    As chamadas são repassadas ao objeto real; as que fazem RPC são cronometradas e contadas.
+    """
+
+    def __init__(self, alvo):
+        object.__setattr__(self, '_alvo', alvo)
+
+    def __getattr__(self, nome):
+        atributo = getattr(self._alvo, nome)
+        if not callable(atributo):
+            return atributo
+
+        prepara_escrita = hasattr(self._alvo, 'commit')
+
+        def chamada(*args, **kwargs):
+            args = _desembrulhar(args)
+            kwargs = {k: _desembrulhar(v) for k, v in kwargs.items()}
+
+            if prepara_escrita and nome in _ESCRITAS_PREPARADAS:
+                resultado = atributo(*args, **kwargs)
+                _contar_documentos_firestore(**{_ESCRITAS_PREPARADAS[nome]: 1})
+                return resultado
+
+            if nome not in _LEITURAS and nome not in _COMMITS and nome not in _ESCRITAS_DIRETAS:
+                return _instrumentar_resultado(atributo(*args, **kwargs))
+
+            inicio = time.perf_counter()
+            resultado = atributo(*args, **kwargs)
+            # stream() devolve um StreamGenerator, que não é um gerador nativo: vale qualquer iterador
+            if nome in _LEITURAS and isinstance(resultado, Iterator):
+                return _iterar_medindo(resultado, nome, inicio)
+
+            duracao = time.perf_counter() - inicio
+            if nome in _LEITURAS:
+                _registrar_operacao('firestore', nome, duracao, leituras=_contar_documentos(resultado))
+            elif nome in _ESCRITAS_DIRETAS:
+                _registrar_operacao('firestore', nome, duracao, **{_ESCRITAS_DIRETAS[nome]: 1})
+            else:
+                _registrar_operacao('firestore', nome.lstrip('_'), duracao)
+            return _instrumentar_resultado(resultado)
+
+        return chamada
+
+    def __setattr__(self, nome, valor):
+        setattr(self._alvo, nome, valor)
+
+    def __bool__(self):
+        return bool(self._alvo)
+
+    def __repr__(self):
+        return f'<instrumentado {self._alvo!r}>'
+
+def _instrumentar_resultado(resultado):
+    """Envolve os objetos que emitem RPCs; snapshots, listas e valores simples passam direto."""
+    if resultado is None or hasattr(resultado, 'to_dict') or isinstance(resultado, (list, tuple, dict, str)):
+        return resultado
+    if any(hasattr(resultado, metodo) for metodo in ('stream', 'commit', 'collection')):
+        return _FirestoreInstrumentado(resultado)
+    return resultado
+
+class _FirestoreSobDemanda(_FirestoreInstrumentado):
+    """O 'db' do app: o cliente do Firestore (e o Firebase) é criado no primeiro uso, uma vez por processo.
+
+    'if not db' continua funcionando como teste de disponibilidade: é falso se a conexão falhar.
+    Credenciais ausentes ou inválidas (FirebaseNaoConfigurado) não viram 'db' falso: a exceção sobe.
+    """
+
+    def __init__(self):
+        object.__setattr__(self, '_cliente', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    @property
+    def _alvo(self):
+        cliente = self._cliente
+        if cliente is None:
+            with self._lock:
+                if self._cliente is None:
+                    garantir_firebase()
+                    object.__setattr__(self, '_cliente', firestore.client())
+                cliente = self._cliente
+        return cliente
+
+    def _descartar(self):
+        """Esquece o cliente atual (herdado do master após um fork); o próximo uso cria outro."""
+        object.__setattr__(self, '_cliente', None)
+
+    def __bool__(self):
+        try:
+            return self._alvo is not None
+        except FirebaseNaoConfigurado:
+            raise
+        except Exception as e:
+            app.logger.error(f"Firestore indisponível: {e}")
+            return False
+
+    def __repr__(self):
+        return f'<instrumentado sob demanda {self._cliente!r}>'
+
+class _AuthInstrumentado:
+    """Proxy do módulo firebase_admin.auth: funções são cronometradas; exceções e classes passam direto.
+
+    O módulo só é importado (e o Firebase inicializado) na primeira chamada.
+    """
+
+    def __init__(self, modulo):
+        self._modulo = modulo
+
+    def __getattr__(self, nome):
+        atributo = getattr(self._modulo, nome)
+        if not inspect.isfunction(atributo) and not inspect.ismethod(atributo):
+            return atributo
+
+        def chamada(*args, **kwargs):
+            garantir_firebase()
+            inicio = time.perf_counter()
+            try:
+                return atributo(*args, **kwargs)
+            finally:
+                _registrar_operacao('auth', nome, time.perf_counter() - inicio)
+
+        return chamada
+
+@app.before_request
+def iniciar_metricas_requisicao():
+    request.environ[METRICAS_ENVIRON] = _novas_metricas()
+    g.inicio_requisicao = time.perf_counter()
+
+@app.after_request
+def registrar_metricas_requisicao(response):
+    """Publica as operações da requisição no cabeçalho Server-Timing e numa linha de log em JSON."""
+    metricas = request.environ.get(METRICAS_ENVIRON)
+    if metricas is None or 'inicio_requisicao' not in g:
+        return response
+    total_ms = (time.perf_counter() - g.inicio_requisicao) * 1000
+
+    with _metricas_lock:
+        metricas = dict(metricas)
+    response.headers.add('Server-Timing', ', '.join([
+        f'firestore;dur={metricas["firestore_ms"]:.1f};desc="rpcs={metricas["firestore_rpcs"]} '
+        f'leituras={metricas["leituras"]} escritas={metricas["escritas"]} exclusoes={metricas["exclusoes"]}"',
+        f'auth;dur={metricas["auth_ms"]:.1f};desc="rpcs={metricas["auth_rpcs"]}"',
+        f'app;dur={total_ms:.1f}',
+    ]))
+
+    if LOG_REQUISICOES and request.endpoint != 'static':
+        log_requisicoes.info(json.dumps({
+            'metodo': request.method,
+            'rota': request.endpoint,
+            'caminho': request.path,
+            'status': response.status_code,
+            'duracao_ms': round(total_ms, 1),
+            'firestore_ms': round(metricas['firestore_ms'], 1),
+            'firestore_rpcs': metricas['firestore_rpcs'],
+            'leituras': metricas['leituras'],
+            'escritas': metricas['escritas'],
+            'exclusoes': metricas['exclusoes'],
+            'auth_ms': round(metricas['auth_ms'], 1),
+            'auth_rpcs': metricas['auth_rpcs'],
+        }))
+    return response
+
+# ==========================================================
+# 1.2 MÉTRICAS PROMETHEUS (/metrics)
+# ==========================================================
+
+# Com PROMETHEUS_MULTIPROC_DIR definido (o gunicorn.conf.py define), cada worker grava seus
+# valores em arquivos nessa pasta e o /metrics de qualquer worker devolve a soma de todos.
+BUCKETS_REQUISICAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BUCKETS_RPC = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN') # Bearer token do coletor (que não tem sessão de admin)
+
+metrica_requisicao_segundos = Histogram(
+    'psicoajuda_requisicao_duracao_segundos', 'Duração das requisições por endpoint do Flask.',
+    ['endpoint', 'metodo'], buckets=BUCKETS_REQUISICAO)
+metrica_respostas = Counter(
+    'psicoajuda_respostas_total', 'Respostas por endpoint e código de status.',
+    ['endpoint', 'status'])
+metrica_requisicoes_em_andamento = Gauge(
+    'psicoajuda_requisicoes_em_andamento', 'Requisições sendo processadas no momento.',
+    multiprocess_mode='livesum')
+metrica_rpc_segundos = Histogram(
+    'psicoajuda_rpc_duracao_segundos', 'Duração das RPCs do Firestore e do Auth por operação.',
+    ['servico', 'operacao'], buckets=BUCKETS_RPC)
+metrica_documentos_firestore = Counter(
+    'psicoajuda_firestore_documentos_total', 'Documentos lidos, gravados e excluídos no Firestore.',
+    ['tipo'])
+metrica_cache = Counter(
+    'psicoajuda_cache_total', 'Consultas aos caches em memória (acerto ou falha).',
+    ['cache', 'resultado'])
+metrica_upload_avatar_bytes = Histogram(
+    'psicoajuda_upload_avatar_bytes', 'Tamanho dos avatares enviados pelo admin.',
+    buckets=(50_000, 100_000, 250_000, 500_000, 1_000_000, 2_500_000, 5_000_000, 10_000_000))
+
+def contar_cache(cache, acerto):
+    metrica_cache.labels(cache, 'acerto' if acerto else 'falha').inc()
+
+@app.before_request
+def iniciar_metricas_prometheus():
+    metrica_requisicoes_em_andamento.inc()
+    g.em_andamento_contada = True
+
+@app.after_request
+def registrar_metricas_prometheus(response):
+    if 'inicio_requisicao' in g:
+        endpoint = request.endpoint or 'sem_rota' # 404 não multiplica as séries por URL
+        metrica_requisicao_segundos.labels(endpoint, request.method).observe(time.perf_counter() - g.inicio_requisicao)
+        metrica_respostas.labels(endpoint, str(response.status_code)).inc()
+    return response
+
+@app.teardown_request
+def finalizar_metricas_prometheus(exc):
+    # No teardown (e não no after_request) para também descontar requisições que terminaram em exceção
+    if g.pop('em_andamento_contada', False):
+        metrica_requisicoes_em_andamento.dec()
+
+@app.route('/metrics')
+def metrics():
+    """Métricas no formato do Prometheus, para o admin logado ou para o coletor com o METRICAS_TOKEN."""
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    token_valido = bool(METRICAS_TOKEN) and hmac.compare_digest(token, METRICAS_TOKEN)
+    if session.get('user_role') != 'admin' and not token_valido:
+        return "Acesso negado.", 403
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registro = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registro)
+    else:
+        registro = REGISTRY
+    return generate_latest(registro), 200, {'Content-Type': CONTENT_TYPE_LATEST}
 
 # Configuração da conexão com o banco de dados
-db = firestore.client()
+# (cliente e auth passam pelos proxies da seção 1.1, que medem cada RPC por requisição
+# e só abrem a conexão no primeiro uso)
+db = _FirestoreSobDemanda()
+auth = _AuthInstrumentado(_ModuloSobDemanda('firebase_admin.auth'))
+
+def preparar_worker():
+    """Hook post_fork do gunicorn em modo preload: descarta o que o worker herdou do master.
+
+    Canais gRPC e threads não atravessam o fork(): o cliente do Firestore, o pool de RPCs e o
+    listener do diretório são recriados no primeiro uso dentro do worker.
+    """
+    global _executor_rpc
+    db._descartar()
+    _executor_rpc = None
+    with _cache_psicologos_lock:
+        _cache_psicologos['listener'] = None
+        _cache_psicologos['carregando'] = False
+
+# ==========================================================
+# 1.3 SESSÕES NO SERVIDOR (SQLITE + MSGPACK, COM TTL)
+# ==========================================================
+
+# O cookie leva só um ID opaco e assinado; os dados (agendamento_temp, triagem_filtros, flashes...)
+# ficam num SQLite local, compartilhado pelos workers da máquina e serializado em msgpack.
+# SESSOES_BACKEND=cookie volta à sessão assinada padrão do Flask (ex.: várias máquinas sem disco comum).
+SESSOES_BACKEND = os.environ.get('SESSOES_BACKEND', 'sqlite')
+SESSOES_DB = os.environ.get('SESSOES_DB', os.path.join(app.root_path, '.cache', 'sessoes.sqlite3'))
+SESSOES_TTL = int(os.environ.get('SESSOES_TTL', str(12 * 3600))) # Segundos sem uso até a sessão expirar
+SESSOES_LIMPEZA_A_CADA = 500 # Gravações entre duas limpezas das sessões expiradas
+# Trocar de papel (login/logout) gera um ID novo: um ID plantado antes do login não vale depois dele
+SESSOES_CHAVES_AUTENTICACAO = ('user_role', 'psicologo_uid')
+
+class SessaoServidor(SecureCookieSession):
+    """Sessão com os dados no servidor; 'modified'/'accessed' funcionam como na sessão padrão."""
+
+    def __init__(self, dados=None, sid=None, expira_em=None):
+        super().__init__(dados)
+        self.sid = sid
+        self.expira_em = expira_em
+        self.autenticacao_original = tuple(self.get(chave) for chave in SESSOES_CHAVES_AUTENTICACAO)
+        self.accessed = False # A leitura acima não conta como acesso da requisição
+
+class ArmazemSessoesSQLite:
+    """Sessões num arquivo SQLite em modo WAL: uma conexão por thread (e por processo, após o fork)."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._local = threading.local()
+        self._gravacoes = 0
+
+    def _conexao(self):
+        conexao = getattr(self._local, 'conexao', None)
+        if conexao is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.caminho) or '.', exist_ok=True)
+            conexao = sqlite3.connect(self.caminho, timeout=5, isolation_level=None) # autocommit
+            conexao.execute('PRAGMA journal_mode=WAL')
+            conexao.execute('PRAGMA synchronous=NORMAL')
+            conexao.execute('CREATE TABLE IF NOT EXISTS sessoes '
+                            '(id TEXT PRIMARY KEY, dados BLOB NOT NULL, expira_em REAL NOT NULL)')
+            self._local.conexao, self._local.pid = conexao, os.getpid()
+        return conexao
+
+    def carregar(self, sid):
+        """(dados, expira_em) da sessão, ou (None, None) se não existir ou já tiver expirado."""
+        linha = self._conexao().execute('SELECT dados, expira_em FROM sessoes WHERE id = ?', (sid,)).fetchone()
+        if linha is None or linha[1] < time.time():
+            return None, None
+        return msgpack.unpackb(linha[0], raw=False), linha[1]
+
+    def gravar(self, sid, dados, expira_em):
+        conexao = self._conexao()
+        conexao.execute('INSERT OR REPLACE INTO sessoes (id, dados, expira_em) VALUES (?, ?, ?)',
+                        (sid, msgpack.packb(dados, use_bin_type=True), expira_em))
+        self._gravacoes += 1
+        if self._gravacoes % SESSOES_LIMPEZA_A_CADA == 0:
+            conexao.execute('DELETE FROM sessoes WHERE expira_em < ?', (time.time(),))
+
+    def renovar(self, sid, expira_em):
+        self._conexao().execute('UPDATE sessoes SET expira_em = ? WHERE id = ?', (expira_em, sid))
+
+    def excluir(self, sid):
+        self._conexao().execute('DELETE FROM sessoes WHERE id = ?', (sid,))
+
+class InterfaceSessaoServidor(SessionInterface):
+    """SessionInterface do Flask sobre um armazém com carregar/gravar/renovar/excluir (ex.: ArmazemSessoesSQLite).
+
+    Só grava quando a sessão muda; sessões só lidas têm o prazo renovado quando passam da metade do TTL.
+    """
+
+    def __init__(self, armazem):
+        self.armazem = armazem
+
+    def _assinador(self, app):
+        return Signer(app.secret_key, salt='psicoajuda-sessao')
+
+    def _ttl(self, app, session):
+        return app.permanent_session_lifetime.total_seconds() if session.permanent else SESSOES_TTL
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        valor = request.cookies.get(self.get_cookie_name(app))
+        if valor:
+            try:
+                sid = self._assinador(app).unsign(valor).decode()
+            except BadSignature:
+                sid = None # Cookie adulterado ou de antes da troca de backend: começa uma sessão nova
+            if sid:
+                dados, expira_em = self.armazem.carregar(sid)
+                if dados is not None:
+                    return SessaoServidor(dados, sid=sid, expira_em=expira_em)
+        return SessaoServidor()
+
+    def save_session(self, app, session, response):
+        nome = self.get_cookie_name(app)
+        opcoes_cookie = {
+            'domain': self.get_cookie_domain(app),
+            'path': self.get_cookie_path(app),
+            'secure': self.get_cookie_secure(app),
+            'partitioned': self.get_cookie_partitioned(app),
+            'samesite': self.get_cookie_samesite(app),
+            'httponly': self.get_cookie_httponly(app),
+        }
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        # Sessão esvaziada (ex.: logout e flashes consumidos): apaga o registro e o cookie
+        if not session:
+            if session.sid and session.modified:
+                self.armazem.excluir(session.sid)
+                response.delete_cookie(nome, **opcoes_cookie)
+                response.vary.add('Cookie')
+            return
+
+        agora = time.time()
+        expira_em = agora + self._ttl(app, session)
+        if session.modified or session.sid is None:
+            sid = session.sid
+            autenticacao = tuple(session.get(chave) for chave in SESSOES_CHAVES_AUTENTICACAO)
+            if sid is None or autenticacao != session.autenticacao_original:
+                if sid is not None:
+                    self.armazem.excluir(sid)
+                sid = secrets.token_urlsafe(32)
+            self.armazem.gravar(sid, dict(session), expira_em)
+            if sid != session.sid or session.permanent:
+                response.set_cookie(nome, self._assinador(app).sign(sid).decode(),
+                                    expires=self.get_expiration_time(app, session), **opcoes_cookie)
+                response.vary.add('Cookie')
+        elif session.expira_em - agora < self._ttl(app, session) / 2:
+            self.armazem.renovar(session.sid, expira_em)
+
+if SESSOES_BACKEND == 'sqlite':
+    app.session_interface = InterfaceSessaoServidor(ArmazemSessoesSQLite(SESSOES_DB))
 
 # ==========================================================
 # 2. CONFIGURAÇÃO DE UPLOAD
@@ -82,9 +625,11 @@ UPLOAD_FOLDER = 'static/img/avatares'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-# Cria a pasta se ela não existir (MUITO IMPORTANTE)
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
+# Miniaturas geradas a partir de cada upload (ver seção 4.4)
+AVATAR_MINIATURAS_FOLDER = os.path.join(UPLOAD_FOLDER, 'miniaturas')
+AVATAR_TAMANHOS = (112, 224, 448) # 1x, 2x e 4x do tamanho exibido nos cards (w-28 = 112 px)
+
+# A pasta é criada no momento do upload (os.makedirs antes de salvar), não no import
 # FIM CONFIGURAÇÃO DE UPLOAD
 
     # Decida se o app deve parar aqui ou continuar com funcionalidade limitada
@@ -102,6 +647,38 @@ ADMIN_SENHA_FIXA = "33529710"
 # 3. CONTEXT PROCESSOR E FILTROS JINJA
 # ==========================================================
 
+# Bytecode dos templates compilados em disco: um worker novo (ou reiniciado) carrega o código
+# pronto em vez de analisar e compilar dashboard.html, historico.html etc. de novo. A chave inclui
+# o checksum do fonte, então um template alterado é recompilado sozinho.
+# "flask compilar-templates" preenche o cache no build.
+JINJA_CACHE_DIR = os.environ.get('JINJA_CACHE_DIR', os.path.join(app.root_path, '.cache', 'jinja'))
+# Sem a variável, fica None e o Flask decide pelo modo debug (inclusive o de app.run(debug=True)):
+# em produção o Jinja não confere a data dos arquivos a cada render
+if 'TEMPLATES_AUTO_RELOAD' in os.environ:
+    app.config['TEMPLATES_AUTO_RELOAD'] = os.environ['TEMPLATES_AUTO_RELOAD'] == '1'
+
+def _cache_de_bytecode_jinja():
+    from jinja2 import FileSystemBytecodeCache
+    try:
+        os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    except OSError as e:
+        print(f"Aviso: cache de bytecode do Jinja desativado ({JINJA_CACHE_DIR}: {e}).")
+        return None
+    return FileSystemBytecodeCache(JINJA_CACHE_DIR, pattern='psicoajuda-%s.cache')
+
+app.jinja_options = dict(app.jinja_options, bytecode_cache=_cache_de_bytecode_jinja())
+
+@app.cli.command('compilar-templates')
+def compilar_templates():
+    """Compila todos os templates para o cache de bytecode (flask compilar-templates)."""
+    if app.jinja_env.bytecode_cache is None:
+        print("❌ Cache de bytecode indisponível; nada foi gravado.")
+        return
+    nomes = app.jinja_env.list_templates(extensions=['html'])
+    for nome in nomes:
+        app.jinja_env.get_template(nome)
+    print(f"✅ {len(nomes)} templates compilados em {JINJA_CACHE_DIR}.")
+
 @app.context_processor
 def inject_global_variables():
     """Torna o ano atual disponível como 'current_year' em todos os templates."""
@@ -170,20 +747,47 @@ MOCK_PSICOLOGOS = [
     }
 ]
 
-# Função para gerar horários simulados
-def get_mock_horarios():
-    horarios = {}
-    hoje = datetime.now()
-    dias = [
-        hoje + timedelta(days=i) for i in range(1, 5)
-    ]
-    
-    for dia in dias:
-        dia_str = dia.strftime("%A, %d/%m") 
-        horarios[dia_str] = [
-            f"{h:02d}:00" for h in range(9, 17, 2)
-        ]
-    return horarios
+# Horário de Brasília (sem horário de verão desde 2019), usado nas datas das sessões
+FUSO_BRASILIA = timezone(timedelta(hours=-3))
+
+def interpretar_data_hora_sessao(texto, referencia=None):
+    """Converte o horário escolhido no agendamento em datetime (fuso de Brasília).
+
+    Aceita o formato ISO ('2025-10-15T14:00') e o texto enviado pelo formulário
+    ('Terça-feira, 15/10 às 14:00'), cujo ano é deduzido a partir de 'referencia'.
+    Retorna None se o formato não for reconhecido.
+    """
+    if not isinstance(texto, str):
+        return None
+    try:
+        return datetime.strptime(texto, '%Y-%m-%dT%H:%M').replace(tzinfo=FUSO_BRASILIA)
+    except ValueError:
+        pass
+
+    encontrado = re.search(r'(\d{1,2})/(\d{1,2})\D+(\d{1,2}):(\d{2})', texto)
+    if not encontrado:
+        return None
+    referencia = referencia or datetime.now(FUSO_BRASILIA)
+    dia, mes, hora, minuto = map(int, encontrado.groups())
+    try:
+        data_hora = datetime(referencia.year, mes, dia, hora, minuto, tzinfo=FUSO_BRASILIA)
+        # Os horários oferecidos são sempre dos próximos dias: se a data ficou muito no passado,
+        # a sessão é do ano seguinte (ex.: agendamento feito em dezembro para janeiro)
+        if data_hora < referencia - timedelta(days=180):
+            data_hora = data_hora.replace(year=data_hora.year + 1)
+    except ValueError:
+        return None
+    return data_hora
+
+def campos_data_sessao(texto, referencia=None):
+    """Campos derivados de 'dataHoraSessao', calculados uma única vez ao gravar o agendamento."""
+    data_hora = interpretar_data_hora_sessao(texto, referencia)
+    if data_hora is None:
+        return {}
+    return {
+        'dataHoraInicio': data_hora, # Timestamp ordenável, usado pelo histórico (ordem e filtro por período)
+        'dataFormatada': data_hora.strftime('%d/%m/%Y às %H:%M') # Pronto para exibição
+    }
 
 # 🚨 FUNÇÃO ADICIONADA: Validação de Arquivo
 def allowed_file(filename):
@@ -191,59 +795,184 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# FUNÇÃO UTILITÁRIA CORRIGIDA: PRIORIZA FIREBASE E MAPEIA CAMPOS
-def get_all_psicologos():
-    """Busca a lista de psicólogos do Firestore (prioridade) ou usa o Mock (fallback)."""
-    psicologos_list = []
+# Mapeamento dos campos do Firestore para os campos esperados no Flask 
+FIELD_MAP = {
+    'bio': 'descricaoCurta', # Bio no DB vira descricaoCurta no App
+    'especialidades': 'tags', # Especialidades no DB vira tags no App
+    'fotoURL': 'avatar_filename', # fotoURL no DB vira avatar_filename no App
+    'genero': 'genero',
+    'nome': 'nome',
+    'email': 'email',
+    'valorSessao': 'valorSessao',
+    'cadastradoEm': 'cadastradoEm',
+    'horariosAtendimento': 'horariosAtendimento' # Regras semanais da agenda (seção 4.11)
+}
+
+def mapear_psicologo(doc_id, db_data):
+    """Converte um documento da coleção 'psicologos' para o formato usado pelas rotas e templates."""
+    mapped_data = {}
+
+    # Mapeia e sanitiza os dados
+    for db_field, app_field in FIELD_MAP.items():
+        # Mapeia o valor, lidando com tags (que podem ser None se o doc for antigo)
+        if app_field == 'tags':
+             mapped_data[app_field] = db_data.get(db_field, []) or []
+        else:
+             mapped_data[app_field] = db_data.get(db_field)
     
-    # Mapeamento dos campos do Firestore para os campos esperados no Flask 
-    FIELD_MAP = {
-        'bio': 'descricaoCurta', # Bio no DB vira descricaoCurta no App
-        'especialidades': 'tags', # Especialidades no DB vira tags no App
-        'fotoURL': 'avatar_filename', # fotoURL no DB vira avatar_filename no App
-        'genero': 'genero',
-        'nome': 'nome',
-        'email': 'email',
-        'valorSessao': 'valorSessao',
-        'cadastradoEm': 'cadastradoEm'
-    }
+    # É crucial garantir que o ID do documento esteja no dicionário para as rotas
+    mapped_data['id'] = doc_id 
     
-    # 1. Tenta buscar do Firestore
-    if db:
-        try:
-            # Busca todos os documentos na coleção 'psicologos'
-            docs = db.collection('psicologos').stream()
-            
-            # Converte os documentos e adiciona à lista
-            for doc in docs:
-                db_data = doc.to_dict()
-                mapped_data = {}
-
-                # Mapeia e sanitiza os dados
-                for db_field, app_field in FIELD_MAP.items():
-                    # Mapeia o valor, lidando com tags (que podem ser None se o doc for antigo)
-                    if app_field == 'tags':
-                         mapped_data[app_field] = db_data.get(db_field, []) or []
-                    else:
-                         mapped_data[app_field] = db_data.get(db_field)
-                
-                # É crucial garantir que o ID do documento esteja no dicionário para as rotas
-                mapped_data['id'] = doc.id 
-                
-                # Define um padrão se não houver foto (usa o nome do arquivo, não o caminho completo)
-                if not mapped_data.get('avatar_filename') or mapped_data.get('avatar_filename') == '':
-                     mapped_data['avatar_filename'] = 'default_avatar.jpg'
+    # Define um padrão se não houver foto (usa o nome do arquivo, não o caminho completo)
+    if not mapped_data.get('avatar_filename') or mapped_data.get('avatar_filename') == '':
+         mapped_data['avatar_filename'] = 'default_avatar.jpg'
 
-                psicologos_list.append(mapped_data)
+    return mapped_data
 
-            # Se o Firestore retornou dados, use eles.
-            if psicologos_list:
-                return psicologos_list
+# ==========================================================
+# 4.1 CACHE DO DIRETÓRIO DE PSICÓLOGOS (COMPARTILHADO NO PROCESSO)
+# ==========================================================
 
-        except Exception as e:
-            print(f"Aviso: Erro ao carregar psicólogos do Firestore: {e}. Usando MOCK.")
-            
-    # 2. Fallback: Se DB falhou ou está offline, usa o MOCK
+# Tempo (em segundos) que a lista fica em memória antes de ser relida do Firestore.
+PSICOLOGOS_CACHE_TTL = float(os.environ.get('PSICOLOGOS_CACHE_TTL', '300'))
+# Com PSICOLOGOS_CACHE_LISTENER=1, um listener on_snapshot mantém o cache sempre atualizado
+# e as leituras passam a ser apenas em memória (sem custo de leitura por requisição).
+PSICOLOGOS_CACHE_LISTENER = os.environ.get('PSICOLOGOS_CACHE_LISTENER') == '1'
+
+_cache_psicologos = {
+    'dados': None,        # Lista já mapeada (FIELD_MAP) ou None quando precisa recarregar
+    'carregado_em': 0.0,  # time.monotonic() da última carga
+    'por_id': {},         # Índice id -> psicólogo, construído junto com 'dados'
+    'indice': None,       # Índice de busca (seção 4.2), construído junto com 'dados'
+    'versao': 0,          # Incrementada a cada carga ou invalidação
+    'listener': None,     # Watch do on_snapshot, se habilitado
+    'carregando': False,  # Uma thread relendo a coleção fora do lock (as demais usam a versão anterior)
+}
+_cache_psicologos_lock = threading.RLock()
+# Avisa o fim de uma carga às threads que não tinham versão anterior para usar
+_cache_psicologos_carregado = threading.Condition(_cache_psicologos_lock)
+
+# LRU limitado para leituras pontuais (ids que não estavam no índice, inclusive inexistentes).
+PSICOLOGOS_LRU_MAX = int(os.environ.get('PSICOLOGOS_LRU_MAX', '256'))
+_lru_psicologos = OrderedDict() # id -> (time.monotonic() da leitura, psicólogo mapeado ou None)
+
+def _montar_cache_psicologos(psicologos):
+    """Lista ordenada, índice por ID e índice de busca de uma nova carga (não precisa do lock)."""
+    # Mantém a ordem por ID do documento (a mesma do Firestore), usada pela paginação por cursor
+    psicologos = sorted(psicologos, key=lambda p: p['id'])
+    return {'dados': psicologos, 'por_id': {p['id']: p for p in psicologos},
+            'indice': construir_indice_busca(psicologos)}
+
+def _instalar_cache_psicologos(novo, atual=True):
+    """Troca o cache pela carga montada (chamar com o lock adquirido).
+
+    atual=False instala a lista já vencida: ela é servida, mas a próxima leitura recarrega.
+    """
+    _cache_psicologos.update(novo)
+    _cache_psicologos['carregado_em'] = time.monotonic() if atual else float('-inf')
+    _cache_psicologos['versao'] += 1
+    _lru_psicologos.clear()
+
+def _salvar_cache_psicologos(psicologos):
+    """Grava uma nova lista no cache (chamar com o lock adquirido)."""
+    _instalar_cache_psicologos(_montar_cache_psicologos(psicologos))
+
+def _on_snapshot_psicologos(col_snapshot, changes, read_time):
+    """Callback do listener do Firestore: substitui o cache pela coleção recebida."""
+    psicologos = [mapear_psicologo(doc.id, doc.to_dict()) for doc in col_snapshot]
+    with _cache_psicologos_lock:
+        _salvar_cache_psicologos(psicologos)
+
+def _iniciar_listener_psicologos():
+    """Inicia (uma vez por processo) o listener on_snapshot da coleção 'psicologos'."""
+    watch = _cache_psicologos['listener']
+    if watch is not None and watch.is_active:
+        return True
+    try:
+        _cache_psicologos['listener'] = db.collection('psicologos').on_snapshot(_on_snapshot_psicologos)
+        return True
+    except Exception as e:
+        app.logger.warning(f"Não foi possível iniciar o listener de psicólogos: {e}")
+        _cache_psicologos['listener'] = None
+        return False
+
+def _listener_psicologos_ativo():
+    watch = _cache_psicologos['listener']
+    return watch is not None and watch.is_active
+
+def _cache_psicologos_valido():
+    """Indica se a lista em memória pode ser usada sem reler o Firestore (chamar com o lock)."""
+    if _cache_psicologos['dados'] is None:
+        return False
+    if PSICOLOGOS_CACHE_LISTENER and _listener_psicologos_ativo():
+        # Com o listener ativo o cache é atualizado pelo próprio Firestore
+        return True
+    return time.monotonic() - _cache_psicologos['carregado_em'] <= PSICOLOGOS_CACHE_TTL
+
+def invalidar_cache_psicologos():
+    """Descarta a lista em memória, forçando uma nova leitura completa na próxima requisição."""
+    with _cache_psicologos_lock:
+        _cache_psicologos['dados'] = None
+        _cache_psicologos['por_id'] = {}
+        _cache_psicologos['indice'] = None
+        _cache_psicologos['versao'] += 1
+        _lru_psicologos.clear()
+
+def atualizar_psicologo_no_cache(psicologo_id):
+    """Relê um único psicólogo e atualiza lista, índice por ID e índice de busca de forma incremental.
+
+    Chamado pelas rotas de cadastro e edição do admin. Se a leitura falhar, o cache é invalidado.
+    """
+    try:
+        doc = db.collection('psicologos').document(psicologo_id).get()
+    except Exception as e:
+        app.logger.warning(f"Falha ao reler psicólogo {psicologo_id}; invalidando o cache: {e}")
+        invalidar_cache_psicologos()
+        return
+
+    if not doc.exists:
+        remover_psicologo_do_cache(psicologo_id)
+        return
+
+    psicologo = mapear_psicologo(doc.id, doc.to_dict())
+    with _cache_psicologos_lock:
+        _lru_psicologos.pop(psicologo_id, None)
+        # A versão muda mesmo sem lista carregada: as páginas em cache (seção 4.6) dependem dela
+        _cache_psicologos['versao'] += 1
+        dados = _cache_psicologos['dados']
+        if dados is None:
+            return # Nada carregado ainda: a próxima leitura completa já trará o dado novo
+
+        # Nova lista (as listas já entregues às rotas não são alteradas)
+        if psicologo_id in _cache_psicologos['por_id']:
+            dados = [psicologo if p['id'] == psicologo_id else p for p in dados]
+        else:
+            # Insere na posição correta para manter a ordem por ID
+            pos = bisect.bisect_left(dados, psicologo_id, key=lambda p: p['id'])
+            dados = dados[:pos] + [psicologo] + dados[pos:]
+        _cache_psicologos['dados'] = dados
+        _cache_psicologos['por_id'][psicologo_id] = psicologo
+        indexar_psicologo(_cache_psicologos['indice'], psicologo)
+
+def remover_psicologo_do_cache(psicologo_id):
+    """Remove um psicólogo excluído da lista, do índice por ID e do índice de busca."""
+    with _cache_psicologos_lock:
+        _lru_psicologos.pop(psicologo_id, None)
+        _cache_psicologos['versao'] += 1
+        if _cache_psicologos['dados'] is None:
+            return
+        _cache_psicologos['dados'] = [p for p in _cache_psicologos['dados'] if p['id'] != psicologo_id]
+        _cache_psicologos['por_id'].pop(psicologo_id, None)
+        desindexar_psicologo(_cache_psicologos['indice'], psicologo_id)
+
+def _carregar_psicologos_firestore():
+    """Lê a coleção inteira de psicólogos do Firestore, já mapeada."""
+    # Busca todos os documentos na coleção 'psicologos'
+    docs = db.collection('psicologos').stream()
+    return [mapear_psicologo(doc.id, doc.to_dict()) for doc in docs]
+
+def _get_mock_psicologos():
+    """Cópia do MOCK_PSICOLOGOS com o campo 'avatar_filename' esperado pelo template."""
     global MOCK_PSICOLOGOS
     print("Aviso: Carregando psicólogos do MOCK_PSICOLOGOS.")
     # Converte o campo 'fotoURL' do mock para 'avatar_filename' esperado pelo template
@@ -255,9 +984,556 @@ def get_all_psicologos():
     
     return mock_ajustado
 
+def get_diretorio_psicologos():
+    """Retorna (lista de psicólogos, índice de busca) de uma mesma versão do cache.
+
+    Prioriza o cache/Firestore; se o DB falhar ou estiver offline, usa o Mock (com um índice
+    montado na hora, que nunca fica no cache).
+
+    Quando o cache vence, só uma thread relê a coleção, e fora do lock: as outras continuam
+    recebendo a versão anterior (só esperam a carga quando não há nenhuma em memória).
+    """
+    # 1. Tenta usar o cache / buscar do Firestore
+    if db:
+        with _cache_psicologos_lock:
+            if PSICOLOGOS_CACHE_LISTENER:
+                _iniciar_listener_psicologos()
+
+            valido = _cache_psicologos_valido()
+            contar_cache('diretorio', valido)
+            if valido:
+                return list(_cache_psicologos['dados']), _cache_psicologos['indice']
+
+            carregar = not _cache_psicologos['carregando']
+            if carregar:
+                _cache_psicologos['carregando'] = True
+                versao = _cache_psicologos['versao']
+            else:
+                while _cache_psicologos['carregando'] and _cache_psicologos['dados'] is None:
+                    _cache_psicologos_carregado.wait()
+                if _cache_psicologos['dados'] is not None:
+                    return list(_cache_psicologos['dados']), _cache_psicologos['indice']
+
+        if carregar:
+            novo = None
+            try:
+                psicologos_list = _carregar_psicologos_firestore()
+                # Se o Firestore retornou dados, use eles (e guarde no cache).
+                if psicologos_list:
+                    novo = _montar_cache_psicologos(psicologos_list)
+            except Exception as e:
+                print(f"Aviso: Erro ao carregar psicólogos do Firestore: {e}.")
+            finally:
+                with _cache_psicologos_lock:
+                    _cache_psicologos['carregando'] = False
+                    if novo is not None:
+                        # Uma edição do admin durante a carga pode ter ficado de fora: a lista
+                        # é usada, mas a próxima leitura relê a coleção
+                        _instalar_cache_psicologos(novo, atual=_cache_psicologos['versao'] == versao)
+                    _cache_psicologos_carregado.notify_all()
+
+        # Carga que falhou (ou feita por outra thread que falhou): a versão anterior vale mais que o mock
+        with _cache_psicologos_lock:
+            if _cache_psicologos['dados'] is not None:
+                return list(_cache_psicologos['dados']), _cache_psicologos['indice']
+        print("Aviso: Nenhum psicólogo carregado do Firestore. Usando MOCK.")
+
+    # 2. Fallback: Se DB falhou ou está offline, usa o MOCK
+    mock_ajustado = _get_mock_psicologos()
+    return mock_ajustado, construir_indice_busca(mock_ajustado)
+
+# FUNÇÃO UTILITÁRIA CORRIGIDA: PRIORIZA FIREBASE E MAPEIA CAMPOS
+def get_all_psicologos():
+    """Busca a lista de psicólogos do cache/Firestore (prioridade) ou usa o Mock (fallback).
+
+    Os dicionários retornados são compartilhados pelo cache: não devem ser alterados pelas rotas.
+    """
+    return get_diretorio_psicologos()[0]
+
+def _buscar_psicologo_mock(psicologo_id):
+    """Procura o psicólogo no MOCK_PSICOLOGOS (usado quando o DB está indisponível)."""
+    for p in MOCK_PSICOLOGOS:
+        if p['id'] == psicologo_id:
+            p_copy = p.copy()
+            p_copy['avatar_filename'] = p.get('fotoURL', 'default_avatar.jpg')
+            return p_copy
+    return None
+
+def get_psicologo_by_id(psicologo_id):
+    """Busca um único psicólogo pelo ID: índice em memória, LRU ou uma leitura pontual no Firestore.
+
+    Retorna None se o documento não existir. Assim como em get_all_psicologos, o dicionário
+    retornado é compartilhado pelo cache e não deve ser alterado.
+    """
+    if not psicologo_id:
+        return None
+
+    if db:
+        agora = time.monotonic()
+        with _cache_psicologos_lock:
+            # 1. Índice construído junto com a lista completa (sem nenhuma leitura)
+            if _cache_psicologos_valido():
+                psicologo = _cache_psicologos['por_id'].get(psicologo_id)
+                if psicologo:
+                    contar_cache('psicologo', True)
+                    return psicologo
+
+            # 2. LRU de leituras pontuais anteriores
+            entrada = _lru_psicologos.get(psicologo_id)
+            if entrada and agora - entrada[0] <= PSICOLOGOS_CACHE_TTL:
+                _lru_psicologos.move_to_end(psicologo_id)
+                contar_cache('psicologo', True)
+                return entrada[1]
+
+        contar_cache('psicologo', False)
+
+        # 3. Leitura pontual do documento (o ID do documento é o UID do Auth)
+        try:
+            doc = db.collection('psicologos').document(psicologo_id).get()
+            psicologo = mapear_psicologo(doc.id, doc.to_dict()) if doc.exists else None
+        except Exception as e:
+            print(f"Aviso: Erro ao buscar o psicólogo {psicologo_id} no Firestore: {e}. Usando MOCK.")
+        else:
+            with _cache_psicologos_lock:
+                _lru_psicologos[psicologo_id] = (agora, psicologo)
+                _lru_psicologos.move_to_end(psicologo_id)
+                while len(_lru_psicologos) > PSICOLOGOS_LRU_MAX:
+                    _lru_psicologos.popitem(last=False)
+            return psicologo
+
+    # Fallback: DB offline ou com erro
+    return _buscar_psicologo_mock(psicologo_id)
+
+# ==========================================================
+# 4.2 ÍNDICE DE BUSCA DO DIRETÓRIO (TAGS, GÊNERO E BIO)
+# ==========================================================
+
+def normalizar_texto(texto):
+    """Converte para minúsculas e remove acentos ('Depressão' -> 'depressao')."""
+    if not texto:
+        return ''
+    decomposto = unicodedata.normalize('NFKD', str(texto))
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).lower()
+
+def tokenizar(texto):
+    """Divide o texto normalizado em palavras (letras e números)."""
+    return re.findall(r'[a-z0-9]+', normalizar_texto(texto))
+
+def construir_indice_busca(psicologos):
+    """Monta o índice invertido usado pelos filtros de psicologos_list."""
+    indice = {
+        'tags': {},     # termo -> set(ids) a partir de 'tags' (especialidades)
+        'bio': {},      # termo -> set(ids) a partir de 'descricaoCurta' (bio)
+        'genero': {},   # gênero -> set(ids)
+        'ordenados': {'tags': [], 'bio': []}, # termos em ordem, para busca por prefixo
+        'chaves': {},   # id -> chaves indexadas, para atualização incremental
+        'vetores': None, # Matriz da triagem (seção 4.13), montada no primeiro uso
+        'bm25': None,   # Busca livre, montada na primeira consulta
+    }
+    for psicologo in psicologos:
+        indexar_psicologo(indice, psicologo)
+    return indice
+
+def _adicionar_termos(indice, campo, termos, psicologo_id):
+    postings = indice[campo]
+    for termo in termos:
+        if termo not in postings:
+            postings[termo] = set()
+            bisect.insort(indice['ordenados'][campo], termo)
+        postings[termo].add(psicologo_id)
+
+def _remover_termos(indice, campo, termos, psicologo_id):
+    postings = indice[campo]
+    for termo in termos:
+        ids = postings.get(termo)
+        if ids is None:
+            continue
+        ids.discard(psicologo_id)
+        if not ids:
+            del postings[termo]
+            ordenados = indice['ordenados'][campo]
+            del ordenados[bisect.bisect_left(ordenados, termo)]
+
+def indexar_psicologo(indice, psicologo):
+    """Adiciona (ou atualiza) um psicólogo no índice de busca."""
+    if indice is None:
+        return
+    psicologo_id = psicologo['id']
+    desindexar_psicologo(indice, psicologo_id)
+
+    termos_tags = set()
+    for tag in psicologo.get('tags') or []:
+        termos_tags.update(tokenizar(tag))
+    termos_bio = set(tokenizar(psicologo.get('descricaoCurta')))
+    genero = psicologo.get('genero')
+
+    _adicionar_termos(indice, 'tags', termos_tags, psicologo_id)
+    _adicionar_termos(indice, 'bio', termos_bio, psicologo_id)
+    indice['genero'].setdefault(genero, set()).add(psicologo_id)
+    indice['chaves'][psicologo_id] = (termos_tags, termos_bio, genero)
+    _atualizar_vetor_triagem(indice, psicologo)
+    _indexar_bm25(indice, psicologo)
+
+def desindexar_psicologo(indice, psicologo_id):
+    """Remove um psicólogo do índice de busca (se estiver indexado)."""
+    if indice is None:
+        return
+    chaves = indice['chaves'].pop(psicologo_id, None)
+    if chaves is None:
+        return
+    _remover_vetor_triagem(indice, psicologo_id)
+    _desindexar_bm25(indice, psicologo_id)
+    termos_tags, termos_bio, genero = chaves
+    _remover_termos(indice, 'tags', termos_tags, psicologo_id)
+    _remover_termos(indice, 'bio', termos_bio, psicologo_id)
+    ids_genero = indice['genero'].get(genero)
+    if ids_genero is not None:
+        ids_genero.discard(psicologo_id)
+        if not ids_genero:
+            del indice['genero'][genero]
+
+def _ids_por_prefixo(indice, campo, prefixo):
+    """Ids cujos termos começam com o prefixo (equivale ao antigo 'foco in tag')."""
+    ordenados = indice['ordenados'][campo]
+    ids = set()
+    pos = bisect.bisect_left(ordenados, prefixo)
+    while pos < len(ordenados) and ordenados[pos].startswith(prefixo):
+        ids |= indice[campo][ordenados[pos]]
+        pos += 1
+    return ids
+
+def buscar_ids_psicologos(indice, genero=None, foco=None, linha=None):
+    """Aplica os filtros como interseções de conjuntos. Retorna None se nenhum filtro foi usado."""
+    # O lock impede leituras do índice no meio de uma atualização incremental
+    with _cache_psicologos_lock:
+        return _buscar_ids_psicologos(indice, genero, foco, linha)
+
+def _buscar_ids_psicologos(indice, genero, foco, linha):
+    resultado = None
+
+    def intersectar(atual, ids):
+        return ids if atual is None else atual & ids
+
+    if genero and genero != "Indiferente":
+        resultado = intersectar(resultado, indice['genero'].get(genero, set()))
+
+    # Foco: cada palavra precisa aparecer nas tags ou na bio
+    for termo in tokenizar(foco):
+        resultado = intersectar(resultado, _ids_por_prefixo(indice, 'tags', termo) |
+                                           _ids_por_prefixo(indice, 'bio', termo))
+
+    # Linha teórica: cada palavra precisa aparecer nas tags
+    for termo in tokenizar(linha):
+        resultado = intersectar(resultado, _ids_por_prefixo(indice, 'tags', termo))
+
+    return resultado
+
+# Busca livre ('q' em psicologos_list): BM25 sobre especialidades, bio e nome, com os termos
+# sem acento, sem stopwords e reduzidos ao radical ('depressão', 'depressivos' -> 'depress').
+# Montada na primeira busca e atualizada junto com o restante do índice (indexar_psicologo).
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25_PESO_ESPECIALIDADES = 2 # Cada termo das especialidades conta como duas ocorrências
+
+STOPWORDS_PT = frozenset('''
+    a ao aos as ate com como da das de dela delas dele deles depois do dos e ela elas ele eles em entre era
+    essa essas esse esses esta estao estas estava este estes eu foi ha isso isto ja lhe lhes mais mas me
+    mesmo meu meus minha minhas muito na nas nao nem no nos nossa nossas nosso nossos num numa o os ou para
+    pela pelas pelo pelos por qual quando que quem se sem ser seu seus so sua suas tambem te tem ter teu
+    teus tu tua tuas um uma umas uns voce voces
+'''.split())
+
+# Redução de plural e sufixos (texto já sem acentos), do mais longo para o mais curto
+_PLURAIS = (('oes', 'ao'), ('aes', 'ao'), ('ais', 'al'), ('eis', 'el'), ('ois', 'ol'), ('ns', 'm'))
+_SUFIXOS = ('izacoes', 'izacao', 'amentos', 'imentos', 'amento', 'imento', 'idades', 'idade', 'mente',
+            'edades', 'edade', 'acoes', 'icoes', 'acao', 'icao', 'ucao', 'ismo', 'ista', 'avel', 'ivel', 'ante', 'ente',
+            'ador', 'edor', 'idor', 'ado', 'ido', 'oso', 'osa', 'ivo', 'iva', 'ico', 'ica',
+            'al', 'ao', 'ia', 'io', 'a', 'e', 'o')
+
+@lru_cache(maxsize=50000) # O vocabulário se repete muito entre as bios
+def radical(termo):
+    """Radical de um termo normalizado (stemmer leve para português)."""
+    if len(termo) <= 3:
+        return termo
+    for sufixo, troca in _PLURAIS:
+        if termo.endswith(sufixo):
+            termo = termo[:-len(sufixo)] + troca
+            break
+    else:
+        if termo.endswith('s') and not termo.endswith(('ss', 'us', 'is')):
+            termo = termo[:-1]
+    for sufixo in _SUFIXOS:
+        if termo.endswith(sufixo) and len(termo) - len(sufixo) >= 3:
+            return termo[:-len(sufixo)]
+    return termo
+
+def termos_bm25(texto):
+    """Radicais do texto, sem stopwords, na ordem em que aparecem (com repetições)."""
+    return [radical(termo) for termo in tokenizar(texto) if termo not in STOPWORDS_PT]
+
+def _documento_bm25(psicologo):
+    """Frequência de cada radical no 'documento' do psicólogo."""
+    frequencias = {}
+    termos = termos_bm25(psicologo.get('descricaoCurta')) + termos_bm25(psicologo.get('nome'))
+    for tag in psicologo.get('tags') or []:
+        termos += termos_bm25(tag) * BM25_PESO_ESPECIALIDADES
+    for termo in termos:
+        frequencias[termo] = frequencias.get(termo, 0) + 1
+    return frequencias
+
+def _montar_bm25(indice, psicologos):
+    """Índice BM25 inicial (chamar com o lock do cache)."""
+    indice['bm25'] = {'postings': {}, 'documentos': {}, 'tamanhos': {}, 'soma_tamanhos': 0}
+    for psicologo in psicologos:
+        if psicologo['id'] in indice['chaves']:
+            _indexar_bm25(indice, psicologo)
+    return indice['bm25']
+
+def _indexar_bm25(indice, psicologo):
+    bm25 = indice.get('bm25')
+    if bm25 is None:
+        return
+    frequencias = _documento_bm25(psicologo)
+    for termo, frequencia in frequencias.items():
+        bm25['postings'].setdefault(termo, {})[psicologo['id']] = frequencia
+    bm25['documentos'][psicologo['id']] = frequencias
+    bm25['tamanhos'][psicologo['id']] = sum(frequencias.values())
+    bm25['soma_tamanhos'] += bm25['tamanhos'][psicologo['id']]
+
+def _desindexar_bm25(indice, psicologo_id):
+    bm25 = indice.get('bm25')
+    if bm25 is None:
+        return
+    frequencias = bm25['documentos'].pop(psicologo_id, None)
+    if frequencias is None:
+        return
+    for termo in frequencias:
+        postings = bm25['postings'][termo]
+        del postings[psicologo_id]
+        if not postings:
+            del bm25['postings'][termo]
+    bm25['soma_tamanhos'] -= bm25['tamanhos'].pop(psicologo_id)
+
+def buscar_bm25(indice, psicologos, consulta):
+    """IDs que contêm algum termo da consulta, do mais para o menos relevante (empate: ID)."""
+    termos = set(termos_bm25(consulta))
+    with _cache_psicologos_lock:
+        bm25 = indice.get('bm25') or _montar_bm25(indice, psicologos)
+        total = len(bm25['documentos'])
+        if not termos or not total:
+            return []
+        tamanho_medio = bm25['soma_tamanhos'] / total
+        pontos = {}
+        for termo in termos:
+            postings = bm25['postings'].get(termo)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for psicologo_id, frequencia in postings.items():
+                normalizacao = BM25_K1 * (1 - BM25_B + BM25_B * bm25['tamanhos'][psicologo_id] / tamanho_medio)
+                pontos[psicologo_id] = pontos.get(psicologo_id, 0.0) + \
+                    idf * frequencia * (BM25_K1 + 1) / (frequencia + normalizacao)
+    return sorted(pontos, key=lambda psicologo_id: (-pontos[psicologo_id], psicologo_id))
+
+# ==========================================================
+# 4.3 PAGINAÇÃO DO DIRETÓRIO (CURSOR = ID DO ÚLTIMO PSICÓLOGO DA PÁGINA)
+# ==========================================================
+
+PSICOLOGOS_POR_PAGINA = int(os.environ.get('PSICOLOGOS_POR_PAGINA', '12'))
+PSICOLOGOS_POR_PAGINA_MAX = 50
+
+def ler_parametros_paginacao():
+    """Lê 'apos' (cursor) e 'limite' da query string, limitando o tamanho da página."""
+    apos = request.args.get('apos') or None
+    try:
+        limite = int(request.args.get('limite', PSICOLOGOS_POR_PAGINA))
+    except ValueError:
+        limite = PSICOLOGOS_POR_PAGINA
+    return apos, max(1, min(limite, PSICOLOGOS_POR_PAGINA_MAX))
+
+def fatiar_pagina(psicologos, apos, limite):
+    """Pagina uma lista ordenada por ID. Retorna (página, cursor da próxima página ou None)."""
+    inicio = bisect.bisect_right(psicologos, apos, key=lambda p: p['id']) if apos else 0
+    pagina = psicologos[inicio:inicio + limite]
+    tem_mais = inicio + limite < len(psicologos)
+    return pagina, (pagina[-1]['id'] if tem_mais and pagina else None)
+
+def fatiar_pagina_ranqueada(psicologos, apos, limite):
+    """Como fatiar_pagina, para listas em ordem de relevância (o cursor é procurado na lista)."""
+    inicio = next((pos + 1 for pos, p in enumerate(psicologos) if p['id'] == apos), 0) if apos else 0
+    pagina = psicologos[inicio:inicio + limite]
+    tem_mais = inicio + limite < len(psicologos)
+    return pagina, (pagina[-1]['id'] if tem_mais and pagina else None)
+
+def get_pagina_psicologos(apos=None, limite=PSICOLOGOS_POR_PAGINA):
+    """Busca uma página do diretório, em ordem de ID do documento.
+
+    Com o cache válido a página sai da memória; senão vira uma consulta
+    order_by('__name__') + start_after + limit que lê apenas limite + 1 documentos.
+    """
+    if db:
+        with _cache_psicologos_lock:
+            valido = _cache_psicologos_valido()
+            contar_cache('diretorio', valido)
+            if valido:
+                return fatiar_pagina(_cache_psicologos['dados'], apos, limite)
+
+        try:
+            query = db.collection('psicologos').order_by('__name__')
+            if apos:
+                query = query.start_after({'__name__': apos})
+            # Um documento a mais só para saber se existe próxima página
+            docs = list(query.limit(limite + 1).stream())
+            pagina = [mapear_psicologo(doc.id, doc.to_dict()) for doc in docs[:limite]]
+
+            if pagina or apos:
+                return pagina, (pagina[-1]['id'] if len(docs) > limite else None)
+
+        except Exception as e:
+            print(f"Aviso: Erro ao paginar psicólogos no Firestore: {e}. Usando MOCK.")
+
+    # Fallback: coleção vazia, DB offline ou com erro
+    return fatiar_pagina(_get_mock_psicologos(), apos, limite)
+
+def contar_psicologos():
+    """Total de psicólogos cadastrados: tamanho do cache ou uma agregação count() no Firestore."""
+    if db:
+        with _cache_psicologos_lock:
+            if _cache_psicologos_valido():
+                return len(_cache_psicologos['dados'])
+        try:
+            resultado = db.collection('psicologos').count(alias='total').get()
+            return resultado[0][0].value
+        except Exception as e:
+            app.logger.warning(f"Não foi possível contar os psicólogos: {e}")
+    return None
+
+# ==========================================================
+# 4.4 PROCESSAMENTO DE AVATARES (MINIATURAS WEBP/JPEG)
+# ==========================================================
+
+_executor_imagens = None
+_executor_imagens_lock = threading.Lock()
+# nome do avatar -> (miniaturas prontas?, time.monotonic() da verificação)
+_miniaturas_status = {}
+MINIATURAS_RECHECAGEM = 60 # segundos até verificar de novo um avatar ainda sem miniaturas
+
+def _get_executor_imagens():
+    """Pool de threads (criado no primeiro upload) que gera as miniaturas fora da requisição."""
+    global _executor_imagens
+    with _executor_imagens_lock:
+        if _executor_imagens is None:
+            _executor_imagens = ThreadPoolExecutor(
+                max_workers=int(os.environ.get('AVATAR_WORKERS', '2')),
+                thread_name_prefix='avatar'
+            )
+        return _executor_imagens
+
+def nome_miniatura_avatar(avatar_filename, tamanho, formato):
+    """Nome do arquivo da miniatura (ex: 'abc_foto_224.webp')."""
+    base = os.path.splitext(avatar_filename)[0]
+    return f"{base}_{tamanho}.{formato}"
+
+def gerar_miniaturas_avatar(avatar_filename):
+    """Decodifica o upload, remove metadados e grava as miniaturas quadradas em WebP e JPEG."""
+    # Importação adiada: só o processo que recebe uploads paga o custo do Pillow
+    from PIL import Image, ImageOps
+
+    origem = os.path.join(UPLOAD_FOLDER, avatar_filename)
+    os.makedirs(AVATAR_MINIATURAS_FOLDER, exist_ok=True)
+
+    with Image.open(origem) as imagem:
+        # Aplica a rotação do EXIF antes de descartá-lo; RGB porque JPEG não tem transparência
+        imagem = ImageOps.exif_transpose(imagem).convert('RGB')
+
+        # WebP por último: o WebP do maior tamanho marca o conjunto como pronto
+        for formato, opcoes in (('jpg', {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True}),
+                                ('webp', {'format': 'WEBP', 'quality': 80, 'method': 6})):
+            for tamanho in AVATAR_TAMANHOS:
+                miniatura = ImageOps.fit(imagem, (tamanho, tamanho), Image.LANCZOS)
+                destino = os.path.join(AVATAR_MINIATURAS_FOLDER, nome_miniatura_avatar(avatar_filename, tamanho, formato))
+                # Grava em arquivo temporário e renomeia, para nunca servir um arquivo pela metade
+                temporario = f"{destino}.tmp"
+                miniatura.save(temporario, **opcoes)
+                os.replace(temporario, destino)
+
+    _miniaturas_status[avatar_filename] = (True, time.monotonic())
+
+def _gerar_miniaturas_com_log(avatar_filename):
+    try:
+        gerar_miniaturas_avatar(avatar_filename)
+    except Exception as e:
+        app.logger.warning(f"Falha ao gerar miniaturas do avatar {avatar_filename}: {e}")
+
+def agendar_miniaturas_avatar(avatar_filename):
+    """Envia a geração das miniaturas para o pool, sem bloquear a requisição do admin."""
+    _miniaturas_status.pop(avatar_filename, None)
+    _get_executor_imagens().submit(_gerar_miniaturas_com_log, avatar_filename)
+
+def miniaturas_avatar_prontas(avatar_filename):
+    """Indica se as miniaturas existem (resultado guardado em memória para não consultar o disco a cada card)."""
+    pronto, verificado_em = _miniaturas_status.get(avatar_filename, (False, None))
+    if pronto:
+        return True
+    if verificado_em is not None and time.monotonic() - verificado_em < MINIATURAS_RECHECAGEM:
+        return False
+
+    marcador = os.path.join(AVATAR_MINIATURAS_FOLDER,
+                            nome_miniatura_avatar(avatar_filename, AVATAR_TAMANHOS[-1], 'webp'))
+    pronto = os.path.exists(marcador)
+    _miniaturas_status[avatar_filename] = (pronto, time.monotonic())
+    return pronto
+
+def remover_miniaturas_avatar(avatar_filename):
+    """Apaga as miniaturas de um avatar excluído (melhor esforço)."""
+    _miniaturas_status.pop(avatar_filename, None)
+    for formato in ('jpg', 'webp'):
+        for tamanho in AVATAR_TAMANHOS:
+            caminho = os.path.join(AVATAR_MINIATURAS_FOLDER, nome_miniatura_avatar(avatar_filename, tamanho, formato))
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                app.logger.warning(f"Não foi possível remover a miniatura {caminho}: {e}")
+
+def urls_miniaturas_avatar(avatar_filename):
+    """Campos 'avatar', 'avatar_srcset' e 'avatar_srcset_webp' para o template, ou None se não houver miniaturas."""
+    if not miniaturas_avatar_prontas(avatar_filename):
+        return None
+
+    pasta = AVATAR_MINIATURAS_FOLDER.replace("static/", "") # 'img/avatares/miniaturas'
+    densidades = ('1x', '2x', '4x')
+
+    def srcset(formato):
+        return ', '.join(
+            f"{url_for('static', filename=f'{pasta}/{nome_miniatura_avatar(avatar_filename, tamanho, formato)}')} {densidade}"
+            for tamanho, densidade in zip(AVATAR_TAMANHOS, densidades)
+        )
+
+    return {
+        'avatar': url_for('static', filename=f'{pasta}/{nome_miniatura_avatar(avatar_filename, AVATAR_TAMANHOS[0], "jpg")}'),
+        'avatar_srcset': srcset('jpg'),
+        'avatar_srcset_webp': srcset('webp'),
+    }
+
+@app.cli.command('gerar-miniaturas-avatares')
+def gerar_miniaturas_avatares_existentes():
+    """Gera as miniaturas dos avatares enviados antes do pipeline (flask gerar-miniaturas-avatares)."""
+    gerados = 0
+    for avatar_filename in sorted(os.listdir(UPLOAD_FOLDER)):
+        if not allowed_file(avatar_filename) or miniaturas_avatar_prontas(avatar_filename):
+            continue
+        try:
+            gerar_miniaturas_avatar(avatar_filename)
+            gerados += 1
+        except Exception as e:
+            print(f"Aviso: não foi possível processar {avatar_filename}: {e}")
+    print(f"✅ Miniaturas geradas para {gerados} avatares.")
+
 # 🚨 FUNÇÃO CORRIGIDA: Adiciona o URL do avatar ao template, considerando o caminho de upload
 def process_psicologos_for_template(psicologos_list):
-    """Adiciona o campo 'avatar' usando url_for, tratando o caminho do upload."""
+    """Adiciona o campo 'avatar' (e o srcset das miniaturas, se prontas) usando url_for, tratando o caminho do upload."""
     processed_list = []
     for psi in psicologos_list:
         psi_com_url = psi.copy() 
@@ -269,14 +1545,1324 @@ def process_psicologos_for_template(psicologos_list):
             # Arquivo de mock default está em 'static/img/default_avatar.jpg'
             psi_com_url['avatar'] = url_for('static', filename='img/default_avatar.jpg')
         else:
-            # Arquivos próprios estão dentro de 'static/img/avatares/nome_unico.jpg'
-            # UPLOAD_FOLDER é 'static/img/avatares'
-            upload_dir_name = UPLOAD_FOLDER.replace("static/", "") # 'img/avatares'
-            psi_com_url['avatar'] = url_for('static', filename=f'{upload_dir_name}/{avatar_filename}')
+            miniaturas = urls_miniaturas_avatar(avatar_filename)
+            if miniaturas:
+                # Miniaturas prontas: JPEG de 112 px como 'src' e variantes 1x/2x/4x (WebP e JPEG) no srcset
+                psi_com_url.update(miniaturas)
+            else:
+                # Arquivos próprios estão dentro de 'static/img/avatares/nome_unico.jpg'
+                # UPLOAD_FOLDER é 'static/img/avatares'
+                upload_dir_name = UPLOAD_FOLDER.replace("static/", "") # 'img/avatares'
+                psi_com_url['avatar'] = url_for('static', filename=f'{upload_dir_name}/{avatar_filename}')
             
         processed_list.append(psi_com_url)
     return processed_list
 
+# ==========================================================
+# 4.5 ARQUIVOS ESTÁTICOS (HASH NO NOME, CACHE IMUTÁVEL E PRÉ-COMPRESSÃO)
+# ==========================================================
+
+# url_for('static', filename='css/style.css') gera '/static/css/style.<hash>.css'. Como o nome muda
+# junto com o conteúdo, a resposta pode ser guardada pelo navegador por um ano sem revalidação.
+ESTATICOS_MANIFESTO = os.path.join(app.static_folder, 'manifest.json')
+ESTATICOS_MAX_AGE_IMUTAVEL = 31536000 # 1 ano
+ESTATICOS_COMPRIMIVEIS = ('.css', '.js', '.svg', '.json', '.txt')
+ESTATICOS_HASH_TAMANHO = 10
+# Pasta (relativa a 'static') -> larguras geradas por 'flask gerar-estaticos' em '<pasta>/redimensionadas'
+IMAGENS_REDIMENSIONADAS = {
+    'img/livros': (400, 800), # cards da home têm ~360 px de largura (1x e 2x)
+}
+_RE_ESTATICO_COM_HASH = re.compile(r'^(.+)\.([0-9a-f]{%d})(\.[^./]+)$' % ESTATICOS_HASH_TAMANHO)
+_CODIFICACOES_ESTATICOS = (('br', 'br'), ('gzip', 'gz')) # (Content-Encoding, extensão), em ordem de preferência
+
+# filename -> (mtime_ns, tamanho, hash); o manifesto evita ler arquivos grandes só para calcular o hash
+_hashes_estaticos = {}
+_variantes_imagens = {}
+_manifesto_estaticos = None
+_estaticos_lock = threading.Lock()
+
+def _carregar_manifesto_estaticos():
+    """Lê (uma vez) o manifesto gerado por 'flask gerar-estaticos'; sem manifesto, os hashes são calculados sob demanda."""
+    global _manifesto_estaticos
+    if _manifesto_estaticos is None:
+        try:
+            with open(ESTATICOS_MANIFESTO, encoding='utf-8') as f:
+                _manifesto_estaticos = json.load(f).get('arquivos', {})
+        except (OSError, ValueError):
+            _manifesto_estaticos = {}
+    return _manifesto_estaticos
+
+def _calcular_hash_arquivo(caminho):
+    sha = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(65536), b''):
+            sha.update(bloco)
+    return sha.hexdigest()[:ESTATICOS_HASH_TAMANHO]
+
+def hash_estatico(filename):
+    """Hash do conteúdo atual de 'static/<filename>', ou None se o arquivo não existir.
+
+    Em produção o resultado fica em memória pelo tempo de vida do processo (um deploy novo reinicia os
+    workers); em debug o mtime é conferido a cada chamada para refletir edições no CSS.
+    """
+    registro = _hashes_estaticos.get(filename)
+    if registro is not None and not app.debug:
+        return registro[2]
+
+    caminho = safe_join(app.static_folder, filename)
+    try:
+        info = os.stat(caminho) if caminho else None
+    except OSError:
+        info = None
+    if info is None:
+        # Não guarda a ausência: miniaturas de avatar aparecem depois do upload
+        return None
+
+    if registro is not None and registro[:2] == (info.st_mtime_ns, info.st_size):
+        return registro[2]
+
+    entrada = _carregar_manifesto_estaticos().get(filename)
+    if entrada and (entrada.get('mtime_ns'), entrada.get('tamanho')) == (info.st_mtime_ns, info.st_size):
+        valor = entrada['hash']
+    else:
+        valor = _calcular_hash_arquivo(caminho)
+
+    with _estaticos_lock:
+        _hashes_estaticos[filename] = (info.st_mtime_ns, info.st_size, valor)
+    return valor
+
+def nome_versionado_estatico(filename):
+    """'css/style.css' -> 'css/style.<hash>.css' (ou o próprio nome se o arquivo não existir)."""
+    valor = hash_estatico(filename)
+    if not valor:
+        return filename
+    base, extensao = os.path.splitext(filename)
+    return f"{base}.{valor}{extensao}"
+
+@app.url_defaults
+def versionar_url_estatico(endpoint, values):
+    """Aplica o hash do conteúdo a todo url_for('static', ...), inclusive nos templates."""
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = nome_versionado_estatico(values['filename'])
+
+def _variante_comprimida(filename, hash_atual):
+    """Escolhe a variante pré-comprimida (.br/.gz) aceita pelo cliente, desde que gerada a partir do conteúdo atual."""
+    entrada = _carregar_manifesto_estaticos().get(filename)
+    if not entrada or entrada.get('hash') != hash_atual:
+        return None, None
+    for codificacao, extensao in _CODIFICACOES_ESTATICOS:
+        if extensao in entrada.get('comprimidos', ()) and codificacao in request.accept_encodings:
+            return codificacao, f"{filename}.{extensao}"
+    return None, None
+
+def servir_estatico(filename):
+    """Substitui a view 'static' do Flask: remove o hash do nome, negocia a compressão e define o cache."""
+    hash_pedido = None
+    partes = _RE_ESTATICO_COM_HASH.match(filename)
+    if partes:
+        caminho = safe_join(app.static_folder, filename)
+        if not caminho or not os.path.isfile(caminho):
+            filename, hash_pedido = partes.group(1) + partes.group(3), partes.group(2)
+
+    hash_atual = hash_estatico(filename)
+    # Hash antigo (HTML em cache de uma versão anterior) recebe o conteúdo atual, mas sem cache longo
+    imutavel = hash_pedido is not None and hash_pedido == hash_atual
+    max_age = ESTATICOS_MAX_AGE_IMUTAVEL if imutavel else (0 if hash_pedido else None)
+
+    codificacao, arquivo = _variante_comprimida(filename, hash_atual) if hash_atual else (None, None)
+    if codificacao:
+        resposta = send_from_directory(app.static_folder, arquivo, max_age=max_age,
+                                       mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        resposta.headers['Content-Encoding'] = codificacao
+    else:
+        resposta = send_from_directory(app.static_folder, filename, max_age=max_age)
+
+    if filename.endswith(ESTATICOS_COMPRIMIVEIS):
+        resposta.vary.add('Accept-Encoding')
+    if imutavel:
+        resposta.cache_control.public = True
+        resposta.cache_control.immutable = True
+    return resposta
+
+app.view_functions['static'] = servir_estatico
+
+def nome_imagem_redimensionada(filename, largura, formato):
+    """'img/livros/capa.png' -> 'img/livros/redimensionadas/capa_400.webp'."""
+    pasta, nome = os.path.split(filename)
+    return f"{pasta}/redimensionadas/{os.path.splitext(nome)[0]}_{largura}.{formato}"
+
+@app.template_global()
+def imagem_responsiva(filename):
+    """Campos 'src', 'srcset' e 'srcset_webp' de uma imagem estática, usando as versões redimensionadas se existirem."""
+    larguras = IMAGENS_REDIMENSIONADAS.get(os.path.dirname(filename), ())
+    prontas = _variantes_imagens.get(filename)
+    if prontas is None or app.debug:
+        prontas = bool(larguras) and all(
+            os.path.exists(os.path.join(app.static_folder, nome_imagem_redimensionada(filename, largura, formato)))
+            for largura in larguras for formato in ('jpg', 'webp')
+        )
+        _variantes_imagens[filename] = prontas
+
+    if not prontas:
+        return {'src': url_for('static', filename=filename), 'srcset': None, 'srcset_webp': None}
+
+    def srcset(formato):
+        return ', '.join(
+            f"{url_for('static', filename=nome_imagem_redimensionada(filename, largura, formato))} {largura}w"
+            for largura in larguras
+        )
+
+    return {
+        'src': url_for('static', filename=nome_imagem_redimensionada(filename, larguras[0], 'jpg')),
+        'srcset': srcset('jpg'),
+        'srcset_webp': srcset('webp'),
+    }
+
+def _gerar_imagens_redimensionadas(pasta, larguras):
+    """Grava as versões WebP/JPEG em cada largura (mantendo a proporção) das imagens de 'static/<pasta>'."""
+    from PIL import Image, ImageOps
+
+    origem_dir = os.path.join(app.static_folder, pasta)
+    destino_dir = os.path.join(origem_dir, 'redimensionadas')
+    os.makedirs(destino_dir, exist_ok=True)
+    geradas = 0
+    for nome in sorted(os.listdir(origem_dir)):
+        if not allowed_file(nome):
+            continue
+        filename = f"{pasta}/{nome}"
+        with Image.open(os.path.join(origem_dir, nome)) as imagem:
+            imagem = ImageOps.exif_transpose(imagem).convert('RGB')
+            for largura in larguras:
+                altura = round(imagem.height * largura / imagem.width)
+                redimensionada = imagem.resize((largura, altura), Image.LANCZOS)
+                for formato, opcoes in (('jpg', {'format': 'JPEG', 'quality': 80, 'optimize': True, 'progressive': True}),
+                                        ('webp', {'format': 'WEBP', 'quality': 78, 'method': 6})):
+                    destino = os.path.join(app.static_folder, nome_imagem_redimensionada(filename, largura, formato))
+                    temporario = f"{destino}.tmp"
+                    redimensionada.save(temporario, **opcoes)
+                    os.replace(temporario, destino)
+                    geradas += 1
+    return geradas
+
+def _gravar_comprimido(caminho, conteudo, extensao, comprimir):
+    """Grava '<caminho>.<extensao>' se a compressão compensar; devolve se o arquivo foi mantido."""
+    comprimido = comprimir(conteudo)
+    destino = f"{caminho}.{extensao}"
+    if len(comprimido) >= len(conteudo):
+        if os.path.exists(destino):
+            os.remove(destino)
+        return False
+    with open(f"{destino}.tmp", 'wb') as f:
+        f.write(comprimido)
+    os.replace(f"{destino}.tmp", destino)
+    return True
+
+@app.cli.command('gerar-estaticos')
+def gerar_estaticos():
+    """Redimensiona as imagens, pré-comprime CSS/JS e grava o manifesto de hashes (flask gerar-estaticos)."""
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+        print("Aviso: módulo 'brotli' não instalado; serão geradas apenas as variantes .gz.")
+
+    for pasta, larguras in IMAGENS_REDIMENSIONADAS.items():
+        print(f"🖼️ {_gerar_imagens_redimensionadas(pasta, larguras)} imagens redimensionadas em {pasta}.")
+
+    arquivos = {}
+    for raiz, _, nomes in os.walk(app.static_folder):
+        for nome in sorted(nomes):
+            caminho = os.path.join(raiz, nome)
+            filename = os.path.relpath(caminho, app.static_folder).replace(os.sep, '/')
+            if filename == 'manifest.json' or nome.endswith(('.gz', '.br', '.tmp')):
+                continue
+
+            entrada = {'hash': _calcular_hash_arquivo(caminho), 'comprimidos': []}
+            if nome.endswith(ESTATICOS_COMPRIMIVEIS):
+                with open(caminho, 'rb') as f:
+                    conteudo = f.read()
+                # mtime=0 deixa o .gz idêntico entre builds do mesmo conteúdo
+                if _gravar_comprimido(caminho, conteudo, 'gz', lambda dados: gzip.compress(dados, 9, mtime=0)):
+                    entrada['comprimidos'].append('gz')
+                if brotli and _gravar_comprimido(caminho, conteudo, 'br', lambda dados: brotli.compress(dados, quality=11)):
+                    entrada['comprimidos'].append('br')
+
+            # Lidos depois de gravar as variantes, para o servidor reconhecer o arquivo sem recalcular o hash
+            info = os.stat(caminho)
+            entrada.update({'mtime_ns': info.st_mtime_ns, 'tamanho': info.st_size})
+            arquivos[filename] = entrada
+
+    with open(f"{ESTATICOS_MANIFESTO}.tmp", 'w', encoding='utf-8') as f:
+        json.dump({'gerado_em': datetime.now().isoformat(), 'arquivos': arquivos}, f, indent=1, sort_keys=True)
+    os.replace(f"{ESTATICOS_MANIFESTO}.tmp", ESTATICOS_MANIFESTO)
+    print(f"✅ Manifesto com {len(arquivos)} arquivos gravado em {ESTATICOS_MANIFESTO}.")
+
+# ==========================================================
+# 4.6 CACHE DE PÁGINAS RENDERIZADAS (VISITANTES ANÔNIMOS)
+# ==========================================================
+
+# HTML pronto das páginas públicas, por rota + parâmetros + versão do diretório (seção 4.1).
+# As rotas do admin mudam a versão, então uma edição tira as páginas antigas de uso na hora
+# (nos outros workers do gunicorn vale o TTL, como no cache do diretório).
+PAGINAS_CACHE_MAX_BYTES = int(os.environ.get('PAGINAS_CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+PAGINAS_CACHE_TTL = float(os.environ.get('PAGINAS_CACHE_TTL', str(PSICOLOGOS_CACHE_TTL)))
+# Chaves de sessão que mudam o HTML (menu do base.html, mensagens flash, filtros da triagem):
+# quem tem alguma delas recebe a página renderizada normalmente.
+SESSAO_CHAVES_PERSONALIZADAS = ('user_role', '_flashes', 'triagem_filtros')
+
+_cache_paginas = OrderedDict() # (endpoint, parâmetros, versão) -> (time.monotonic(), html em bytes)
+_cache_paginas_estado = {'bytes': 0, 'versao': None}
+_cache_paginas_lock = threading.Lock()
+
+def _marcar_flash_na_requisicao(sender, message, category, **extra):
+    g.pagina_com_flash = True
+
+message_flashed.connect(_marcar_flash_na_requisicao, app)
+
+def _ler_pagina_cache(chave):
+    with _cache_paginas_lock:
+        entrada = _cache_paginas.get(chave)
+        if entrada is None:
+            return None
+        if time.monotonic() - entrada[0] > PAGINAS_CACHE_TTL:
+            _cache_paginas.pop(chave)
+            _cache_paginas_estado['bytes'] -= len(entrada[1])
+            return None
+        _cache_paginas.move_to_end(chave)
+        return entrada[1]
+
+def _salvar_pagina_cache(chave, html):
+    if len(html) > PAGINAS_CACHE_MAX_BYTES // 4:
+        return # Uma página enorme expulsaria todo o resto
+    with _cache_paginas_lock:
+        versao = chave[-1]
+        if _cache_paginas_estado['versao'] != versao:
+            # Diretório mudou: as páginas das versões anteriores nunca mais serão lidas
+            _cache_paginas.clear()
+            _cache_paginas_estado.update({'bytes': 0, 'versao': versao})
+
+        anterior = _cache_paginas.pop(chave, None)
+        if anterior is not None:
+            _cache_paginas_estado['bytes'] -= len(anterior[1])
+        _cache_paginas[chave] = (time.monotonic(), html)
+        _cache_paginas_estado['bytes'] += len(html)
+
+        # LRU limitado em bytes: remove as páginas menos usadas até caber
+        while _cache_paginas_estado['bytes'] > PAGINAS_CACHE_MAX_BYTES:
+            _, (_, removida) = _cache_paginas.popitem(last=False)
+            _cache_paginas_estado['bytes'] -= len(removida)
+
+def _pagina_pode_usar_cache():
+    """Só GET anônimo, sem flash pendente e fora do modo debug (que recarrega os templates)."""
+    if request.method != 'GET' or app.debug or PAGINAS_CACHE_MAX_BYTES <= 0:
+        return False
+    return not any(chave in session for chave in SESSAO_CHAVES_PERSONALIZADAS)
+
+def cache_de_pagina(*parametros):
+    """Decorator: serve da memória o HTML da rota para visitantes anônimos.
+
+    'parametros' são os argumentos da query string que mudam o conteúdo; os demais são ignorados
+    na chave (e também pela rota), para que URLs arbitrárias não fragmentem o cache.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not _pagina_pode_usar_cache():
+                return f(*args, **kwargs)
+
+            with _cache_psicologos_lock:
+                versao = _cache_psicologos['versao']
+            chave = (
+                request.endpoint,
+                tuple(sorted(kwargs.items())),
+                tuple((nome, request.args.get(nome)) for nome in parametros if request.args.get(nome)),
+                versao,
+            )
+            html = _ler_pagina_cache(chave)
+            contar_cache('paginas', html is not None)
+            if html is not None:
+                return app.response_class(html, mimetype='text/html')
+
+            resposta = f(*args, **kwargs)
+
+            # Não guarda páginas com mensagem de erro/aviso, nem as renderizadas durante uma
+            # mudança de versão (o conteúdo pode ser anterior ou posterior à edição)
+            if isinstance(resposta, str) and not g.get('pagina_com_flash'):
+                with _cache_psicologos_lock:
+                    versao_atual = _cache_psicologos['versao']
+                if versao_atual == versao:
+                    _salvar_pagina_cache(chave, resposta.encode('utf-8'))
+            return resposta
+        return decorated_function
+    return decorator
+
+# ==========================================================
+# 4.7 RPCs EM PARALELO (POOL COMPARTILHADO PELO WORKER)
+# ==========================================================
+
+# Chamadas independentes ao Firestore/Auth de uma mesma rota rodam ao mesmo tempo:
+# a rota passa a esperar pela RPC mais lenta, e não pela soma de todas.
+RPC_WORKERS = int(os.environ.get('RPC_WORKERS', '8'))
+_executor_rpc = None
+_executor_rpc_lock = threading.Lock()
+
+def _get_executor_rpc():
+    """Pool de threads do worker para RPCs (criado no primeiro uso, portanto já depois do fork)."""
+    global _executor_rpc
+    with _executor_rpc_lock:
+        if _executor_rpc is None:
+            _executor_rpc = ThreadPoolExecutor(max_workers=RPC_WORKERS, thread_name_prefix='rpc')
+        return _executor_rpc
+
+def em_paralelo(funcao, *args, **kwargs):
+    """Inicia funcao(*args, **kwargs) no pool e devolve o Future.
+
+    Dentro de uma requisição a tarefa herda o contexto (request, session e as métricas da seção 1.1).
+    As tarefas não devem chamar em_paralelo de novo: com o pool cheio, a espera viraria deadlock.
+    """
+    if has_request_context():
+        funcao = copy_current_request_context(funcao)
+    return _get_executor_rpc().submit(funcao, *args, **kwargs)
+
+# ==========================================================
+# 4.8 TRANSIÇÕES DE STATUS DOS AGENDAMENTOS (ATÔMICAS, COM DONO VERIFICADO E EM LOTE)
+# ==========================================================
+
+# Ação -> status de origem aceitos, status final (None = excluir o registro) e campo de data gravado junto
+TRANSICOES_AGENDAMENTO = {
+    'confirmar': {'de': ('Pendente',), 'para': 'Confirmado', 'carimbo': None, 'rotulo': 'confirmado(s)'},
+    'cancelar': {'de': ('Pendente', 'Confirmado'), 'para': 'Cancelada', 'carimbo': 'dataCancelamento', 'rotulo': 'cancelado(s)'},
+    'concluir': {'de': ('Confirmado',), 'para': 'Realizada', 'carimbo': 'dataFinalizacao', 'rotulo': 'concluído(s)'},
+    'excluir': {'de': ('Realizada', 'Cancelada'), 'para': None, 'carimbo': None, 'rotulo': 'excluído(s)'},
+}
+# Agendamentos aceitos numa mesma ação em lote (seleção do dashboard)
+LIMITE_LOTE_AGENDAMENTOS = 500
+# Um WriteBatch aceita até 500 escritas. Cada agendamento soma a própria escrita, a liberação dos
+# blocos da agenda e os contadores de estatísticas que ainda não estão no lote: a seleção é
+# dividida em quantos lotes forem necessários, sem separar as escritas de um mesmo agendamento.
+LIMITE_ESCRITAS_LOTE = 500
+# Novas tentativas quando outro request altera um dos documentos entre a leitura e o commit
+TRANSICOES_TENTATIVAS = 3
+
+def _montar_lotes_transicao(referencias, transicao, valores, psicologo_uid, resultado):
+    """Lê os agendamentos (uma RPC) e distribui as escritas em lotes de até LIMITE_ESCRITAS_LOTE.
+
+    Os IDs recusados vão direto para `resultado`; devolve a lista de lotes, cada um com as
+    referências, os donos (psicologo_id -> IDs) e os deltas de estatísticas que grava.
+    """
+    partes = []
+    parte = None
+    campos_lidos = ['psicologo_id', 'status', 'reservaHorarios', 'dataHoraInicio', 'valor']
+    for snapshot in db.get_all(referencias, field_paths=campos_lidos):
+        if not snapshot.exists:
+            resultado['nao_encontrados'].append(snapshot.id)
+            continue
+        dados = snapshot.to_dict()
+        if psicologo_uid is not None and dados.get('psicologo_id') != psicologo_uid:
+            resultado['sem_permissao'].append(snapshot.id)
+            continue
+        if dados.get('status') not in transicao['de']:
+            resultado['status_invalido'].append(snapshot.id)
+            continue
+
+        # Ao sair da agenda, o horário é liberado no mesmo commit (seção 4.12). Só enquanto
+        # ocupa: depois de cancelado, o bloco pode já ser de outro agendamento.
+        reservas = []
+        if dados.get('status') in STATUS_OCUPAM_HORARIO and transicao['para'] not in STATUS_OCUPAM_HORARIO:
+            reservas = dados.get('reservaHorarios') or []
+        contadores = registrar_estatisticas({}, dados.get('psicologo_id'), dados.get('dataHoraInicio'),
+                                            dados.get('valor'), dados.get('status'), transicao['para'])
+
+        # Escritas deste agendamento: ele, os blocos liberados e os contadores novos no lote
+        escritas = 1 + len(reservas) + len(contadores)
+        if parte is not None:
+            repetidos = sum(1 for chave in contadores if chave in parte['deltas'])
+            if parte['escritas'] + escritas - repetidos > LIMITE_ESCRITAS_LOTE:
+                parte = None
+            else:
+                escritas -= repetidos
+        if parte is None:
+            parte = {'lote': db.batch(), 'referencias': [], 'donos': {}, 'deltas': {}, 'escritas': 0}
+            partes.append(parte)
+        parte['escritas'] += escritas
+
+        condicao = db.write_option(last_update_time=snapshot.update_time)
+        if transicao['para'] is None:
+            parte['lote'].delete(snapshot.reference, option=condicao)
+        else:
+            parte['lote'].update(snapshot.reference, valores, option=condicao)
+        for reserva_id in reservas:
+            parte['lote'].delete(db.collection(COLECAO_RESERVAS).document(reserva_id))
+        for chave, campos in contadores.items():
+            acumulados = parte['deltas'].setdefault(chave, {})
+            for campo, variacao in campos.items():
+                acumulados[campo] = acumulados.get(campo, 0) + variacao
+        parte['referencias'].append(snapshot.reference)
+        parte['donos'].setdefault(dados.get('psicologo_id'), []).append(snapshot.id)
+    for parte in partes:
+        gravar_estatisticas(parte['lote'], parte['deltas'])
+    return partes
+
+def transicionar_agendamentos(doc_ids, acao, psicologo_uid=None, campos=None):
+    """Aplica a transição `acao` a um ou mais agendamentos, em WriteBatches de até LIMITE_ESCRITAS_LOTE escritas.
+
+    Os documentos são lidos em uma RPC (get_all) e só entram no lote os do psicólogo
+    (psicologo_uid=None libera todos, para o admin) cujo status atual aceita a transição.
+    Cada escrita leva a pré-condição last_update_time da leitura: se outro request alterou
+    o documento nesse meio tempo, o commit daquele lote falha e ele (com os seguintes) é
+    refeito com os dados novos. Cada lote é tudo ou nada; uma seleção que não cabe num só
+    lote pode ficar parcialmente aplicada se um commit falhar de vez.
+
+    Retorna {'alterados', 'nao_encontrados', 'sem_permissao', 'status_invalido'} com os IDs de cada caso.
+    """
+    transicao = TRANSICOES_AGENDAMENTO[acao]
+    doc_ids = list(dict.fromkeys(doc_ids))[:LIMITE_LOTE_AGENDAMENTOS]
+    referencias = [db.collection('agendamentos').document(doc_id) for doc_id in doc_ids]
+
+    valores = {'status': transicao['para'], **(campos or {})}
+    if transicao['carimbo']:
+        valores[transicao['carimbo']] = firestore.SERVER_TIMESTAMP
+
+    resultado = {'alterados': [], 'nao_encontrados': [], 'sem_permissao': [], 'status_invalido': []}
+    for tentativa in range(1, TRANSICOES_TENTATIVAS + 1):
+        partes = _montar_lotes_transicao(referencias, transicao, valores, psicologo_uid, resultado)
+        referencias = []
+        for indice, parte in enumerate(partes):
+            try:
+                parte['lote'].commit()
+            except excecoes_google.FailedPrecondition:
+                if tentativa == TRANSICOES_TENTATIVAS:
+                    raise
+                # Este lote e os seguintes são lidos e montados de novo
+                referencias = [referencia for seguinte in partes[indice:] for referencia in seguinte['referencias']]
+                print(f"Agendamentos alterados durante a transição '{acao}'; tentativa {tentativa + 1}.")
+                break
+            resultado['alterados'].extend(referencia.id for referencia in parte['referencias'])
+            # Cancelados e excluídos deixam de ocupar a agenda (seção 4.11)
+            if transicao['para'] not in STATUS_OCUPAM_HORARIO:
+                for psicologo_id, ids in parte['donos'].items():
+                    liberar_ocupacao(psicologo_id, ids)
+        if not referencias:
+            return resultado
+
+def flash_transicao_unica(resultado, acao, mensagem_sucesso):
+    """Mensagem de uma transição de um único agendamento (rotas de confirmar, cancelar, finalizar e excluir)."""
+    if resultado['alterados']:
+        flash(mensagem_sucesso, 'success')
+    elif resultado['nao_encontrados']:
+        flash("Erro: Consulta não encontrada.", 'error')
+    elif resultado['sem_permissao']:
+        flash("Você não tem permissão para alterar esta consulta.", 'error')
+    else:
+        flash(f"O status atual desta consulta não permite a ação '{acao}'.", 'error')
+
+# ==========================================================
+# 4.9 AQUECIMENTO DO WORKER (TEMPLATES, FIRESTORE E DIRETÓRIO) E PRONTIDÃO
+# ==========================================================
+
+# Com AQUECER_WORKER=1 o gunicorn (post_worker_init em gunicorn.conf.py) aquece cada worker antes
+# de ele aceitar conexões; sem o gunicorn, o primeiro GET /pronto faz o mesmo. Assim a primeira
+# requisição real não paga a compilação do Jinja, o handshake gRPC, o token e a carga do diretório.
+AQUECER_WORKER = os.environ.get('AQUECER_WORKER', '0') == '1'
+_aquecimento = {'pronto': False, 'duracao_ms': None, 'templates': 0, 'psicologos': 0, 'erros': []}
+_aquecimento_lock = threading.Lock()
+
+def aquecer_worker():
+    """Compila todos os templates, abre o canal do Firestore e carrega o diretório (uma vez por processo).
+
+    Com falhas (registradas no log e em _aquecimento['erros']) o worker não fica pronto e a
+    próxima chamada tenta de novo; enquanto isso, as requisições carregam tudo sob demanda.
+    """
+    with _aquecimento_lock:
+        if _aquecimento['pronto']:
+            return _aquecimento
+        inicio = time.perf_counter()
+        erros = []
+
+        # 1. Templates: compilados e guardados no cache do ambiente Jinja
+        templates = 0
+        for nome in app.jinja_env.list_templates(extensions=['html']):
+            try:
+                app.jinja_env.get_template(nome)
+                templates += 1
+            except Exception as e:
+                erros.append(f"template {nome}: {e}")
+
+        # 2 e 3. Firestore (credenciais, token e canal gRPC) e o diretório de psicólogos,
+        # que é a primeira leitura da listagem e da triagem. A carga é feita aqui, e não por
+        # get_diretorio_psicologos(): lá uma falha do Firestore vira o MOCK e passaria por sucesso.
+        psicologos = 0
+        try:
+            if db:
+                with _cache_psicologos_lock:
+                    versao = _cache_psicologos['versao']
+                novo = _montar_cache_psicologos(_carregar_psicologos_firestore())
+                psicologos = len(novo['dados'])
+                if psicologos:
+                    with _cache_psicologos_lock:
+                        _instalar_cache_psicologos(novo, atual=_cache_psicologos['versao'] == versao)
+                recomendar_psicologos(novo['indice'], novo['dados'], pesos_triagem()) # Monta a matriz da triagem (seção 4.13)
+                buscar_bm25(novo['indice'], novo['dados'], '') # e o índice da busca livre (seção 4.2)
+            else:
+                erros.append("Firestore indisponível")
+        except Exception as e:
+            erros.append(f"diretório: {e}")
+
+        _aquecimento.update(pronto=not erros, duracao_ms=round((time.perf_counter() - inicio) * 1000, 1),
+                            templates=templates, psicologos=psicologos, erros=erros)
+        for erro in erros:
+            app.logger.warning(f"Aquecimento do worker {os.getpid()}: {erro}")
+        if not erros:
+            print(f"🔥 Worker {os.getpid()} aquecido em {_aquecimento['duracao_ms']} ms "
+                  f"({templates} templates, {psicologos} psicólogos).")
+        return _aquecimento
+
+@app.route('/pronto')
+def prontidao():
+    """Readiness: 200 só depois de um aquecimento sem falhas, 503 antes disso.
+
+    Sem aquecimento no boot, a chamada aquece (ou tenta de novo). Rota pública: as mensagens
+    de erro ficam no log, a resposta traz só a quantidade.
+    """
+    estado = aquecer_worker()
+    resposta = {'pronto': estado['pronto'], 'duracao_ms': estado['duracao_ms'], 'templates': estado['templates'],
+                'psicologos': estado['psicologos'], 'falhas': len(estado['erros']), 'pid': os.getpid()}
+    return resposta, 200 if estado['pronto'] else 503
+
+# ==========================================================
+# 4.10 VERIFICAÇÃO LOCAL DE TOKENS DO FIREBASE (ID TOKEN E COOKIE DE SESSÃO)
+# ==========================================================
+
+# LOGIN_MODO='token': o navegador entra com e-mail e senha no Firebase Auth (SDK web) e envia o
+# ID token para /login/sessao. O servidor confere o token aqui, sem chamar o Google, e troca-o
+# por um cookie de sessão do Firebase (a única chamada ao Admin SDK do login). Cada requisição
+# autenticada confere esse cookie com as chaves públicas em cache.
+# LOGIN_MODO='email' mantém o login antigo (só confere se o e-mail existe no Auth).
+LOGIN_MODO = os.environ.get('LOGIN_MODO', 'email')
+COOKIE_SESSAO_FIREBASE = '__session' # Nome que o Firebase Hosting repassa ao backend
+DURACAO_SESSAO_FIREBASE = timedelta(days=int(os.environ.get('SESSAO_FIREBASE_DIAS', '5'))) # Entre 5 min e 14 dias
+IDADE_MAXIMA_LOGIN = 300 # Segundos desde o login no navegador aceitos para criar o cookie
+FIREBASE_WEB_CONFIG = {
+    'apiKey': os.environ.get('FIREBASE_WEB_API_KEY'),
+    'authDomain': os.environ.get('FIREBASE_AUTH_DOMAIN'),
+}
+
+_projeto_firebase = None
+
+def projeto_firebase():
+    """ID do projeto: FIREBASE_PROJECT_ID ou o project_id das mesmas credenciais do Admin SDK (seção 1)."""
+    global _projeto_firebase
+    if _projeto_firebase is None:
+        projeto = os.environ.get('FIREBASE_PROJECT_ID') or os.environ.get('GOOGLE_CLOUD_PROJECT')
+        if not projeto:
+            try:
+                if os.environ.get('FIREBASE_CREDENTIALS_JSON'):
+                    projeto = json.loads(os.environ['FIREBASE_CREDENTIALS_JSON']).get('project_id')
+                elif os.path.exists('firebase-admin-sdk.json'):
+                    with open('firebase-admin-sdk.json', encoding='utf-8') as f:
+                        projeto = json.load(f).get('project_id')
+            except (ValueError, OSError) as e:
+                app.logger.warning(f"Não foi possível ler o project_id das credenciais: {e}")
+        _projeto_firebase = projeto or ''
+    return _projeto_firebase
+
+class VerificadorTokensFirebase:
+    """Confere JWTs RS256 emitidos pelo Firebase com as chaves públicas do Google em cache.
+
+    As chaves são baixadas de novo quando o Cache-Control da última resposta expira ou quando
+    aparece um 'kid' desconhecido (rotação), no máximo uma vez por minuto. Sem URL, usa só as
+    chaves passadas a instalar_chaves() (ex.: chaves geradas localmente no benchmark).
+    """
+
+    INTERVALO_MINIMO_BUSCA = 60
+
+    def __init__(self, url_certificados, emissor):
+        self.url_certificados = url_certificados
+        self.emissor = emissor # Com {projeto} no lugar do ID do projeto
+        self._chaves = {}
+        self._expira_em = 0.0
+        self._ultima_busca = 0.0
+        self._lock_busca = threading.Lock() # Uma busca de chaves por vez no processo
+
+    def instalar_chaves(self, certificados, validade=3600):
+        """Troca as chaves em uso: {kid: certificado X.509 ou chave pública, em PEM}."""
+        from cryptography import x509
+        from cryptography.hazmat.primitives import serialization
+        chaves = {}
+        for kid, pem in certificados.items():
+            pem = pem.encode() if isinstance(pem, str) else pem
+            if b'CERTIFICATE' in pem:
+                chaves[kid] = x509.load_pem_x509_certificate(pem).public_key()
+            else:
+                chaves[kid] = serialization.load_pem_public_key(pem)
+        self._chaves = chaves
+        self._expira_em = time.time() + validade
+
+    def _buscar_chaves(self):
+        import urllib.request
+        self._ultima_busca = time.time()
+        with urllib.request.urlopen(self.url_certificados, timeout=10) as resposta:
+            certificados = json.loads(resposta.read())
+            max_age = re.search(r'max-age=(\d+)', resposta.headers.get('Cache-Control', ''))
+        self.instalar_chaves(certificados, int(max_age.group(1)) if max_age else 3600)
+
+    def _chave(self, kid):
+        chave = self._chaves.get(kid)
+        if self.url_certificados and (chave is None or time.time() >= self._expira_em):
+            with self._lock_busca:
+                # Outra thread pode ter buscado enquanto esta esperava
+                chave = self._chaves.get(kid)
+                if (chave is None or time.time() >= self._expira_em) and \
+                        time.time() - self._ultima_busca >= self.INTERVALO_MINIMO_BUSCA:
+                    try:
+                        self._buscar_chaves()
+                    except (OSError, ValueError) as e:
+                        # Mantém as chaves antigas: o Google as publica bem antes de deixar de usá-las
+                        app.logger.warning(f"Falha ao atualizar as chaves públicas do Firebase: {e}")
+                    chave = self._chaves.get(kid)
+        return chave
+
+    def verificar(self, token, projeto=None):
+        """Claims do token (com 'uid') se assinatura, emissor, público e validade conferem; senão None."""
+        import jwt
+        projeto = projeto or projeto_firebase()
+        if not token or not projeto:
+            return None
+        try:
+            cabecalho = jwt.get_unverified_header(token)
+            if cabecalho.get('alg') != 'RS256':
+                return None
+            chave = self._chave(cabecalho.get('kid'))
+            if chave is None:
+                return None
+            claims = jwt.decode(token, chave, algorithms=['RS256'], audience=projeto,
+                                issuer=self.emissor.format(projeto=projeto), leeway=10,
+                                options={'require': ['exp', 'iat', 'sub', 'aud', 'iss']})
+        except jwt.PyJWTError as e:
+            app.logger.info(f"Token do Firebase recusado: {e}")
+            return None
+        if not isinstance(claims.get('sub'), str) or not claims['sub'] or len(claims['sub']) > 128:
+            return None
+        claims['uid'] = claims['sub']
+        return claims
+
+verificador_id_token = VerificadorTokensFirebase(
+    'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com',
+    'https://securetoken.google.com/{projeto}')
+verificador_cookie_sessao = VerificadorTokensFirebase(
+    'https://www.googleapis.com/identitytoolkit/v3/relyingparty/publicKeys',
+    'https://session.firebase.google.com/{projeto}')
+
+@app.before_request
+def conferir_cookie_sessao_firebase():
+    """No modo 'token', a sessão de psicólogo só vale com um cookie de sessão do Firebase válido e do mesmo UID."""
+    if LOGIN_MODO != 'token' or request.endpoint == 'static' or 'user_role' not in session:
+        return
+    if session['user_role'] != 'psicologo':
+        return
+    claims = verificador_cookie_sessao.verificar(request.cookies.get(COOKIE_SESSAO_FIREBASE))
+    if claims is None or claims['uid'] != session.get('psicologo_uid'):
+        # Cookie expirado, ausente ou de outro usuário: encerra a sessão (as rotas mandam para o login)
+        session.pop('psicologo_uid', None)
+        session.pop('user_role', None)
+        return
+    g.claims_firebase = claims
+
+def renderizar_login():
+    return render_template('login.html', page_title='Login PsicoAPP', login_modo=LOGIN_MODO,
+                           firebase_web_config=dict(FIREBASE_WEB_CONFIG, projectId=projeto_firebase()))
+
+# ==========================================================
+# 4.11 DISPONIBILIDADE DE HORÁRIOS (REGRAS SEMANAIS + OCUPAÇÃO POR DIA EM BITMAP)
+# ==========================================================
+
+# Cada dia é um inteiro com um bit por unidade de 10 minutos (144 bits). O horário de trabalho
+# vem das regras semanais do psicólogo ('horariosAtendimento' no documento) e a ocupação de um
+# índice em memória montado a partir de 'agendamentos': um horário está livre quando todas as
+# unidades da sessão estão no expediente e nenhuma está ocupada (duas operações com inteiros).
+MINUTOS_POR_UNIDADE = 10
+INTERVALO_INICIO_MINUTOS = 60 # Início das sessões oferecidas: de hora em hora
+DURACAO_MINIMA_MINUTOS = 50 # Sessão mais curta do formulário (a duração é escolhida junto com o horário)
+DIAS_DISPONIBILIDADE = int(os.environ.get('DIAS_DISPONIBILIDADE', '7'))
+ANTECEDENCIA_MINIMA = timedelta(hours=2)
+STATUS_OCUPAM_HORARIO = ('Pendente', 'Confirmado', 'Realizada')
+DIAS_SEMANA = ('seg', 'ter', 'qua', 'qui', 'sex', 'sab', 'dom') # Mesma ordem de datetime.weekday()
+
+# Formato de 'horariosAtendimento': {'seg': [['09:00', '12:00'], ['14:00', '18:00']], ...}.
+# Psicólogos sem o campo atendem de segunda a sexta, das 09:00 às 17:00.
+HORARIOS_ATENDIMENTO_PADRAO = {dia: [['09:00', '17:00']] for dia in DIAS_SEMANA[:5]}
+
+# Ocupação por psicólogo, carregada com uma consulta no primeiro uso e atualizada a cada
+# agendamento criado ou cancelado neste processo. O TTL traz as mudanças feitas por outros
+# workers e pelo admin.
+OCUPACAO_TTL = int(os.environ.get('OCUPACAO_TTL', '300'))
+_ocupacao = {} # psicologo_id -> {'carregado_em', 'mascaras': {date: {doc_id: bits}}, 'ocupado': {date: bits}}
+_ocupacao_lock = threading.Lock()
+
+def _minutos_do_dia(texto):
+    horas, minutos = texto.split(':')
+    return int(horas) * 60 + int(minutos)
+
+def mascara_horario(inicio_minutos, duracao_minutos):
+    """Bits das unidades de 10 minutos cobertas por uma sessão (arredonda o fim para cima)."""
+    primeira = inicio_minutos // MINUTOS_POR_UNIDADE
+    ultima = -(-(inicio_minutos + duracao_minutos) // MINUTOS_POR_UNIDADE)
+    return ((1 << (ultima - primeira)) - 1) << primeira
+
+def duracao_em_minutos(texto):
+    """'50 min' -> 50 (o formulário grava a duração como texto)."""
+    encontrado = re.search(r'\d+', str(texto or ''))
+    return int(encontrado.group()) if encontrado else DURACAO_MINIMA_MINUTOS
+
+def expediente_semanal(psicologo):
+    """Tupla com o bitmap do expediente de cada dia da semana (segunda = 0)."""
+    regras = psicologo.get('horariosAtendimento') or HORARIOS_ATENDIMENTO_PADRAO
+    semana = []
+    for dia in DIAS_SEMANA:
+        bits = 0
+        for intervalo in regras.get(dia) or []:
+            try:
+                inicio, fim = (_minutos_do_dia(h) for h in intervalo)
+            except (TypeError, ValueError):
+                continue # Regra mal formatada no documento: ignora só o intervalo
+            if fim > inicio:
+                bits |= mascara_horario(inicio, fim - inicio)
+        semana.append(bits)
+    return tuple(semana)
+
+def _registrar_na_ocupacao(entrada, doc_id, data_hora, duracao):
+    data_hora = data_hora.astimezone(FUSO_BRASILIA)
+    dia = data_hora.date()
+    entrada['mascaras'].setdefault(dia, {})[doc_id] = mascara_horario(data_hora.hour * 60 + data_hora.minute, duracao)
+    _recalcular_dia(entrada, dia)
+
+def _recalcular_dia(entrada, dia):
+    ocupado = 0
+    for bits in entrada['mascaras'].get(dia, {}).values():
+        ocupado |= bits
+    entrada['ocupado'][dia] = ocupado
+
+def _carregar_ocupacao(psicologo_id):
+    """Agendamentos que ocupam horário de hoje em diante (mesmo índice composto do histórico)."""
+    entrada = {'carregado_em': time.monotonic(), 'mascaras': {}, 'ocupado': {}}
+    hoje = datetime.now(FUSO_BRASILIA).replace(hour=0, minute=0, second=0, microsecond=0)
+    documentos = db.collection('agendamentos') \
+        .where(filter=firestore.FieldFilter('psicologo_id', '==', psicologo_id)) \
+        .where(filter=firestore.FieldFilter('status', 'in', list(STATUS_OCUPAM_HORARIO))) \
+        .where(filter=firestore.FieldFilter('dataHoraInicio', '>=', hoje)) \
+        .select(['dataHoraInicio', 'duracao']) \
+        .stream()
+    for doc in documentos:
+        dados = doc.to_dict()
+        if dados.get('dataHoraInicio'):
+            _registrar_na_ocupacao(entrada, doc.id, dados['dataHoraInicio'], duracao_em_minutos(dados.get('duracao')))
+    return entrada
+
+def ocupacao_psicologo(psicologo_id):
+    """Índice de ocupação do psicólogo (carregado ou recarregado se passou do TTL)."""
+    with _ocupacao_lock:
+        entrada = _ocupacao.get(psicologo_id)
+    if entrada is not None and time.monotonic() - entrada['carregado_em'] < OCUPACAO_TTL:
+        return entrada
+    if not db:
+        return {'carregado_em': time.monotonic(), 'mascaras': {}, 'ocupado': {}}
+    # A consulta roda fora do lock: psicólogos diferentes carregam em paralelo
+    entrada = _carregar_ocupacao(psicologo_id)
+    with _ocupacao_lock:
+        _ocupacao[psicologo_id] = entrada
+    return entrada
+
+def registrar_ocupacao(psicologo_id, doc_id, data_hora, duracao):
+    """Marca no índice um agendamento recém-criado (sem reler o Firestore)."""
+    with _ocupacao_lock:
+        entrada = _ocupacao.get(psicologo_id)
+        if entrada is not None and data_hora is not None:
+            _registrar_na_ocupacao(entrada, doc_id, data_hora, duracao_em_minutos(duracao))
+
+def liberar_ocupacao(psicologo_id, doc_ids):
+    """Remove do índice agendamentos cancelados ou excluídos."""
+    with _ocupacao_lock:
+        entrada = _ocupacao.get(psicologo_id)
+        if entrada is None:
+            return
+        for dia, mascaras in entrada['mascaras'].items():
+            if any(mascaras.pop(doc_id, None) is not None for doc_id in list(doc_ids)):
+                _recalcular_dia(entrada, dia)
+
+def horarios_disponiveis(psicologo, inicio=None, dias=DIAS_DISPONIBILIDADE):
+    """{'Tuesday, 15/10': ['09:00', ...]} dos próximos `dias`, no formato que o agendamento.html espera.
+
+    Dias sem nenhum horário livre ficam de fora.
+    """
+    agora = datetime.now(FUSO_BRASILIA)
+    inicio = inicio or agora.date()
+    limite = agora + ANTECEDENCIA_MINIMA
+    expediente = expediente_semanal(psicologo)
+    ocupado = ocupacao_psicologo(psicologo['id'])['ocupado']
+
+    horarios = {}
+    for deslocamento in range(dias):
+        dia = inicio + timedelta(days=deslocamento)
+        livre = expediente[dia.weekday()] & ~ocupado.get(dia, 0)
+        if not livre:
+            continue
+        livres = []
+        for minutos in range(0, 24 * 60, INTERVALO_INICIO_MINUTOS):
+            mascara = mascara_horario(minutos, DURACAO_MINIMA_MINUTOS)
+            if livre & mascara == mascara:
+                data_hora = datetime(dia.year, dia.month, dia.day, minutos // 60, minutos % 60, tzinfo=FUSO_BRASILIA)
+                if data_hora >= limite:
+                    livres.append(f"{minutos // 60:02d}:{minutos % 60:02d}")
+        if livres:
+            horarios[dia.strftime("%A, %d/%m")] = livres
+    return horarios
+
+def horario_disponivel(psicologo, data_hora, duracao):
+    """True se a sessão cabe no expediente e não colide com nenhum agendamento conhecido."""
+    if data_hora is None or data_hora < datetime.now(FUSO_BRASILIA) + ANTECEDENCIA_MINIMA:
+        return False
+    data_hora = data_hora.astimezone(FUSO_BRASILIA)
+    inicio = data_hora.hour * 60 + data_hora.minute
+    if inicio % INTERVALO_INICIO_MINUTOS:
+        return False # Só os inícios oferecidos (a reserva da seção 4.12 é por bloco)
+    mascara = mascara_horario(inicio, duracao_em_minutos(duracao))
+    expediente = expediente_semanal(psicologo)[data_hora.weekday()]
+    ocupado = ocupacao_psicologo(psicologo['id'])['ocupado'].get(data_hora.date(), 0)
+    return expediente & mascara == mascara and not ocupado & mascara
+
+# ==========================================================
+# 4.12 RESERVA DE HORÁRIOS (DOCUMENTO POR HORÁRIO, RETENÇÃO COM PRAZO)
+# ==========================================================
+
+# Cada bloco de INTERVALO_INICIO_MINUTOS da agenda de um psicólogo tem um ID fixo em
+# 'reservas_horarios' (psicólogo + data + hora). Reservar é criar esses documentos com create(),
+# que falha se algum já existir: duas pessoas no mesmo horário não passam as duas, e horários
+# diferentes não disputam nenhum lock. Ao escolher o horário, o cliente ganha uma retenção que
+# vence sozinha; no pagamento ela vira reserva no mesmo commit que grava o agendamento.
+# Configure uma política de TTL do Firestore no campo 'expiraEm' dessa coleção: retenções vencidas
+# e reservas de sessões passadas são apagadas sem job de limpeza (até lá, retenção vencida
+# conta como livre).
+COLECAO_RESERVAS = 'reservas_horarios'
+RETENCAO_HORARIO = timedelta(minutes=int(os.environ.get('RETENCAO_HORARIO_MINUTOS', '10')))
+
+def ids_reserva_horario(psicologo_id, data_hora, duracao):
+    """IDs dos blocos da agenda cobertos pela sessão (uma sessão de 80 min ocupa dois blocos de 1 h)."""
+    data_hora = data_hora.astimezone(FUSO_BRASILIA)
+    inicio = data_hora.hour * 60 + data_hora.minute
+    fim = inicio + duracao_em_minutos(duracao)
+    primeiro = inicio - inicio % INTERVALO_INICIO_MINUTOS
+    return [f"{psicologo_id}_{data_hora:%Y%m%d}_{minutos // 60:02d}{minutos % 60:02d}"
+            for minutos in range(primeiro, fim, INTERVALO_INICIO_MINUTOS)]
+
+def _retencao_disponivel(dados, titular, agora):
+    """Documento existente que ainda pode ser tomado: retenção do próprio titular ou já vencida."""
+    return dados.get('estado') == 'retido' and (dados.get('titular') == titular or dados['expiraEm'] <= agora)
+
+def _gravar_blocos(lote, referencias, dados, titular):
+    """Inclui no lote a gravação de cada bloco; False se algum está retido por outro ou reservado."""
+    agora = datetime.now(timezone.utc)
+    snapshots = {snapshot.id: snapshot for snapshot in db.get_all(referencias)}
+    for referencia in referencias:
+        snapshot = snapshots.get(referencia.id)
+        if snapshot is None or not snapshot.exists:
+            lote.create(referencia, dados)
+        elif _retencao_disponivel(snapshot.to_dict(), titular, agora):
+            # Pré-condição: se outro cliente tomou o bloco depois da leitura, o commit falha
+            lote.update(referencia, dados, option=db.write_option(last_update_time=snapshot.update_time))
+        else:
+            return False
+    return True
+
+def reter_horario(psicologo_id, data_hora, duracao, titular):
+    """Retém os blocos da sessão por RETENCAO_HORARIO. Falha na hora (False) se algum está ocupado."""
+    referencias = [db.collection(COLECAO_RESERVAS).document(doc_id)
+                   for doc_id in ids_reserva_horario(psicologo_id, data_hora, duracao)]
+    dados = {'psicologo_id': psicologo_id, 'estado': 'retido', 'titular': titular,
+             'inicio': data_hora, 'expiraEm': datetime.now(timezone.utc) + RETENCAO_HORARIO}
+    lote = db.batch()
+    for referencia in referencias:
+        lote.create(referencia, dados)
+    try:
+        lote.commit() # Caminho comum: nenhum bloco existe, uma RPC
+        return True
+    except excecoes_google.AlreadyExists:
+        pass
+
+    # Algum bloco existe: só segue se for retenção vencida ou do próprio titular (ex.: voltou e escolheu de novo)
+    lote = db.batch()
+    if not _gravar_blocos(lote, referencias, dados, titular):
+        return False
+    try:
+        lote.commit()
+        return True
+    except (excecoes_google.Conflict, excecoes_google.FailedPrecondition):
+        return False
+
+def confirmar_reserva(agendamento_ref, dados_agendamento, psicologo_id, data_hora, duracao, titular):
+    """Grava o agendamento e converte a retenção em reserva num único commit (tudo ou nada).
+
+    Vale também sem retenção válida (ex.: venceu durante o pagamento), desde que o horário
+    continue livre. Retorna False se alguém ficou com o horário.
+    """
+    ids = ids_reserva_horario(psicologo_id, data_hora, duracao)
+    referencias = [db.collection(COLECAO_RESERVAS).document(doc_id) for doc_id in ids]
+    # A reserva vence um dia depois da sessão: o TTL limpa a agenda passada
+    reserva = {'psicologo_id': psicologo_id, 'estado': 'reservado', 'titular': titular,
+               'agendamento_id': agendamento_ref.id, 'inicio': data_hora, 'expiraEm': data_hora + timedelta(days=1)}
+    lote = db.batch()
+    if not _gravar_blocos(lote, referencias, reserva, titular):
+        return False
+    lote.set(agendamento_ref, dict(dados_agendamento, reservaHorarios=ids))
+    # Contadores do painel de estatísticas no mesmo commit (seção 4.14)
+    gravar_estatisticas(lote, registrar_estatisticas({}, psicologo_id, data_hora, dados_agendamento.get('valor'),
+                                                     para=dados_agendamento.get('status')))
+    try:
+        lote.commit()
+        return True
+    except (excecoes_google.Conflict, excecoes_google.FailedPrecondition):
+        return False
+
+def liberar_retencao(psicologo_id, data_hora, duracao, titular):
+    """Desfaz a retenção do titular (ex.: escolheu outro horário); reservas e retenções alheias ficam."""
+    referencias = [db.collection(COLECAO_RESERVAS).document(doc_id)
+                   for doc_id in ids_reserva_horario(psicologo_id, data_hora, duracao)]
+    proprias = [snapshot for snapshot in db.get_all(referencias)
+                if snapshot.exists and snapshot.get('estado') == 'retido' and snapshot.get('titular') == titular]
+    if proprias:
+        lote = db.batch()
+        for snapshot in proprias:
+            lote.delete(snapshot.reference, option=db.write_option(last_update_time=snapshot.update_time))
+        try:
+            lote.commit()
+        except excecoes_google.FailedPrecondition:
+            pass # Outro cliente já tomou a retenção vencida
+
+# ==========================================================
+# 4.13 RECOMENDAÇÃO DA TRIAGEM (VETORES DE CARACTERÍSTICAS + PONTUAÇÃO VETORIZADA)
+# ==========================================================
+
+# Cada psicólogo vira uma linha de uma matriz NumPy (temas atendidos e linhas teóricas, a partir
+# dos mesmos termos do índice de busca da seção 4.2), com gênero e valor da sessão ao lado.
+# As respostas da triagem viram um vetor de pesos e todos os profissionais são pontuados com
+# um único produto matriz-vetor. A matriz fica no índice de busca, é montada no primeiro uso
+# (o numpy não entra no cold start) e acompanha as edições do admin por indexar_psicologo().
+np = _ModuloSobDemanda('numpy')
+
+# Tema ou linha -> radicais (texto normalizado) procurados nas especialidades e na bio
+TEMAS_TRIAGEM = {
+    'ansiedade': ('ansiedad', 'ansios', 'panico', 'fobia'),
+    'estresse': ('estress', 'burnout'),
+    'depressao': ('depress', 'tristeza'),
+    'luto': ('luto', 'perda'),
+    'relacionamento': ('relacionament', 'casal', 'familia', 'familiar'),
+    'carreira': ('carreira', 'proposito', 'profissional'),
+    'autoestima': ('autoestima', 'autoconhecimento'),
+    'infantil': ('infantil', 'crianca', 'adolescen'),
+    'trauma': ('trauma',),
+}
+LINHAS_TRIAGEM = {
+    'tcc': ('tcc', 'cognitiv', 'comportamental'),
+    'psicanalise': ('psicanal',),
+    'humanista': ('humanista',),
+    'gestalt': ('gestalt',),
+}
+COLUNAS_TRIAGEM = [(nome, radicais) for nome, radicais in {**TEMAS_TRIAGEM, **LINHAS_TRIAGEM}.items()]
+POSICAO_COLUNA = {nome: pos for pos, (nome, _) in enumerate(COLUNAS_TRIAGEM)}
+
+PESO_ESPECIALIDADE = 1.0 # Tema nas especialidades
+PESO_BIO = 0.5 # Tema só mencionado na bio
+PESO_GENERO = 2.0 # Preferência de gênero: ordena antes, mas não esconde ninguém
+PESO_PRECO = 0.2 # Desempate a favor das sessões mais baratas
+TRIAGEM_TOP_K = int(os.environ.get('TRIAGEM_TOP_K', '12'))
+
+# Opção 'foco_principal' do triagem.html -> tema
+FOCOS_TRIAGEM = {'Ansiedade': 'ansiedade', 'Depressão': 'depressao', 'Relacionamento': 'relacionamento',
+                 'Luto': 'luto', 'Carreira': 'carreira', 'Autoestima': 'autoestima'}
+# Linha teórica sugerida para cada tema (a mesma regra da triagem antiga: TCC para ansiedade...)
+LINHA_POR_TEMA = {'ansiedade': 'tcc', 'estresse': 'tcc', 'depressao': 'psicanalise', 'luto': 'psicanalise',
+                  'relacionamento': 'humanista', 'autoestima': 'humanista'}
+
+def _codigo_genero(genero):
+    """'F'/'Feminino' -> 1, 'M'/'Masculino' -> 2, outros -> 0."""
+    return {'f': 1, 'm': 2}.get(normalizar_texto(genero)[:1], 0)
+
+def _vetor_psicologo(termos_tags, termos_bio):
+    vetor = [0.0] * len(COLUNAS_TRIAGEM)
+    for pos, (_, radicais) in enumerate(COLUNAS_TRIAGEM):
+        if any(termo.startswith(radicais) for termo in termos_tags):
+            vetor[pos] = PESO_ESPECIALIDADE
+        elif any(termo.startswith(radicais) for termo in termos_bio):
+            vetor[pos] = PESO_BIO
+    return vetor
+
+def _preco(psicologo):
+    try:
+        return float(psicologo.get('valorSessao') or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def _montar_vetores_triagem(indice, psicologos):
+    """Matriz inicial, com folga para os cadastros seguintes (chamar com o lock do cache)."""
+    capacidade = max(16, len(psicologos) * 2)
+    vetores = {
+        'matriz': np.zeros((capacidade, len(COLUNAS_TRIAGEM)), dtype=np.float32),
+        'genero': np.zeros(capacidade, dtype=np.int8),
+        'preco': np.zeros(capacidade, dtype=np.float32),
+        'ativo': np.zeros(capacidade, dtype=bool),
+        'ids': [], # linha -> id
+        'linha': {}, # id -> linha
+    }
+    indice['vetores'] = vetores
+    for psicologo in psicologos:
+        if psicologo['id'] in indice['chaves']:
+            _atualizar_vetor_triagem(indice, psicologo)
+    return vetores
+
+def _atualizar_vetor_triagem(indice, psicologo):
+    """Grava a linha do psicólogo (nova ou existente), a partir dos termos já indexados."""
+    vetores = indice.get('vetores')
+    if vetores is None:
+        return
+    psicologo_id = psicologo['id']
+    termos_tags, termos_bio, genero = indice['chaves'][psicologo_id]
+    linha = vetores['linha'].get(psicologo_id)
+    if linha is None:
+        linha = len(vetores['ids'])
+        if linha == len(vetores['ativo']):
+            # Dobra a capacidade: cadastros seguidos custam O(1) amortizado
+            for campo in ('matriz', 'genero', 'preco', 'ativo'):
+                atual = vetores[campo]
+                vetores[campo] = np.concatenate([atual, np.zeros_like(atual)])
+        vetores['ids'].append(psicologo_id)
+        vetores['linha'][psicologo_id] = linha
+    vetores['matriz'][linha] = _vetor_psicologo(termos_tags, termos_bio)
+    vetores['genero'][linha] = _codigo_genero(genero)
+    vetores['preco'][linha] = _preco(psicologo)
+    vetores['ativo'][linha] = True
+
+def _remover_vetor_triagem(indice, psicologo_id):
+    """Desativa a linha de um psicólogo excluído (a linha é reaproveitada se ele voltar)."""
+    vetores = indice.get('vetores')
+    if vetores is None or psicologo_id not in vetores['linha']:
+        return
+    vetores['ativo'][vetores['linha'][psicologo_id]] = False
+
+def pesos_triagem(foco_principal=None, nivel_ansiedade=None, nivel_depressao=None):
+    """Vetor de pesos por tema/linha a partir das respostas (níveis de 1 a 5)."""
+    pesos = [0.0] * len(COLUNAS_TRIAGEM)
+
+    def somar(tema, peso):
+        pesos[POSICAO_COLUNA[tema]] += peso
+        if tema in LINHA_POR_TEMA:
+            pesos[POSICAO_COLUNA[LINHA_POR_TEMA[tema]]] += peso / 2
+
+    if foco_principal in FOCOS_TRIAGEM:
+        somar(FOCOS_TRIAGEM[foco_principal], 1.0)
+    for tema, nivel in (('ansiedade', nivel_ansiedade), ('depressao', nivel_depressao)):
+        try:
+            intensidade = (min(max(int(nivel), 1), 5) - 1) / 4
+        except (TypeError, ValueError):
+            continue
+        somar(tema, intensidade)
+        if tema == 'ansiedade':
+            somar('estresse', intensidade / 2)
+    return pesos
+
+def recomendar_psicologos(indice, psicologos, pesos, genero=None, k=TRIAGEM_TOP_K):
+    """IDs dos k psicólogos com maior pontuação, em ordem decrescente."""
+    with _cache_psicologos_lock:
+        vetores = indice.get('vetores') or _montar_vetores_triagem(indice, psicologos)
+        n = len(vetores['ids'])
+        if n == 0:
+            return []
+        pontos = vetores['matriz'][:n] @ np.asarray(pesos, dtype=np.float32)
+        codigo = _codigo_genero(genero) if genero and genero != 'Indiferente' else 0
+        if codigo:
+            pontos += PESO_GENERO * (vetores['genero'][:n] == codigo)
+        precos = vetores['preco'][:n]
+        amplitude = float(precos.max() - precos.min())
+        if amplitude > 0:
+            pontos -= PESO_PRECO * (precos - precos.min()) / amplitude
+        pontos[~vetores['ativo'][:n]] = -np.inf
+        ids = vetores['ids']
+
+    k = min(k, int(np.count_nonzero(np.isfinite(pontos))))
+    if k <= 0:
+        return []
+    melhores = np.argpartition(-pontos, k - 1)[:k]
+    melhores = melhores[np.argsort(-pontos[melhores], kind='stable')]
+    return [ids[i] for i in melhores]
+
+# ==========================================================
+# 4.14 ESTATÍSTICAS DE AGENDAMENTOS (CONTADORES DISTRIBUÍDOS + AGREGAÇÕES)
+# ==========================================================
+
+# O painel de estatísticas do admin não varre o histórico: cada escrita de agendamento
+# (pagamento e transições da seção 4.8) incrementa, no mesmo commit, contadores por status em
+# dois documentos: o total geral e o do mês da sessão, que guarda num só lugar a série por dia
+# ('dias') e a de cada psicólogo ('psicologos'). Cada contador é dividido em ESTATISTICAS_SHARDS
+# documentos (o Firestore aceita ~1 escrita/s sustentada por documento); a leitura soma os
+# shards. O painel lê (1 + meses da janela) x shards documentos, qualquer que seja o número de
+# psicólogos ou de dias. As agregações count()/sum() do Firestore ficam para o que é limitado
+# por natureza, como a fila de agendamentos pendentes.
+COLECAO_ESTATISTICAS = 'estatisticas_agendamentos'
+ESTATISTICAS_SHARDS = int(os.environ.get('ESTATISTICAS_SHARDS', '4'))
+ESTATISTICAS_DIAS_PADRAO = 30
+ESTATISTICAS_DIAS_MAX = 90
+ESTATISTICAS_DIAS_FUTUROS = 30 # Sessões já agendadas entram na série diária
+STATUS_AGENDAMENTO = ('Pendente', 'Confirmado', 'Realizada', 'Cancelada')
+STATUS_RECEITA = ('Pendente', 'Confirmado', 'Realizada')
+PERIODO_TOTAL = 'total'
+
+def _dia_estatistica(data_hora):
+    """'AAAA-MM-DD' da sessão no fuso de Brasília (None se o agendamento não tem data)."""
+    if not isinstance(data_hora, datetime):
+        return None
+    return data_hora.astimezone(FUSO_BRASILIA).date().isoformat()
+
+def _valor_numerico(valor):
+    try:
+        valor = float(valor or 0)
+    except (TypeError, ValueError):
+        return 0
+    return int(valor) if valor.is_integer() else valor
+
+def registrar_estatisticas(deltas, psicologo_id, data_hora, valor, de=None, para=None):
+    """Acumula em `deltas` a mudança de status de um agendamento (de=None: novo; para=None: excluído).
+
+    deltas: {periodo: {caminho do campo: variação}}, um documento por período ('total' ou
+    'AAAA-MM'), gravado por gravar_estatisticas().
+    """
+    if de == para:
+        return deltas
+    dia = _dia_estatistica(data_hora)
+    valor = _valor_numerico(valor)
+    escopos = [(PERIODO_TOTAL, ())]
+    if dia:
+        escopos += [(dia[:7], ('dias', dia))] + ([(dia[:7], ('psicologos', psicologo_id, dia))] if psicologo_id else [])
+    for periodo, prefixo in escopos:
+        campos = deltas.setdefault(periodo, {})
+        for status, sinal in ((de, -1), (para, 1)):
+            if status:
+                for caminho, variacao in ((prefixo + (f'contagem_{status}',), sinal),
+                                          (prefixo + (f'valor_{status}',), sinal * valor)):
+                    campos[caminho] = campos.get(caminho, 0) + variacao
+    return deltas
+
+def _referencia_estatistica(periodo, shard):
+    return db.collection(COLECAO_ESTATISTICAS).document(f"{periodo}_{shard}")
+
+def documento_estatisticas(periodo, campos, converter=None):
+    """Documento do período com os campos de registrar_estatisticas() em mapas aninhados (sem os zerados)."""
+    dados = {'periodo': periodo}
+    for caminho, variacao in campos.items():
+        if not variacao:
+            continue
+        *mapas, campo = caminho
+        destino = dados
+        for chave in mapas:
+            destino = destino.setdefault(chave, {})
+        destino[campo] = converter(variacao) if converter else variacao
+    return dados
+
+def gravar_estatisticas(lote, deltas):
+    """Inclui no lote um incremento por período, num shard sorteado (uma escrita por documento)."""
+    for periodo, campos in deltas.items():
+        if not any(campos.values()):
+            continue
+        # merge=True mescla os mapas: só os contadores incrementados são tocados
+        lote.set(_referencia_estatistica(periodo, random.randrange(ESTATISTICAS_SHARDS)),
+                 documento_estatisticas(periodo, campos, firestore.Increment), merge=True)
+
+def _somar_contadores(documentos):
+    """Soma os shards: {'contagem': {status: n}, 'valor': {status: v}}."""
+    soma = {'contagem': dict.fromkeys(STATUS_AGENDAMENTO, 0), 'valor': dict.fromkeys(STATUS_AGENDAMENTO, 0)}
+    for dados in documentos:
+        for campo, numero in dados.items():
+            tipo, _, status = campo.partition('_')
+            if tipo in soma and status:
+                soma[tipo][status] = soma[tipo].get(status, 0) + numero
+    soma['total'] = sum(soma['contagem'].values())
+    soma['receita'] = sum(soma['valor'].get(status, 0) for status in STATUS_RECEITA)
+    return soma
+
+def _meses_do_periodo(inicio, fim):
+    """'AAAA-MM' de cada mês entre as datas 'AAAA-MM-DD' inicio e fim."""
+    ano, mes = int(inicio[:4]), int(inicio[5:7])
+    meses = []
+    while f"{ano:04d}-{mes:02d}" <= fim[:7]:
+        meses.append(f"{ano:04d}-{mes:02d}")
+        ano, mes = (ano + 1, 1) if mes == 12 else (ano, mes + 1)
+    return meses
+
+def _agregar_pendentes():
+    """count() e sum('valor') no servidor dos pendentes com sessão ainda por vir.
+
+    A fila de confirmação só tem a agenda futura, então a agregação não cresce com o histórico
+    e o número sai exato (os contadores guardam pendentes antigos que nunca foram resolvidos).
+    """
+    consulta = (db.collection('agendamentos')
+                .where(filter=firestore.FieldFilter('status', '==', 'Pendente'))
+                .where(filter=firestore.FieldFilter('dataHoraInicio', '>=', datetime.now(FUSO_BRASILIA))))
+    # As duas agregações numa consulta só: uma RPC e uma cobrança de leitura de índice
+    resultado = consulta.count(alias='total').sum('valor', alias='valor').get()
+    valores = {agregacao.alias: agregacao.value for agregacao in resultado[0]}
+    return {'total': valores['total'], 'valor': valores['valor'] or 0}
+
+def _nomes_psicologos(ids):
+    """{id: nome} só dos psicólogos pedidos, numa leitura em lote (get_all) do campo 'nome'."""
+    if not ids:
+        return {}
+    referencias = [db.collection('psicologos').document(psicologo_id) for psicologo_id in ids]
+    return {snapshot.id: snapshot.get('nome') for snapshot in db.get_all(referencias, field_paths=['nome'])
+            if snapshot.exists and snapshot.to_dict().get('nome')}
+
+def carregar_estatisticas(dias=ESTATISTICAS_DIAS_PADRAO):
+    """Dados do painel: total geral, série diária, ranking de psicólogos e pendentes.
+
+    Uma leitura em lote (get_all) traz os shards do total e dos meses da janela: até
+    (1 + 5) x ESTATISTICAS_SHARDS documentos, sem depender do histórico nem do número de
+    psicólogos. A agregação dos pendentes sai em paralelo (seção 4.7); os nomes do ranking
+    vêm depois, num get_all só dos psicólogos listados.
+    """
+    hoje = datetime.now(FUSO_BRASILIA).date()
+    inicio = (hoje - timedelta(days=dias - 1)).isoformat()
+    fim = (hoje + timedelta(days=ESTATISTICAS_DIAS_FUTUROS)).isoformat()
+
+    pendentes = em_paralelo(_agregar_pendentes)
+    referencias = [_referencia_estatistica(periodo, shard)
+                   for periodo in [PERIODO_TOTAL] + _meses_do_periodo(inicio, fim)
+                   for shard in range(ESTATISTICAS_SHARDS)]
+    total, diario, por_psicologo = [], {}, {}
+    for snapshot in db.get_all(referencias):
+        if not snapshot.exists:
+            continue
+        dados = snapshot.to_dict()
+        if dados.get('periodo') == PERIODO_TOTAL:
+            total.append(dados)
+            continue
+        for dia, contadores in (dados.get('dias') or {}).items():
+            if inicio <= dia <= fim:
+                diario.setdefault(dia, []).append(contadores)
+        for psicologo_id, por_dia in (dados.get('psicologos') or {}).items():
+            for dia, contadores in por_dia.items():
+                if inicio <= dia <= fim:
+                    por_psicologo.setdefault(psicologo_id, []).append(contadores)
+
+    serie = sorted(((dia, _somar_contadores(docs)) for dia, docs in diario.items()), reverse=True)
+    ranking = sorted(((psicologo_id, _somar_contadores(docs)) for psicologo_id, docs in por_psicologo.items()),
+                     key=lambda item: (-item[1]['receita'], item[0]))
+    return {
+        'nomes': _nomes_psicologos([psicologo_id for psicologo_id, _ in ranking]),
+        'total': _somar_contadores(total),
+        'periodo': _somar_contadores(d for docs in diario.values() for d in docs),
+        'serie': serie,
+        'ranking': ranking,
+        'pendentes': pendentes.result(),
+        'inicio': inicio,
+        'fim': fim,
+    }
+
 # ==========================================================
 # 5. ROTAS DE AUTENTICAÇÃO (PSICÓLOGO E ADMIN) - CORRIGIDA
 # ==========================================================
@@ -300,6 +2886,12 @@ def login():
             flash("Bem-vindo, Administrador Geral!", 'success')
             return redirect(url_for('admin_dashboard'))
 
+        # No modo 'token' o psicólogo entra pelo Firebase Auth no navegador (/login/sessao);
+        # este formulário só chega aqui quando o Firebase recusou as credenciais
+        if LOGIN_MODO == 'token':
+            flash("E-mail ou senha inválidos.", 'error')
+            return renderizar_login()
+
         # 2. TENTA LOGIN VIA FIREBASE AUTH E FIREBASE FIRESTORE (PSICÓLOGO)
         psicologo_data = None
         psicologo_uid = None
@@ -311,27 +2903,25 @@ def login():
                 psicologo_uid = user.uid
 
                 # 2.2. BUSCA O PERFIL COMPLETO DO PSICÓLOGO NO FIRESTORE (Busca Persistente!)
-                # O ID do documento é o UID do Auth, garantindo a unicidade.
+                # O ID do documento é o UID do Auth: uma leitura pontual, feita só depois que o
+                # Auth aceitou o email. Buscar o perfil em paralelo com o Auth pouparia uma ida e
+                # volta, mas cobraria uma consulta ao Firestore a cada login recusado, inclusive
+                # de visitantes anônimos.
                 psicologo_doc = db.collection('psicologos').document(psicologo_uid).get()
                 
                 if psicologo_doc.exists:
-                    # Usamos a função get_all_psicologos para garantir que os campos sejam mapeados corretamente
-                    todos_psicologos = get_all_psicologos()
-                    psicologo_data = next((p for p in todos_psicologos if p['id'] == psicologo_uid), None)
-
-                    if not psicologo_data:
-                        flash("Erro de mapeamento de perfil de psicólogo.", 'error')
-                        return render_template('login.html', page_title='Login PsicoAPP')
+                    # Reaproveita o documento já lido, com o mesmo mapeamento de campos de get_all_psicologos
+                    psicologo_data = mapear_psicologo(psicologo_doc.id, psicologo_doc.to_dict())
                         
                 else:
                     # Usuário existe no Auth, mas não tem perfil de psicólogo
                     flash("Perfil de psicólogo não encontrado no banco de dados.", 'error')
-                    return render_template('login.html', page_title='Login PsicoAPP')
+                    return renderizar_login()
 
             except firebase_admin.exceptions.FirebaseError:
                 # O usuário não existe no Auth ou a busca falhou
                 flash("E-mail ou senha inválidos.", 'error')
-                return render_template('login.html', page_title='Login PsicoAPP')
+                return renderizar_login()
             
         
         # 3. VERIFICA E CONCLUI O LOGIN
@@ -344,19 +2934,65 @@ def login():
         # 4. Fallback (Se o DB estava offline ou a lógica acima falhou)
         flash("Falha ao conectar com o banco de dados ou erro de login. Tente novamente.", 'error')
             
-    return render_template('login.html', page_title='Login PsicoAPP')
+    return renderizar_login()
+
+@app.route('/login/sessao', methods=['POST'])
+def login_sessao():
+    """Troca o ID token do Firebase Auth (login feito no navegador) por um cookie de sessão do Firebase."""
+    if LOGIN_MODO != 'token':
+        return redirect(url_for('login'))
+
+    # 1. O ID token é conferido localmente (assinatura, projeto, validade): senha errada nem chega aqui
+    id_token = request.form.get('id_token')
+    claims = verificador_id_token.verificar(id_token)
+    if claims is None or time.time() - claims.get('auth_time', 0) > IDADE_MAXIMA_LOGIN:
+        flash("Não foi possível confirmar seu login. Entre novamente.", 'error')
+        return redirect(url_for('login'))
+
+    # 2. O UID do token é o ID do documento do psicólogo (mesmo mapeamento de get_all_psicologos)
+    psicologo_uid = claims['uid']
+    psicologo_data = get_psicologo_by_id(psicologo_uid)
+    if not psicologo_data:
+        flash("Perfil de psicólogo não encontrado no banco de dados.", 'error')
+        return redirect(url_for('login'))
+
+    # 3. Cookie de sessão do Firebase: conferido a cada requisição sem chamadas remotas
+    try:
+        cookie = auth.create_session_cookie(id_token, expires_in=DURACAO_SESSAO_FIREBASE)
+    except firebase_admin.exceptions.FirebaseError as e:
+        print(f"Erro ao criar o cookie de sessão do Firebase: {e}")
+        flash("Não foi possível confirmar seu login. Entre novamente.", 'error')
+        return redirect(url_for('login'))
+
+    session['psicologo_uid'] = psicologo_uid
+    session['user_role'] = 'psicologo'
+    flash(f"Bem-vindo(a), {psicologo_data.get('nome', 'Psicólogo(a)')}!", 'info')
+    resposta = redirect(url_for('dashboard'))
+    resposta.set_cookie(COOKIE_SESSAO_FIREBASE, cookie, max_age=int(DURACAO_SESSAO_FIREBASE.total_seconds()),
+                        httponly=True, secure=request.is_secure or app.config['SESSION_COOKIE_SECURE'],
+                        samesite='Lax')
+    return resposta
 
 @app.route('/logout')
 def logout():
     session.pop('psicologo_uid', None)
     session.pop('user_role', None)
     flash("Você saiu da sua conta.", 'info')
-    return redirect(url_for('index'))
+    resposta = redirect(url_for('index'))
+    if COOKIE_SESSAO_FIREBASE in request.cookies:
+        resposta.delete_cookie(COOKIE_SESSAO_FIREBASE)
+    return resposta
 
 # ==========================================================
 # 6. ROTA PROTEGIDA (DASHBOARD PSICÓLOGO) - CORRIGIDA DEFINITIVAMENTE
 # ==========================================================
 
+# Status exibidos no dashboard (o restante fica no histórico) e campos usados pelos cards
+STATUS_AGENDAMENTO_ATIVOS = ['Pendente', 'Confirmado']
+CAMPOS_CARD_AGENDAMENTO = ['dataHoraSessao', 'dataHoraInicio', 'usuarioEmail', 'sessaoTipo', 'status', 'linkSessao']
+# Sessões ativas por página do dashboard (a partir de hoje, das mais próximas para as mais distantes)
+DASHBOARD_POR_PAGINA = int(os.environ.get('DASHBOARD_POR_PAGINA', '20'))
+
 @app.route('/dashboard')
 def dashboard():
     if session.get('user_role') != 'psicologo':
@@ -366,32 +3002,54 @@ def dashboard():
     psicologo_uid = session.get('psicologo_uid')
     
     # Tenta buscar dados do psicólogo do DB para ter o nome correto
-    psicologo_data = next((p for p in get_all_psicologos() if p['id'] == psicologo_uid), 
-                          {"nome": "Psicólogo(a) Teste", "id": psicologo_uid})
+    # (em paralelo com a consulta dos agendamentos abaixo)
+    psicologo_futuro = em_paralelo(get_psicologo_by_id, psicologo_uid)
                           
     agendamentos = [] # Inicializa vazio
+    proximo_cursor = None
+
+    # Cursor da página (data + ID da última sessão exibida), como no histórico
+    apos_id = request.args.get('apos') or None
+    apos_em = None
+    if apos_id:
+        try:
+            apos_em = datetime.fromisoformat(request.args.get('apos_em', ''))
+        except ValueError:
+            apos_id = None # Cursor inválido: volta para a primeira página
 
     # 1. TENTA BUSCAR DADOS REAIS NO FIREBASE
     if db:
         try:
             # 🚨 PONTO CRÍTICO CORRIGIDO: Busca agendamentos com FieldFilter e o ID correto
             # O campo no DB é 'psicologo_id', e o valor é o 'psicologo_uid' da sessão
-            agendamento_docs = db.collection('agendamentos').where(
-                filter=FieldFilter('psicologo_id', '==', psicologo_uid)
-            ).stream()
-            
+            # Apenas os status ativos e os campos exibidos nos cards: o histórico (Realizada/Cancelada,
+            # com o texto do prontuário) fica em /psicologo/historico, paginado.
+            # Só sessões de hoje em diante, uma página por vez: o custo não cresce com o histórico.
+            inicio_hoje = datetime.now(FUSO_BRASILIA).replace(hour=0, minute=0, second=0, microsecond=0)
+            query = db.collection('agendamentos') \
+                .where(filter=firestore.FieldFilter('psicologo_id', '==', psicologo_uid)) \
+                .where(filter=firestore.FieldFilter('status', 'in', STATUS_AGENDAMENTO_ATIVOS)) \
+                .where(filter=firestore.FieldFilter('dataHoraInicio', '>=', inicio_hoje)) \
+                .order_by('dataHoraInicio') \
+                .order_by('__name__') \
+                .select(CAMPOS_CARD_AGENDAMENTO)
+            if apos_id:
+                query = query.start_after({'dataHoraInicio': apos_em, '__name__': apos_id})
+
+            # Um documento a mais só para saber se existe próxima página
+            agendamento_docs = list(query.limit(DASHBOARD_POR_PAGINA + 1).stream())
+
             # Converte os documentos encontrados para uma lista de dicionários
-            for doc in agendamento_docs:
+            for doc in agendamento_docs[:DASHBOARD_POR_PAGINA]:
                 agendamento = doc.to_dict()
                 agendamento['doc_id'] = doc.id # Adiciona o ID do documento
                 agendamentos.append(agendamento)
-            
-            # DEBUG: Checagem de carregamento (Aparecerá no console)
-            print(f"\n--- DEBUG: Carregamento do Dashboard ---")
-            print(f"ID do Psicólogo Logado: {psicologo_uid}")
-            print(f"Agendamentos carregados do DB: {len(agendamentos)}")
-            print("------------------------------------------\n")
 
+            if len(agendamento_docs) > DASHBOARD_POR_PAGINA:
+                ultimo = agendamentos[-1]
+                proximo_cursor = {'apos': ultimo['doc_id'], 'apos_em': ultimo['dataHoraInicio'].isoformat()}
+            
+            # Leituras e tempo desta consulta saem no Server-Timing e no log da requisição (seção 1.1)
         except Exception as e:
             print(f"ERRO CRÍTICO ao buscar agendamentos no Firebase: {e}")
             flash("Erro ao carregar seus agendamentos. Tente novamente mais tarde.", 'error')
@@ -413,10 +3071,22 @@ def dashboard():
     if not agendamentos and db:
         flash("Você não possui agendamentos confirmados no momento.", 'info')
 
+    psicologo_data = psicologo_futuro.result() or {"nome": "Psicólogo(a) Teste", "id": psicologo_uid}
+
+    # 3. AGRUPA POR STATUS EM UMA ÚNICA PASSADA (o template não precisa mais filtrar a lista)
+    agendamentos_por_status = {status: [] for status in STATUS_AGENDAMENTO_ATIVOS}
+    for agendamento in agendamentos:
+        grupo = agendamentos_por_status.get(agendamento.get('status'))
+        if grupo is not None:
+            grupo.append(agendamento)
+
     return render_template('dashboard.html', 
                             page_title='Dashboard', 
                             psicologo=psicologo_data, 
-                            agendamentos=agendamentos)
+                            confirmadas=agendamentos_por_status['Confirmado'],
+                            pendentes=agendamentos_por_status['Pendente'],
+                            pagina_apos=apos_id,
+                            proximo_cursor=proximo_cursor)
 
 # Coloque esta rota no seu app.py (Seção 6, após a rota /dashboard)
 
@@ -438,26 +3108,12 @@ def finalizar_consulta(doc_id):
         return redirect(url_for('dashboard'))
 
     try:
-        consulta_ref = db.collection('agendamentos').document(doc_id)
-        consulta_doc = consulta_ref.get()
-
-        if not consulta_doc.exists:
-            flash("Erro: Consulta não encontrada.", 'error')
-            return redirect(url_for('dashboard'))
-        
-        # 2. VERIFICAÇÃO DE AUTORIZAÇÃO (DONO DA CONSULTA)
-        if consulta_doc.to_dict().get('psicologo_id') != psicologo_uid:
-            flash("Você não tem permissão para finalizar esta consulta.", 'error')
-            return redirect(url_for('dashboard'))
-
-        # 3. ATUALIZAÇÃO DO FIRESTORE
-        consulta_ref.update({
-            'status': 'Realizada',
+        # 2 e 3. VERIFICAÇÃO DE AUTORIZAÇÃO (DONO DA CONSULTA) E ATUALIZAÇÃO ATÔMICA (seção 4.8)
+        resultado = transicionar_agendamentos([doc_id], 'concluir', psicologo_uid, {
             'prontuario': prontuario, # NOVO CAMPO
-            'dataFinalizacao': firestore.SERVER_TIMESTAMP # Para histórico
         })
-        
-        flash("Registro da consulta e prontuário salvos com sucesso! Status: Realizada.", 'success')
+        flash_transicao_unica(resultado, 'finalizar',
+                              "Registro da consulta e prontuário salvos com sucesso! Status: Realizada.")
 
     except Exception as e:
         flash(f"Erro ao finalizar a consulta: {e}", 'error')
@@ -483,22 +3139,11 @@ def cancelar_consulta(doc_id):
         return redirect(url_for('dashboard'))
 
     try:
-        consulta_ref = db.collection('agendamentos').document(doc_id)
-        consulta_doc = consulta_ref.get()
-        
-        # 2. VERIFICAÇÃO DE AUTORIZAÇÃO (DONO DA CONSULTA)
-        if consulta_doc.exists and consulta_doc.to_dict().get('psicologo_id') != psicologo_uid:
-            flash("Você não tem permissão para cancelar esta consulta.", 'error')
-            return redirect(url_for('dashboard'))
-        
-        # 3. ATUALIZAÇÃO DO FIRESTORE
-        consulta_ref.update({
-            'status': 'Cancelada',
+        # 2 e 3. VERIFICAÇÃO DE AUTORIZAÇÃO (DONO DA CONSULTA) E ATUALIZAÇÃO ATÔMICA (seção 4.8)
+        resultado = transicionar_agendamentos([doc_id], 'cancelar', psicologo_uid, {
             'motivo_cancelamento': motivo, # NOVO CAMPO
-            'dataCancelamento': firestore.SERVER_TIMESTAMP
         })
-        
-        flash("Consulta alterada para Cancelada com sucesso.", 'info')
+        flash_transicao_unica(resultado, 'cancelar', "Consulta alterada para Cancelada com sucesso.")
 
     except Exception as e:
         flash(f"Erro ao cancelar a consulta: {e}", 'error')
@@ -521,26 +3166,20 @@ def mudar_status_agendamento(doc_id, action):
         flash("Erro: Conexão com o Banco de Dados (Firebase) indisponível. Status não alterado.", 'error')
         return redirect(url_for('dashboard'))
 
-    # Mapeia a ação para o status final
+    # Mapeia a ação para a transição (status final em TRANSICOES_AGENDAMENTO, seção 4.8)
     if action == 'concluir':
-        novo_status = 'Concluída'
         mensagem = 'Agendamento marcado como CONCLUÍDO.'
     elif action == 'cancelar':
-        novo_status = 'Cancelada'
         mensagem = 'Agendamento CANCELADO com sucesso.'
     else:
         flash("Ação inválida.", 'error')
         return redirect(url_for('dashboard'))
         
     try:
-        # 1. Referência ao documento de agendamento no Firestore
-        # O 'doc_id' é o ID do documento da coleção 'agendamentos'
-        agendamento_ref = db.collection('agendamentos').document(doc_id)
-        
-        # 2. Atualiza o campo 'status' no Firestore
-        agendamento_ref.update({'status': novo_status})
-        
-        flash(mensagem, 'success')
+        # O admin altera qualquer agendamento; o psicólogo, apenas os seus
+        dono = None if session.get('user_role') == 'admin' else session.get('psicologo_uid')
+        resultado = transicionar_agendamentos([doc_id], action, dono)
+        flash_transicao_unica(resultado, action, mensagem)
         
     except Exception as e:
         flash(f"Erro ao atualizar o status do agendamento: {e}", 'error')
@@ -550,6 +3189,19 @@ def mudar_status_agendamento(doc_id, action):
 
 # Coloque este código no seu app.py, junto das outras rotas protegidas (Seção 6)
 
+HISTORICO_POR_PAGINA = int(os.environ.get('HISTORICO_POR_PAGINA', '20'))
+
+def _ler_data_filtro(nome):
+    """Lê um filtro de data ('AAAA-MM-DD') da query string. Retorna None se vazio ou inválido."""
+    valor = request.args.get(nome)
+    if not valor:
+        return None
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d').replace(tzinfo=FUSO_BRASILIA)
+    except ValueError:
+        flash(f"Data inválida ignorada no filtro: {valor}", 'error')
+        return None
+
 @app.route('/psicologo/historico')
 def historico_consultas():
     # 1. VERIFICAÇÃO DE SEGURANÇA
@@ -564,44 +3216,134 @@ def historico_consultas():
         return redirect(url_for('dashboard'))
 
     historico_list = []
+
+    # Período opcional (inclusivo) e cursor da página (data + ID do último registro exibido)
+    data_de = _ler_data_filtro('de')
+    data_ate = _ler_data_filtro('ate')
+    apos_id = request.args.get('apos') or None
+    apos_em = None
+    if apos_id:
+        try:
+            apos_em = datetime.fromisoformat(request.args.get('apos_em', ''))
+        except ValueError:
+            apos_id = None # Cursor inválido: volta para a primeira página
     
     try:
         # 2. BUSCA NO FIRESTORE
         # Filtra por 'psicologo_id' e status 'Realizada' ou 'Cancelada'
         # Nota: O filtro 'in' é a forma mais eficiente de buscar múltiplos status
-        historico_docs = db.collection('agendamentos') \
-            .where(filter=FieldFilter('psicologo_id', '==', psicologo_uid)) \
-            .where(filter=FieldFilter('status', 'in', ['Realizada', 'Cancelada'])) \
-            .order_by('dataHoraSessao', direction='DESCENDING') \
-            .stream()
-
-        # 3. PROCESSAMENTO DOS DADOS
-        for doc in historico_docs:
+        query = db.collection('agendamentos') \
+            .where(filter=firestore.FieldFilter('psicologo_id', '==', psicologo_uid)) \
+            .where(filter=firestore.FieldFilter('status', 'in', ['Realizada', 'Cancelada']))
+
+        if data_de:
+            query = query.where(filter=firestore.FieldFilter('dataHoraInicio', '>=', data_de))
+        if data_ate:
+            query = query.where(filter=firestore.FieldFilter('dataHoraInicio', '<', data_ate + timedelta(days=1)))
+
+        # 'dataHoraInicio' é gravado como timestamp em pagamento(); o ID desempata registros no mesmo horário
+        query = query.order_by('dataHoraInicio', direction='DESCENDING') \
+                     .order_by('__name__', direction='DESCENDING')
+        if apos_id:
+            query = query.start_after({'dataHoraInicio': apos_em, '__name__': apos_id})
+
+        # Um documento a mais só para saber se existe próxima página
+        historico_docs = list(query.limit(HISTORICO_POR_PAGINA + 1).stream())
+
+        # 3. PROCESSAMENTO DOS DADOS (a data já vem formatada do momento da gravação)
+        for doc in historico_docs[:HISTORICO_POR_PAGINA]:
             consulta = doc.to_dict()
             consulta['doc_id'] = doc.id
-            
-            # Formatação da data (apenas para exibição no template)
-            if isinstance(consulta.get('dataHoraSessao'), str):
-                # Tentativa de converter string para objeto datetime para formatação
-                try:
-                    dt_obj = datetime.strptime(consulta['dataHoraSessao'], '%Y-%m-%dT%H:%M')
-                    consulta['data_formatada'] = dt_obj.strftime('%d/%m/%Y às %H:%M')
-                except ValueError:
-                    consulta['data_formatada'] = consulta['dataHoraSessao']
-            else:
-                 consulta['data_formatada'] = 'Data indisponível'
-                
+            consulta['data_formatada'] = consulta.get('dataFormatada') or consulta.get('dataHoraSessao') or 'Data indisponível'
             historico_list.append(consulta)
+
+        # Filtros de período repetidos nos links de navegação
+        filtros_periodo = {nome: request.args.get(nome) for nome in ('de', 'ate') if request.args.get(nome)}
+
+        # Parâmetros do link "Mais Antigas" (cursor + filtros), se existir próxima página
+        proximo_cursor = None
+        if len(historico_docs) > HISTORICO_POR_PAGINA:
+            ultimo = historico_list[-1]
+            proximo_cursor = dict(filtros_periodo, apos=ultimo['doc_id'], apos_em=ultimo['dataHoraInicio'].isoformat())
         
         # 4. RENDERIZAÇÃO
         return render_template('historico.html', 
                                page_title='Histórico de Consultas',
-                               historico=historico_list)
+                               historico=historico_list,
+                               filtros_periodo=filtros_periodo,
+                               pagina_apos=apos_id,
+                               proximo_cursor=proximo_cursor)
 
     except Exception as e:
         flash(f"Erro ao carregar o histórico: {e}", 'error')
         return redirect(url_for('dashboard'))
 
+@app.cli.command('migrar-datas-agendamentos')
+def migrar_datas_agendamentos():
+    """Preenche dataHoraInicio/dataFormatada nos agendamentos antigos (flask migrar-datas-agendamentos)."""
+    atualizados = 0
+    batch = db.batch()
+    pendentes = 0
+
+    for doc in db.collection('agendamentos').stream():
+        dados = doc.to_dict()
+        if dados.get('dataHoraInicio'):
+            continue
+
+        # O ano das datas no formato do formulário é deduzido a partir da criação do agendamento
+        criado_em = dados.get('criadoEm')
+        referencia = criado_em.astimezone(FUSO_BRASILIA) if isinstance(criado_em, datetime) else None
+        campos = campos_data_sessao(dados.get('dataHoraSessao'), referencia)
+        if not campos:
+            print(f"Aviso: data não reconhecida no agendamento {doc.id}: {dados.get('dataHoraSessao')!r}")
+            continue
+
+        batch.update(doc.reference, campos)
+        pendentes += 1
+        atualizados += 1
+        if pendentes == 500: # Limite de operações por WriteBatch
+            batch.commit()
+            batch = db.batch()
+            pendentes = 0
+
+    if pendentes:
+        batch.commit()
+    print(f"✅ {atualizados} agendamentos atualizados.")
+
+@app.cli.command('recontar-estatisticas')
+def recontar_estatisticas():
+    """Refaz os contadores do painel de estatísticas a partir do histórico (flask recontar-estatisticas).
+
+    Necessário uma vez, para os agendamentos anteriores aos contadores. Rode com o app parado:
+    escritas feitas durante a recontagem podem ser contadas em dobro ou perdidas.
+    """
+    deltas = {}
+    for doc in db.collection('agendamentos').select(['psicologo_id', 'status', 'dataHoraInicio', 'valor']).stream():
+        dados = doc.to_dict()
+        registrar_estatisticas(deltas, dados.get('psicologo_id'), dados.get('dataHoraInicio'), dados.get('valor'),
+                               para=dados.get('status'))
+
+    batch = db.batch()
+    pendentes = 0
+    for doc in db.collection(COLECAO_ESTATISTICAS).select([]).stream():
+        batch.delete(doc.reference)
+        pendentes += 1
+        if pendentes == 500: # Limite de operações por WriteBatch
+            batch.commit()
+            batch = db.batch()
+            pendentes = 0
+    for periodo, campos in deltas.items():
+        batch.set(_referencia_estatistica(periodo, 0), documento_estatisticas(periodo, campos))
+        pendentes += 1
+        if pendentes == 500:
+            batch.commit()
+            batch = db.batch()
+            pendentes = 0
+
+    if pendentes:
+        batch.commit()
+    print(f"✅ Contadores de {len(deltas)} períodos gravados.")
+
 # ==========================================================
 # 7. ROTAS DE ADMINISTRAÇÃO GERAL (CRUD COMPLETO)
 # ==========================================================
@@ -619,12 +3361,41 @@ def admin_required(f):
 @app.route('/admin/dashboard')
 @admin_required
 def admin_dashboard():
-    # Usa a função corrigida para exibir todos os psicólogos cadastrados
-    psicologos_cadastrados = process_psicologos_for_template(get_all_psicologos())
+    # Exibe os psicólogos cadastrados página a página (cursor 'apos' + 'limite' na URL)
+    apos, limite = ler_parametros_paginacao()
+    pagina, proximo_cursor = get_pagina_psicologos(apos, limite)
+    psicologos_cadastrados = process_psicologos_for_template(pagina)
     
     return render_template('admin/dashboard.html', 
                             page_title='Admin | Painel Geral',
-                            psicologos=psicologos_cadastrados)
+                            psicologos=psicologos_cadastrados,
+                            total_psicologos=contar_psicologos(),
+                            pagina_apos=apos,
+                            proximo_cursor=proximo_cursor)
+
+@app.route('/admin/estatisticas')
+@admin_required
+def admin_estatisticas():
+    # Contadores da seção 4.14: o custo da página não cresce com o histórico de agendamentos
+    try:
+        dias = min(max(int(request.args.get('dias', ESTATISTICAS_DIAS_PADRAO)), 1), ESTATISTICAS_DIAS_MAX)
+    except ValueError:
+        dias = ESTATISTICAS_DIAS_PADRAO
+
+    estatisticas = None
+    if db:
+        try:
+            estatisticas = carregar_estatisticas(dias)
+        except Exception as e:
+            app.logger.error(f"Erro ao carregar as estatísticas: {e}")
+            flash("Não foi possível carregar as estatísticas agora.", 'error')
+
+    return render_template('admin/estatisticas.html',
+                           page_title='Admin | Estatísticas',
+                           estatisticas=estatisticas,
+                           status_agendamento=STATUS_AGENDAMENTO,
+                           dias=dias,
+                           total_psicologos=contar_psicologos())
 
 @app.route('/admin/cadastro_psicologo', methods=['GET', 'POST'])
 @admin_required
@@ -655,8 +3426,13 @@ def cadastro_psicologo():
             unique_filename = f"{uuid.uuid4().hex}_{filename}"
             try:
                 # Salva o arquivo no sistema de arquivos
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], unique_filename))
+                caminho_upload = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+                os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True) # Cria a pasta se ela não existir
+                file.save(caminho_upload)
+                metrica_upload_avatar_bytes.observe(os.path.getsize(caminho_upload))
                 avatar_filename = unique_filename # Salva APENAS o nome único
+                # Miniaturas geradas em segundo plano (o cadastro não espera a conversão)
+                agendar_miniaturas_avatar(unique_filename)
             except Exception as e:
                 flash(f"Aviso: Erro ao salvar o arquivo de foto: {e}. O cadastro continuará sem a foto.", 'warning')
                 avatar_filename = 'default_avatar.jpg' # Usa o default em caso de erro de I/O
@@ -694,6 +3470,7 @@ def cadastro_psicologo():
             
             # Usa o UID do Auth como ID do documento no Firestore
             db.collection('psicologos').document(psicologo_uid).set(db_data_to_save)
+            atualizar_psicologo_no_cache(psicologo_uid)
             
             flash(f"Psicólogo {nome} cadastrado com sucesso! ID: {psicologo_uid}", 'success')
             return redirect(url_for('admin_dashboard'))
@@ -702,6 +3479,7 @@ def cadastro_psicologo():
             # Em caso de erro do Firebase (ex: e-mail já existe), tentamos limpar o arquivo salvo
             if avatar_filename != 'default_avatar.jpg' and os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], avatar_filename)):
                 os.remove(os.path.join(app.config['UPLOAD_FOLDER'], avatar_filename))
+                remover_miniaturas_avatar(avatar_filename)
                 
             flash(f"Erro no Firebase (Auth/DB): {e}", 'error')
         except Exception as e:
@@ -734,8 +3512,12 @@ def editar_psicologo(psicologo_uid):
             try:
                 # Tenta salvar localmente (só funcionará em ambiente de desenvolvimento)
                 # No Render, isso vai falhar, mas o 'except' vai capturar.
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], unique_filename))
+                caminho_upload = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+                os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True) # Cria a pasta se ela não existir
+                file.save(caminho_upload)
+                metrica_upload_avatar_bytes.observe(os.path.getsize(caminho_upload))
                 avatar_filename = unique_filename
+                agendar_miniaturas_avatar(unique_filename)
                 flash("Nova foto de perfil enviada com sucesso.", 'info')
             except Exception as e:
                 # Adiciona log para o Render
@@ -759,6 +3541,7 @@ def editar_psicologo(psicologo_uid):
         try:
             # 1. Atualiza o Firestore
             psicologo_ref.update(dados_atualizados)
+            atualizar_psicologo_no_cache(psicologo_uid)
             
             # Não precisamos mais atualizar o MOCK aqui
             
@@ -775,31 +3558,26 @@ def editar_psicologo(psicologo_uid):
         # GET: Carrega os dados atuais (Prioriza DB)
         psicologo = None
         
-        if db:
-            try:
-                # Usa get_all_psicologos para garantir o mapeamento de campos (bio->descricaoCurta, etc)
-                todos_psicologos = get_all_psicologos()
-                psicologo = next((p for p in todos_psicologos if p['id'] == psicologo_uid), None)
-
-            except Exception as e:
-                # Adiciona log para o Render
-                app.logger.error(f"Erro ao buscar psicologos no GET de editar_psicologo: {e}") 
-                pass 
+        try:
+            # Usa get_psicologo_by_id para garantir o mapeamento de campos (bio->descricaoCurta, etc)
+            # Se o DB estiver offline, a própria função busca no MOCK
+            psicologo = get_psicologo_by_id(psicologo_uid)
 
-        if not psicologo:
-             # Se não encontrou no DB ou o DB está offline, busca no MOCK (get_all_psicologos já retorna o mock se DB falhar)
-             psicologo = next((p for p in get_all_psicologos() if p['id'] == psicologo_uid), None)
+        except Exception as e:
+            # Adiciona log para o Render
+            app.logger.error(f"Erro ao buscar psicologo no GET de editar_psicologo: {e}") 
 
         if not psicologo:
              flash("Erro ao carregar dados do psicólogo. Não encontrado no DB ou MOCK.", 'error')
              return redirect(url_for('admin_dashboard'))
 
-        if not isinstance(psicologo.get('tags'), list):
-             psicologo['tags'] = []
-        
         # Para exibir a foto atual no template de edição, precisamos do URL
+        # (process_psicologos_for_template devolve uma cópia, o cache não é alterado)
         psicologo = process_psicologos_for_template([psicologo])[0]
 
+        if not isinstance(psicologo.get('tags'), list):
+             psicologo['tags'] = []
+
         return render_template('admin/editar_psicologo.html', 
                                 page_title='Admin | Editar Profissional',
                                 psicologo=psicologo)
@@ -813,10 +3591,13 @@ def excluir_psicologo(psicologo_uid):
         flash("Erro: Conexão com o Banco de Dados (Firebase) indisponível. A exclusão não foi realizada.", 'error')
         return redirect(url_for('admin_dashboard'))
     
+    # A exclusão no Auth não depende do documento: começa enquanto o nome da foto é lido
+    exclusao_auth = em_paralelo(auth.delete_user, psicologo_uid)
+
     # Tenta obter o nome da foto antes de excluir o registro
     foto_para_deletar = 'default_avatar.jpg'
     try:
-        doc = db.collection('psicologos').document(psicologo_uid).get()
+        doc = db.collection('psicologos').document(psicologo_uid).get(field_paths=['fotoURL'])
         if doc.exists:
              foto_para_deletar = doc.to_dict().get('fotoURL', 'default_avatar.jpg')
     except Exception as e:
@@ -824,11 +3605,12 @@ def excluir_psicologo(psicologo_uid):
 
 
     try:
-        # 1. Exclui do Firebase Authentication
-        auth.delete_user(psicologo_uid)
+        # 1. Exclui do Firebase Authentication (aguarda a chamada iniciada acima)
+        exclusao_auth.result()
         
         # 2. Exclui do Firestore
         db.collection('psicologos').document(psicologo_uid).delete()
+        remover_psicologo_do_cache(psicologo_uid)
         
         # 3. Exclui a imagem física (se não for o default)
         if foto_para_deletar != 'default_avatar.jpg':
@@ -836,12 +3618,14 @@ def excluir_psicologo(psicologo_uid):
              if os.path.exists(caminho_foto):
                  os.remove(caminho_foto)
                  print(f"Foto excluída do sistema de arquivos: {foto_para_deletar}")
+             remover_miniaturas_avatar(foto_para_deletar)
                  
         flash(f"Psicólogo (ID: {psicologo_uid}) foi excluído com sucesso do Auth, DB e arquivos.", 'success')
 
     except auth.UserNotFoundError:
         # A conta Auth não existia, apenas exclui do DB/Mock
         db.collection('psicologos').document(psicologo_uid).delete()
+        remover_psicologo_do_cache(psicologo_uid)
         flash(f"Psicólogo (ID: {psicologo_uid}) excluído apenas do DB (Não estava no Auth).", 'info')
         
     except Exception as e:
@@ -854,14 +3638,14 @@ def excluir_psicologo(psicologo_uid):
 @app.route('/psicologo/agendamento/excluir/<doc_id>', methods=['POST'])
 
 def excluir_agendamento(doc_id):
-    # O decorator @psicologo_required ou a verificação de segurança (session.get('user_role'))
-    # já deve garantir que apenas o psicólogo acesse.
+    # Apenas o psicólogo dono do registro, e só para consultas Realizadas ou Canceladas (seção 4.8)
+    if session.get('user_role') != 'psicologo':
+        flash("Acesso negado.", 'error')
+        return redirect(url_for('login'))
         
     try:
-        # Assumindo 'db' é o seu objeto firestore.client()
-        db.collection('agendamentos').document(doc_id).delete()
-        
-        flash("Registro excluído com sucesso.", 'success')
+        resultado = transicionar_agendamentos([doc_id], 'excluir', session.get('psicologo_uid'))
+        flash_transicao_unica(resultado, 'excluir', "Registro excluído com sucesso.")
         
     except Exception as e:
         print(f"Erro ao excluir agendamento {doc_id}: {e}")
@@ -884,12 +3668,9 @@ def confirmar_agendamento(doc_id):
         return redirect(url_for('dashboard'))
 
     try:
-        # Atualiza apenas o campo 'status'
-        db.collection('agendamentos').document(doc_id).update({
-            'status': 'Confirmado'
-        })
-        
-        flash("Agendamento confirmado e movido para 'Sessões Confirmadas'.", 'success')
+        # Atualiza apenas o campo 'status', se a consulta for do psicólogo e ainda estiver Pendente
+        resultado = transicionar_agendamentos([doc_id], 'confirmar', session.get('psicologo_uid'))
+        flash_transicao_unica(resultado, 'confirmar', "Agendamento confirmado e movido para 'Sessões Confirmadas'.")
         
     except Exception as e:
         print(f"Erro ao confirmar agendamento {doc_id}: {e}")
@@ -898,32 +3679,58 @@ def confirmar_agendamento(doc_id):
     # Redireciona de volta para o Dashboard
     return redirect(url_for('dashboard'))
 
+@app.route('/psicologo/agendamentos/lote', methods=['POST'])
+def agendamentos_em_lote():
+    """Confirma, cancela ou conclui de uma vez os agendamentos marcados no dashboard (um único WriteBatch)."""
+    if session.get('user_role') != 'psicologo':
+        flash("Acesso negado.", 'error')
+        return redirect(url_for('login'))
+
+    acao = request.form.get('acao')
+    doc_ids = [doc_id for doc_id in request.form.getlist('doc_ids') if doc_id]
+    if acao not in ('confirmar', 'cancelar', 'concluir'):
+        flash("Ação inválida.", 'error')
+        return redirect(url_for('dashboard'))
+    if not doc_ids:
+        flash("Selecione ao menos um agendamento.", 'info')
+        return redirect(url_for('dashboard'))
+    if len(doc_ids) > LIMITE_LOTE_AGENDAMENTOS:
+        flash(f"Selecione no máximo {LIMITE_LOTE_AGENDAMENTOS} agendamentos por vez.", 'error')
+        return redirect(url_for('dashboard'))
+
+    if not db:
+        flash("Erro de conexão com o Banco de Dados.", 'error')
+        return redirect(url_for('dashboard'))
+
+    campos = None
+    if acao == 'cancelar':
+        campos = {'motivo_cancelamento': request.form.get('motivo_cancelamento')
+                  or 'Cancelado pelo psicólogo sem motivo especificado.'}
+
+    try:
+        resultado = transicionar_agendamentos(doc_ids, acao, session.get('psicologo_uid'), campos)
+    except Exception as e:
+        print(f"Erro na ação em lote '{acao}' ({len(doc_ids)} agendamentos): {e}")
+        flash("Erro ao atualizar os agendamentos selecionados. Confira no dashboard quais foram alterados.", 'error')
+        return redirect(url_for('dashboard'))
+
+    if resultado['alterados']:
+        flash(f"{len(resultado['alterados'])} agendamento(s) {TRANSICOES_AGENDAMENTO[acao]['rotulo']}.", 'success')
+    ignorados = len(resultado['nao_encontrados']) + len(resultado['sem_permissao']) + len(resultado['status_invalido'])
+    if ignorados:
+        flash(f"{ignorados} agendamento(s) ignorado(s): não encontrados, de outro psicólogo ou com status que não permite a ação.", 'info')
+    return redirect(url_for('dashboard'))
+
 
 # ==========================================================
 # 8. ROTAS PÚBLICAS (FLUXO DO CLIENTE)
 # ==========================================================
 
 @app.route('/')
+@cache_de_pagina()
 def index():
-    psicologos_com_url = [] # Define uma lista vazia como fallback
-    
-    try:
-        # Tenta obter os dados do Firebase (onde pode falhar se a conexão for interrompida)
-        psicologos = get_all_psicologos() 
-        
-        # Só processa se houver dados
-        if psicologos:
-            psicologos_com_url = process_psicologos_for_template(psicologos)
-            
-    except Exception as e:
-        # Registra o erro detalhado no log do Render
-        app.logger.error(f"Erro CRÍTICO ao carregar psicólogos na rota '/': {e}")
-        # Opcionalmente, pode-se carregar dados de mock aqui se o DB falhar
-        # psicologos_com_url = MOCK_PSICOLOGOS 
-        flash("Não foi possível carregar a lista de psicólogos. Tente novamente mais tarde.", 'error')
-
-
-    return render_template('index.html', page_title='Home', psicologos=psicologos_com_url)
+    # A home só tem chamadas para a triagem e para a listagem: nenhum psicólogo é lido aqui
+    return render_template('index.html', page_title='Home')
 
 
 @app.route('/triagem', methods=['GET', 'POST'])
@@ -951,10 +3758,15 @@ def triagem():
         else:
               linha_recomendada = ""
 
+        # Ranking de todos os profissionais pelas respostas (seção 4.13); os filtros acima
+        # continuam preenchendo o formulário de busca da listagem
+        psicologos_base, indice = get_diretorio_psicologos()
+        pesos = pesos_triagem(problema_principal, nivel_ansiedade, nivel_depressao)
         session['triagem_filtros'] = {
             'genero': preferencia_genero,
             'foco': " ".join(list(set(focos_recomendados))), 
-            'linha': linha_recomendada
+            'linha': linha_recomendada,
+            'ranking': recomendar_psicologos(indice, psicologos_base, pesos, preferencia_genero),
         }
 
         flash("Excelente! Com base nas suas respostas, encontramos os profissionais mais adequados. Role para baixo para ver a lista.", 'success')
@@ -963,53 +3775,82 @@ def triagem():
     return render_template('triagem.html', page_title='Avaliação Rápida')
 
 @app.route('/psicologos', methods=['GET', 'POST'])
+@cache_de_pagina('apos', 'limite', 'q', 'foco', 'genero', 'linha')
 def psicologos_list():
-    # USA A FUNÇÃO CORRIGIDA PARA OBTER OS DADOS DO FIREBASE
-    psicologos_base = get_all_psicologos() 
-    psicologos_filtrados = psicologos_base # Começa a filtragem com todos os dados
-    
+    apos, limite = ler_parametros_paginacao()
     filtros = {}
     
+    ranking = None
     triagem_filtros = session.pop('triagem_filtros', None)
     if triagem_filtros:
+        ranking = triagem_filtros.pop('ranking', None)
         filtros = triagem_filtros
     
     elif request.method == 'POST':
         filtros = {
+            'q': request.form.get('q'),
             'foco': request.form.get('foco'),
             'genero': request.form.get('genero'),
             'linha': request.form.get('linha')
         }
 
-    if filtros:
-        genero = filtros.get('genero')
-        foco = filtros.get('foco')
-        linha = filtros.get('linha')
+    elif any(request.args.get(campo) for campo in ('q', 'foco', 'genero', 'linha')):
+        # Filtros vindos dos links de paginação (ou de uma busca por GET)
+        filtros = {
+            'q': request.args.get('q'),
+            'foco': request.args.get('foco'),
+            'genero': request.args.get('genero'),
+            'linha': request.args.get('linha')
+        }
 
-        if genero and genero != "Indiferente":
-            psicologos_filtrados = [p for p in psicologos_filtrados if p['genero'] == genero]
-        
-        if foco:
-            foco_lower = foco.lower().strip()
-            # Filtra pelos campos 'tags' e 'descricaoCurta'
-            psicologos_filtrados = [p for p in psicologos_filtrados if any(foco_lower in tag.lower() for tag in p['tags']) or foco_lower in p['descricaoCurta'].lower()]
-            
-        if linha:
-            linha_lower = linha.lower().strip()
-            # Filtra pelo campo 'tags'
-            psicologos_filtrados = [p for p in psicologos_filtrados if any(linha_lower in tag.lower() for tag in p['tags'])]
+    ids = None
+    relevancia = None
+    if filtros:
+        # USA A FUNÇÃO CORRIGIDA PARA OBTER OS DADOS DO FIREBASE (lista + índice de busca do cache)
+        psicologos_base, indice = get_diretorio_psicologos()
+        # Filtra pelo índice invertido (tags, bio e gênero), sem percorrer os textos
+        if ranking is None:
+            ids = buscar_ids_psicologos(indice,
+                                        genero=filtros.get('genero'),
+                                        foco=filtros.get('foco'),
+                                        linha=filtros.get('linha'))
+            # Busca livre: ordem de relevância (BM25), dentro dos demais filtros
+            if (filtros.get('q') or '').strip():
+                relevancia = buscar_bm25(indice, psicologos_base, filtros['q'])
+
+    if ranking is not None:
+        # Recomendação da triagem: os top-k em ordem de pontuação, numa única página
+        por_id = {p['id']: p for p in psicologos_base}
+        pagina, proximo_cursor = [por_id[i] for i in ranking if i in por_id], None
+    elif relevancia is not None:
+        por_id = {p['id']: p for p in psicologos_base}
+        psicologos_filtrados = [por_id[i] for i in relevancia if i in por_id and (ids is None or i in ids)]
+        pagina, proximo_cursor = fatiar_pagina_ranqueada(psicologos_filtrados, apos, limite)
+    elif ids is not None:
+        psicologos_filtrados = [p for p in psicologos_base if p['id'] in ids]
+        pagina, proximo_cursor = fatiar_pagina(psicologos_filtrados, apos, limite)
+    else:
+        # Sem filtros: só a página pedida (memória ou consulta com cursor no Firestore)
+        pagina, proximo_cursor = get_pagina_psicologos(apos, limite)
 
+    # Filtros preenchidos, repetidos nos links de navegação entre páginas
+    filtros_paginacao = {campo: valor for campo, valor in filtros.items() if valor}
+    if limite != PSICOLOGOS_POR_PAGINA:
+        filtros_paginacao['limite'] = limite
 
-    psicologos_com_url = process_psicologos_for_template(psicologos_filtrados)
+    psicologos_com_url = process_psicologos_for_template(pagina)
     return render_template('psicologos_list.html', 
                             page_title='Escolha o Profissional', 
                             psicologos=psicologos_com_url, 
-                            filtros=filtros) 
+                            filtros=filtros,
+                            filtros_paginacao=filtros_paginacao,
+                            pagina_apos=apos,
+                            proximo_cursor=proximo_cursor) 
 
 @app.route('/agendamento/<psicologo_doc_id>', methods=['GET'])
 def agendamento(psicologo_doc_id):
-    # Busca a lista completa do DB/Mock
-    psicologo = next((p for p in get_all_psicologos() if p['id'] == psicologo_doc_id), None)
+    # Busca apenas o psicólogo escolhido (índice em memória ou leitura pontual)
+    psicologo = get_psicologo_by_id(psicologo_doc_id)
         
     if not psicologo:
         flash("Psicólogo não encontrado.", 'error')
@@ -1021,13 +3862,13 @@ def agendamento(psicologo_doc_id):
     return render_template('agendamento.html', 
                             page_title='Agendar', 
                             psicologo=psicologo_com_url, 
-                            horarios=get_mock_horarios())
+                            horarios=horarios_disponiveis(psicologo))
 
 # Rota POST para o agendamento (Redirecionamento para pagamento)
 @app.route('/agendamento/<psicologo_doc_id>', methods=['POST'])
 def pagamento_redirect(psicologo_doc_id):
-    # Busca a lista completa do DB/Mock
-    psicologo = next((p for p in get_all_psicologos() if p['id'] == psicologo_doc_id), None)
+    # Busca apenas o psicólogo escolhido (índice em memória ou leitura pontual)
+    psicologo = get_psicologo_by_id(psicologo_doc_id)
         
     if not psicologo:
         flash("Erro ao processar agendamento: Psicólogo não encontrado.", 'error')
@@ -1042,6 +3883,26 @@ def pagamento_redirect(psicologo_doc_id):
         flash("Por favor, selecione o tipo, a duração e o horário da sessão.", 'error')
         return redirect(url_for('agendamento', psicologo_doc_id=psicologo_doc_id))
 
+    data_hora = interpretar_data_hora_sessao(data_hora_sessao)
+    if not horario_disponivel(psicologo, data_hora, duracao):
+        flash("Este horário não está mais disponível (ou a duração escolhida não cabe nele). Escolha outro.", 'error')
+        return redirect(url_for('agendamento', psicologo_doc_id=psicologo_doc_id))
+
+    # Retém o horário enquanto o cliente paga (seção 4.12); a escolha anterior, se houver, é desfeita
+    retencao = None
+    if db:
+        anterior = session.get('agendamento_temp')
+        if anterior and anterior.get('retencao'):
+            try:
+                liberar_retencao(anterior['psicologo_id'], interpretar_data_hora_sessao(anterior['dataHoraSessao']),
+                                 anterior['duracao'], anterior['retencao'])
+            except Exception as e:
+                print(f"Aviso: Não foi possível liberar a retenção anterior: {e}") # Vence sozinha
+        retencao = secrets.token_urlsafe(16)
+        if not reter_horario(psicologo_doc_id, data_hora, duracao, retencao):
+            flash("Este horário acabou de ser escolhido por outra pessoa. Escolha outro.", 'error')
+            return redirect(url_for('agendamento', psicologo_doc_id=psicologo_doc_id))
+
     valor_base = float(psicologo['valorSessao']) 
     
     # Lógica de cálculo de valor
@@ -1060,6 +3921,7 @@ def pagamento_redirect(psicologo_doc_id):
         'sessaoTipo': sessao_tipo,
         'duracao': duracao,
         'valor': int(valor_final),
+        'retencao': retencao,
     }
 
     return redirect(url_for('pagamento'))
@@ -1092,6 +3954,8 @@ def pagamento():
             'status': 'Pendente', # <-- MUDAR AQUI: De 'Confirmado' para 'Pendente'
             'criadoEm': firestore.SERVER_TIMESTAMP
         }
+        # Data da sessão interpretada uma única vez, já pronta para ordenação e exibição
+        dados_para_db.update(campos_data_sessao(agendamento_temp['dataHoraSessao']))
 # ...
         
         # 2. Dicionário para a Sessão do Flask (USA STRING DE DATA - Evita TypeError Sentinel)
@@ -1109,9 +3973,23 @@ def pagamento():
         }
 
         if db:
+            data_hora = dados_para_db.get('dataHoraInicio')
+            if data_hora is None:
+                del session['agendamento_temp']
+                flash("Horário inválido. Escolha o horário novamente.", 'error')
+                return redirect(url_for('agendamento', psicologo_doc_id=agendamento_temp['psicologo_id']))
             try:
-                # Salva o Dicionário com o Sentinel no Firestore
-                db.collection('agendamentos').add(dados_para_db)
+                # Salva o Dicionário com o Sentinel no Firestore, junto com a reserva do horário
+                agendamento_ref = db.collection('agendamentos').document()
+                reservado = confirmar_reserva(agendamento_ref, dados_para_db, agendamento_temp['psicologo_id'],
+                                              data_hora, agendamento_temp['duracao'], agendamento_temp.get('retencao'))
+                if not reservado:
+                    # A retenção venceu e outra pessoa ficou com o horário
+                    del session['agendamento_temp']
+                    flash("Este horário acabou de ser reservado por outra pessoa. Escolha outro horário.", 'error')
+                    return redirect(url_for('agendamento', psicologo_doc_id=agendamento_temp['psicologo_id']))
+                registrar_ocupacao(agendamento_temp['psicologo_id'], agendamento_ref.id, data_hora,
+                                   agendamento_temp['duracao'])
                 
                 # Salva o Dicionário Limpo na Sessão do Flask (CORRETO)
                 session['agendamento_confirmado'] = dados_para_session
@@ -0,0 +1,255 @@
+"""Prepara o app.py para o benchmark: Firestore (em memória ou emulador), dados de teste e cenários.
+
+Configuração por variáveis de ambiente, para valer também dentro do worker do gunicorn:
+    BENCH_PSICOLOGOS    quantidade de psicólogos (padrão 200)
+    BENCH_AGENDAMENTOS  quantidade de agendamentos (padrão 5000)
+    FIRESTORE_EMULATOR_HOST  se definido, usa o emulador em vez do Firestore em memória
+    LOGIN_MODO          'token' assina os cookies de sessão do Firebase com uma chave RSA local
+"""
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from flask import request
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TAGS = ['TCC', 'Ansiedade', 'Depressão', 'Psicanálise', 'Luto', 'Casal', 'Humanista',
+        'Estresse', 'Autoestima', 'Infantil', 'Gestalt', 'Burnout']
+STATUS = ['Pendente', 'Confirmado', 'Realizada', 'Cancelada']
+PROJETO_EMULADOR = os.environ.get('BENCH_PROJETO', 'psicoajuda-bench')
+
+# Psicólogo logado nos cenários do dashboard e do histórico
+PSICOLOGO_BENCH = 'psi00000'
+
+# Agenda de todos os dias, das 08:00 às 20:00 (12 sessões por dia)
+HORARIOS_BENCH = {dia: [['08:00', '20:00']] for dia in ('seg', 'ter', 'qua', 'qui', 'sex', 'sab', 'dom')}
+_proximo_horario = itertools.count()
+
+
+def usando_emulador():
+    return bool(os.environ.get('FIRESTORE_EMULATOR_HOST'))
+
+
+def _credencial_anonima():
+    from firebase_admin import credentials
+    from google.auth.credentials import AnonymousCredentials
+
+    class CredencialAnonima(credentials.Base):
+        def get_credential(self):
+            return AnonymousCredentials()
+
+    return CredencialAnonima()
+
+
+def _limpar_emulador():
+    """Apaga todos os documentos do emulador antes de semear."""
+    import urllib.request
+    url = (f"http://{os.environ['FIRESTORE_EMULATOR_HOST']}/emulator/v1/projects/"
+           f"{PROJETO_EMULADOR}/databases/(default)/documents")
+    urllib.request.urlopen(urllib.request.Request(url, method='DELETE'), timeout=10).read()
+
+
+def instalar_firestore():
+    """Inicializa o Firebase Admin antes do import do app.py (que reaproveita o app existente).
+
+    Sem emulador, firestore.client() e as funções de auth usadas pelo app.py passam a
+    apontar para o Firestore em memória de benchmarks/firestore_falso.py.
+    """
+    import firebase_admin
+    from firebase_admin import auth, firestore
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(_credencial_anonima(), {'projectId': PROJETO_EMULADOR})
+
+    if usando_emulador():
+        _limpar_emulador()
+        return
+
+    from benchmarks import firestore_falso
+    cliente = firestore_falso.ClienteFirestore()
+    usuarios = firestore_falso.AuthFalso()
+    firestore.client = lambda app=None, database_id=None: cliente
+    for nome in ('get_user', 'get_user_by_email', 'create_user', 'update_user', 'delete_user'):
+        setattr(auth, nome, getattr(usuarios, nome))
+
+
+def semear(aplicacao, psicologos, agendamentos, semente=42):
+    """Grava psicólogos e agendamentos com a mesma forma dos documentos reais."""
+    from firebase_admin import auth, firestore
+
+    db = aplicacao.db
+    # Contas de Auth só existem para o login; no emulador, apenas se o de Auth também estiver ativo
+    criar_usuarios = not usando_emulador() or bool(os.environ.get('FIREBASE_AUTH_EMULATOR_HOST'))
+    rnd = random.Random(semente)
+    agora = datetime.now()
+    batch = db.batch()
+    pendentes = 0
+    estatisticas = {}
+
+    def gravar(referencia, dados):
+        nonlocal batch, pendentes
+        batch.set(referencia, dados)
+        pendentes += 1
+        if pendentes == 500:
+            batch.commit()
+            batch = db.batch()
+            pendentes = 0
+
+    for i in range(psicologos):
+        uid = f'psi{i:05d}'
+        email = f'psicologo{i}@bench.psicoajuda'
+        if criar_usuarios:
+            try:
+                auth.create_user(uid=uid, email=email, password='bench-senha', display_name=f'Psicólogo {i}')
+            except Exception:
+                pass # Já existe no emulador de Auth
+        tags = rnd.sample(TAGS, 3)
+        gravar(db.collection('psicologos').document(uid), {
+            'nome': f'Psicólogo Bench {i}',
+            'email': email,
+            'genero': rnd.choice(['Masculino', 'Feminino']),
+            'valorSessao': float(rnd.randrange(90, 300, 10)),
+            'especialidades': tags,
+            'bio': f"Atendimento focado em {', '.join(tags)} com abordagem acolhedora e baseada em evidências.",
+            'fotoURL': 'default_avatar.jpg',
+            'cadastradoEm': firestore.SERVER_TIMESTAMP,
+            'horariosAtendimento': HORARIOS_BENCH,
+        })
+
+    for j in range(agendamentos):
+        # O psicólogo do benchmark concentra 10% dos agendamentos, como uma agenda cheia
+        psicologo = PSICOLOGO_BENCH if j % 10 == 0 else f'psi{rnd.randrange(max(psicologos, 1)):05d}'
+        inicio = (agora + timedelta(days=rnd.randint(-365, 60))).replace(hour=rnd.randint(8, 19), minute=0,
+                                                                          second=0, microsecond=0)
+        texto = inicio.strftime('%Y-%m-%dT%H:%M')
+        dados = {
+            'psicologo_id': psicologo,
+            'psicologo_nome': 'Psicólogo Bench',
+            'usuarioEmail': f'cliente{j}@bench.psicoajuda',
+            'dataHoraSessao': texto,
+            'sessaoTipo': rnd.choice(['Sessão Individual', 'Terapia de Casal']),
+            'duracao': '50 min',
+            'valor': rnd.randrange(90, 450, 10),
+            'linkSessao': f'https://psicoapp.com/sessao/bench-{j}',
+            'status': rnd.choice(STATUS),
+            'prontuario': 'Anotações da sessão. ' * rnd.randint(0, 40),
+            'criadoEm': firestore.SERVER_TIMESTAMP,
+        }
+        dados.update(aplicacao.campos_data_sessao(texto))
+        gravar(db.collection('agendamentos').document(), dados)
+        aplicacao.registrar_estatisticas(estatisticas, psicologo, dados['dataHoraInicio'], dados['valor'],
+                                         para=dados['status'])
+
+    # Contadores do painel do admin, como se os agendamentos tivessem passado pelo app
+    for periodo, campos in estatisticas.items():
+        gravar(aplicacao._referencia_estatistica(periodo, 0), aplicacao.documento_estatisticas(periodo, campos))
+
+    if pendentes:
+        batch.commit()
+
+
+def carregar_app():
+    """Instala o Firestore, importa o app.py e semeia os dados configurados no ambiente."""
+    if RAIZ not in sys.path:
+        sys.path.insert(0, RAIZ)
+    os.chdir(RAIZ) # UPLOAD_FOLDER e demais caminhos do app.py são relativos à raiz
+    instalar_firestore()
+
+    import app as aplicacao
+    if aplicacao.LOGIN_MODO == 'token':
+        _instalar_chave_firebase(aplicacao)
+    semear(aplicacao,
+           int(os.environ.get('BENCH_PSICOLOGOS', '200')),
+           int(os.environ.get('BENCH_AGENDAMENTOS', '5000')))
+    return aplicacao
+
+
+def _instalar_chave_firebase(aplicacao):
+    """Gera (uma vez, compartilhada com o worker do gunicorn pelo ambiente) uma chave RSA e a
+    instala no verificador de cookies de sessão do app, no lugar das chaves públicas do Google."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    if 'BENCH_CHAVE_FIREBASE' not in os.environ:
+        chave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        os.environ['BENCH_CHAVE_FIREBASE'] = chave.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()).decode()
+    privada = serialization.load_pem_private_key(os.environ['BENCH_CHAVE_FIREBASE'].encode(), password=None)
+    publica = privada.public_key().public_bytes(serialization.Encoding.PEM,
+                                                 serialization.PublicFormat.SubjectPublicKeyInfo)
+    aplicacao.verificador_cookie_sessao.url_certificados = None
+    aplicacao.verificador_cookie_sessao.instalar_chaves({'bench': publica}, validade=float('inf'))
+    aplicacao._projeto_firebase = PROJETO_EMULADOR
+
+
+def cookie_sessao_firebase(uid):
+    """Cookie de sessão do Firebase para o UID, assinado com a chave local (LOGIN_MODO=token)."""
+    import jwt
+
+    agora = int(time.time())
+    claims = {'iss': f'https://session.firebase.google.com/{PROJETO_EMULADOR}', 'aud': PROJETO_EMULADOR,
+              'sub': uid, 'iat': agora, 'auth_time': agora, 'exp': agora + 3600}
+    return jwt.encode(claims, os.environ['BENCH_CHAVE_FIREBASE'], algorithm='RS256', headers={'kid': 'bench'})
+
+
+def cookie_de_sessao(flask_app, dados):
+    """Cabeçalho Cookie de uma sessão nova com os dados informados (para o test client e o gunicorn).
+
+    Passa pela session_interface do app, então vale tanto para a sessão no servidor (um ID novo
+    gravado no SQLite a cada chamada) quanto para o cookie assinado padrão do Flask.
+    """
+    with flask_app.test_request_context():
+        interface = flask_app.session_interface
+        sessao = interface.open_session(flask_app, request)
+        sessao.update(dados)
+        resposta = flask_app.response_class()
+        interface.save_session(flask_app, sessao, resposta)
+    cookie = resposta.headers['Set-Cookie'].split(';', 1)[0]
+    if dados.get('user_role') == 'psicologo' and 'BENCH_CHAVE_FIREBASE' in os.environ:
+        cookie += f"; __session={cookie_sessao_firebase(dados['psicologo_uid'])}"
+    return cookie
+
+
+def sessao_com_agendamento():
+    """Sessão de quem chegou ao pagamento, cada uma com um horário ainda livre.
+
+    Os horários vêm depois dos agendamentos semeados (até 60 dias à frente), um por chamada,
+    para que o POST de /pagamento sempre grave em vez de recusar um horário já ocupado.
+    """
+    n = next(_proximo_horario)
+    inicio = (datetime.now() + timedelta(days=61 + n // 12)).replace(hour=8 + n % 12, minute=0)
+    return {
+        'agendamento_temp': {
+            'psicologo_id': PSICOLOGO_BENCH,
+            'psicologo_nome': 'Psicólogo Bench 0',
+            'dataHoraSessao': inicio.strftime('%Y-%m-%dT%H:%M'),
+            'sessaoTipo': 'Sessão Individual',
+            'duracao': '50 min',
+            'valor': 150,
+        }
+    }
+
+
+def cenarios(psicologos):
+    """Rotas medidas: (nome, método, caminho, sessão ou função que a cria, formulário)."""
+    sessao_psicologo = {'user_role': 'psicologo', 'psicologo_uid': PSICOLOGO_BENCH}
+    sessao_admin = {'user_role': 'admin', 'psicologo_uid': 'admin_master_uid'}
+    agendamento_temp = sessao_com_agendamento
+    editado = f'psi{min(1, max(psicologos - 1, 0)):05d}'
+    return [
+        ('home', 'GET', '/', {}, None),
+        ('diretorio', 'GET', '/psicologos', {}, None),
+        ('diretorio_filtrado', 'GET', '/psicologos?foco=ansiedade&genero=Feminino', {}, None),
+        ('agendamento', 'GET', f'/agendamento/{PSICOLOGO_BENCH}', {}, None),
+        ('dashboard', 'GET', '/dashboard', sessao_psicologo, None),
+        ('historico', 'GET', '/psicologo/historico', sessao_psicologo, None),
+        ('pagamento', 'GET', '/pagamento', agendamento_temp, None),
+        ('pagamento_post', 'POST', '/pagamento', agendamento_temp, {'email': 'cliente@bench.psicoajuda'}),
+        ('admin_dashboard', 'GET', '/admin/dashboard', sessao_admin, None),
+        ('admin_estatisticas', 'GET', '/admin/estatisticas', sessao_admin, None),
+        ('admin_editar', 'GET', f'/admin/psicologo/{editado}/editar', sessao_admin, None),
+    ]
@@ -0,0 +1,237 @@
+"""Benchmark de latência, vazão e leituras do Firestore por rota.
+
+Roda da raiz do projeto:
+
+    python -m benchmarks.carga                          # test client + gunicorn, Firestore em memória
+    python -m benchmarks.carga --modo cliente --requisicoes 500 --json antes.json
+    python -m benchmarks.carga --modo cliente --comparar antes.json
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python -m benchmarks.carga
+
+No modo 'cliente' as requisições passam pelo test client do Flask, uma por vez; no modo
+'gunicorn' um worker real (benchmarks/wsgi.py) recebe requisições HTTP concorrentes. Nos dois,
+as leituras e escritas por requisição vêm do cabeçalho Server-Timing do próprio app.
+"""
+import argparse
+import http.client
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from benchmarks import ambiente
+
+_RE_OPERACOES = re.compile(r'(leituras|escritas|exclusoes)=(\d+)')
+
+
+def _operacoes_firestore(server_timing):
+    """{'leituras': n, 'escritas': n, 'exclusoes': n} a partir do Server-Timing (vazio se ausente)."""
+    return {nome: int(valor) for nome, valor in _RE_OPERACOES.findall(server_timing or '')}
+
+
+def _percentis(latencias):
+    if len(latencias) < 2:
+        valor = latencias[0] if latencias else 0.0
+        return valor, valor, valor
+    cortes = statistics.quantiles(latencias, n=100, method='inclusive')
+    return cortes[49], cortes[94], cortes[98]
+
+
+def _resumo(nome, latencias, duracao, erros, operacoes):
+    p50, p95, p99 = _percentis(latencias)
+    resumo = {
+        'rota': nome,
+        'requisicoes': len(latencias),
+        'erros': erros,
+        'p50_ms': p50 * 1000,
+        'p95_ms': p95 * 1000,
+        'p99_ms': p99 * 1000,
+        'req_por_s': len(latencias) / duracao if duracao else 0.0,
+    }
+    if operacoes:
+        resumo['leituras_por_req'] = sum(o.get('leituras', 0) for o in operacoes) / len(operacoes)
+        resumo['escritas_por_req'] = sum(o.get('escritas', 0) + o.get('exclusoes', 0) for o in operacoes) / len(operacoes)
+    return resumo
+
+
+def _cabecalhos(aplicacao, sessao):
+    """Uma sessão nova por requisição: rotas como o POST de /pagamento consomem dados da sessão."""
+    if callable(sessao):
+        sessao = sessao()
+    return {'Cookie': ambiente.cookie_de_sessao(aplicacao.app, sessao)} if sessao else {}
+
+
+def medir_cliente(aplicacao, cenarios, requisicoes, aquecimento):
+    """Mede cada cenário pelo test client do Flask, uma requisição por vez."""
+    cliente = aplicacao.app.test_client(use_cookies=False)
+    resultados = []
+    for nome, metodo, caminho, sessao, formulario in cenarios:
+        for _ in range(aquecimento):
+            cliente.open(caminho, method=metodo, headers=_cabecalhos(aplicacao, sessao), data=formulario)
+
+        latencias, operacoes, erros = [], [], 0
+        inicio = time.perf_counter()
+        for _ in range(requisicoes):
+            cabecalhos = _cabecalhos(aplicacao, sessao)
+            t0 = time.perf_counter()
+            resposta = cliente.open(caminho, method=metodo, headers=cabecalhos, data=formulario)
+            latencias.append(time.perf_counter() - t0)
+            operacoes.append(_operacoes_firestore(resposta.headers.get('Server-Timing')))
+            erros += resposta.status_code >= 400
+        duracao = time.perf_counter() - inicio
+        resultados.append(_resumo(nome, latencias, duracao, erros, operacoes))
+    return resultados
+
+
+def _porta_livre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _aguardar_servidor(porta, processo, limite=120):
+    prazo = time.monotonic() + limite
+    while time.monotonic() < prazo:
+        if processo.poll() is not None:
+            raise RuntimeError('O gunicorn terminou antes de aceitar conexões.')
+        try:
+            conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=2)
+            conexao.request('GET', '/ajuda')
+            conexao.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('O gunicorn não respondeu a tempo.')
+
+
+def _requisicao_http(porta, metodo, caminho, cabecalhos, formulario):
+    if callable(cabecalhos):
+        cabecalhos = cabecalhos()
+    conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=30)
+    corpo = None
+    if formulario:
+        corpo = urlencode(formulario)
+        cabecalhos = dict(cabecalhos, **{'Content-Type': 'application/x-www-form-urlencoded'})
+    t0 = time.perf_counter()
+    operacoes = {}
+    try:
+        conexao.request(metodo, caminho, body=corpo, headers=cabecalhos)
+        resposta = conexao.getresponse()
+        resposta.read()
+        status = resposta.status
+        operacoes = _operacoes_firestore(resposta.getheader('Server-Timing'))
+    except OSError:
+        status = 599
+    finally:
+        conexao.close()
+    return time.perf_counter() - t0, status, operacoes
+
+
+def medir_gunicorn(aplicacao, cenarios, requisicoes, aquecimento, concorrencia, workers, argumentos_extras):
+    """Sobe um gunicorn com benchmarks.wsgi e mede cada cenário com requisições HTTP concorrentes."""
+    porta = _porta_livre()
+    comando = [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{porta}', '--workers', str(workers),
+               '--log-level', 'warning', *argumentos_extras, 'benchmarks.wsgi:app']
+    processo = subprocess.Popen(comando, cwd=ambiente.RAIZ, env=dict(os.environ))
+    resultados = []
+    try:
+        _aguardar_servidor(porta, processo)
+        with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+            for nome, metodo, caminho, sessao, formulario in cenarios:
+                cabecalhos = lambda sessao=sessao: _cabecalhos(aplicacao, sessao)
+                for _ in range(aquecimento):
+                    _requisicao_http(porta, metodo, caminho, cabecalhos, formulario)
+
+                inicio = time.perf_counter()
+                medidas = list(executor.map(lambda _: _requisicao_http(porta, metodo, caminho, cabecalhos, formulario),
+                                            range(requisicoes)))
+                duracao = time.perf_counter() - inicio
+                resultados.append(_resumo(nome, [latencia for latencia, _, _ in medidas], duracao,
+                                          sum(status >= 400 for _, status, _ in medidas),
+                                          [operacoes for _, _, operacoes in medidas if operacoes]))
+    finally:
+        processo.terminate()
+        try:
+            processo.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            processo.kill()
+    return resultados
+
+
+def imprimir_tabela(titulo, resultados, referencia=None):
+    print(f"\n{titulo}")
+    cabecalho = f"{'rota':<20}{'n':>6}{'erros':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}{'leit/req':>10}{'escr/req':>10}"
+    print(cabecalho)
+    print('-' * len(cabecalho))
+    base = {r['rota']: r for r in (referencia or [])}
+    for r in resultados:
+        leituras = f"{r['leituras_por_req']:.1f}" if 'leituras_por_req' in r else '-'
+        escritas = f"{r['escritas_por_req']:.1f}" if 'escritas_por_req' in r else '-'
+        linha = (f"{r['rota']:<20}{r['requisicoes']:>6}{r['erros']:>7}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}"
+                 f"{r['p99_ms']:>10.2f}{r['req_por_s']:>10.1f}{leituras:>10}{escritas:>10}")
+        anterior = base.get(r['rota'])
+        if anterior and anterior['p50_ms']:
+            linha += f"   p50 {(r['p50_ms'] / anterior['p50_ms'] - 1) * 100:+.0f}%"
+            if 'leituras_por_req' in r and 'leituras_por_req' in anterior:
+                linha += f", leituras {r['leituras_por_req'] - anterior['leituras_por_req']:+.1f}"
+        print(linha)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modo', choices=('cliente', 'gunicorn', 'ambos'), default='ambos')
+    parser.add_argument('--psicologos', type=int, default=int(os.environ.get('BENCH_PSICOLOGOS', '200')))
+    parser.add_argument('--agendamentos', type=int, default=int(os.environ.get('BENCH_AGENDAMENTOS', '5000')))
+    parser.add_argument('--requisicoes', type=int, default=200, help='requisições medidas por rota')
+    parser.add_argument('--aquecimento', type=int, default=5, help='requisições descartadas por rota')
+    parser.add_argument('--concorrencia', type=int, default=4, help='requisições simultâneas no modo gunicorn')
+    parser.add_argument('--workers', type=int, default=1, help='workers do gunicorn')
+    parser.add_argument('--gunicorn-args', default='', help="argumentos extras do gunicorn (ex: '--threads 4')")
+    parser.add_argument('--rotas', help='lista separada por vírgulas (padrão: todas)')
+    parser.add_argument('--json', help='grava os resultados neste arquivo')
+    parser.add_argument('--comparar', help='arquivo gerado por --json para mostrar a variação')
+    args = parser.parse_args(argv)
+
+    # Lidos por benchmarks/ambiente.py aqui e no worker do gunicorn
+    os.environ['BENCH_PSICOLOGOS'] = str(args.psicologos)
+    os.environ['BENCH_AGENDAMENTOS'] = str(args.agendamentos)
+    # O log por requisição do app.py só atrapalharia a tabela (o Server-Timing continua ativo)
+    os.environ.setdefault('LOG_REQUISICOES', '0')
+
+    inicio = time.perf_counter()
+    aplicacao = ambiente.carregar_app()
+    print(f"Dados semeados em {time.perf_counter() - inicio:.1f}s: {args.psicologos} psicólogos, "
+          f"{args.agendamentos} agendamentos ({'emulador' if ambiente.usando_emulador() else 'Firestore em memória'}).")
+
+    cenarios = ambiente.cenarios(args.psicologos)
+    if args.rotas:
+        escolhidas = set(args.rotas.split(','))
+        cenarios = [c for c in cenarios if c[0] in escolhidas]
+
+    referencia = {}
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            referencia = json.load(f)
+
+    saida = {}
+    if args.modo in ('cliente', 'ambos'):
+        saida['cliente'] = medir_cliente(aplicacao, cenarios, args.requisicoes, args.aquecimento)
+        imprimir_tabela('Flask test client (sequencial)', saida['cliente'], referencia.get('cliente'))
+    if args.modo in ('gunicorn', 'ambos'):
+        saida['gunicorn'] = medir_gunicorn(aplicacao, cenarios, args.requisicoes, args.aquecimento,
+                                           args.concorrencia, args.workers, args.gunicorn_args.split())
+        imprimir_tabela(f'gunicorn ({args.workers} worker(s), concorrência {args.concorrencia})',
+                        saida['gunicorn'], referencia.get('gunicorn'))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(saida, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
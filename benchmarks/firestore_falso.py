@@ -0,0 +1,489 @@
+"""Firestore e Firebase Auth em memória, com a mesma interface usada pelo app.py.
+
+Usado apenas pelo benchmark (benchmarks/carga.py): cobre documentos, consultas com
+where/order_by/limit/start_after/select, agregações count/sum, batches e transações
+(com as pré-condições de write_option: last_update_time e exists).
+As leituras e escritas de cada requisição são contadas pela instrumentação do próprio
+app.py (seção 1.1) e chegam ao benchmark pelo cabeçalho Server-Timing.
+"""
+import copy
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from google.api_core import exceptions as gexc
+from google.cloud.firestore_v1.client import Client as _ClienteReal
+from google.cloud.firestore_v1.transforms import Sentinel, Increment, ArrayUnion, ArrayRemove
+
+
+def _aplicar_transformacoes(atual, dados, mesclar=False):
+    """Resolve SERVER_TIMESTAMP, DELETE_FIELD, Increment e ArrayUnion/ArrayRemove sobre o documento atual.
+
+    mesclar=True (set com merge=True) mescla os mapas aninhados em vez de substituí-los.
+    """
+    resultado = dict(atual or {})
+    for campo, valor in dados.items():
+        if isinstance(valor, dict):
+            anterior = resultado.get(campo) if mesclar and isinstance(resultado.get(campo), dict) else None
+            resultado[campo] = _aplicar_transformacoes(anterior, valor, mesclar)
+        elif isinstance(valor, Sentinel):
+            if 'delete' in valor.description.lower():
+                resultado.pop(campo, None)
+            else:
+                resultado[campo] = datetime.now(timezone.utc)
+        elif isinstance(valor, Increment):
+            resultado[campo] = resultado.get(campo, 0) + valor.value
+        elif isinstance(valor, ArrayUnion):
+            resultado[campo] = list(resultado.get(campo) or []) + [v for v in valor.values if v not in (resultado.get(campo) or [])]
+        elif isinstance(valor, ArrayRemove):
+            resultado[campo] = [v for v in (resultado.get(campo) or []) if v not in valor.values]
+        else:
+            resultado[campo] = copy.deepcopy(valor)
+    return resultado
+
+
+# Pré-condição interna das operações create(): o documento não pode existir (AlreadyExists)
+_SEM_DOCUMENTO = object()
+
+
+class Snapshot:
+    def __init__(self, referencia, dados):
+        self.reference = referencia
+        self.id = referencia.id
+        self._dados = dados
+        self.exists = dados is not None
+        self.update_time = referencia._cliente._versoes.get(referencia.path) if self.exists else None
+
+    def to_dict(self):
+        return copy.deepcopy(self._dados) if self._dados is not None else None
+
+    def get(self, campo):
+        return (self._dados or {}).get(campo)
+
+
+class Documento:
+    def __init__(self, cliente, colecao, doc_id):
+        self._cliente = cliente
+        self._colecao = colecao
+        self.id = doc_id
+        self.path = f'{colecao}/{doc_id}'
+
+    def _tabela(self):
+        return self._cliente._colecoes.setdefault(self._colecao, {})
+
+    def _conferir(self, option):
+        """Valida a pré-condição de client.write_option() contra o estado atual do documento."""
+        if option is None:
+            return
+        versao = self._cliente._versoes.get(self.path)
+        if option is _SEM_DOCUMENTO:
+            if versao is not None:
+                raise gexc.AlreadyExists(f'Documento já existe: {self.path}')
+            return
+        if hasattr(option, '_last_update_time') and option._last_update_time != versao:
+            raise gexc.FailedPrecondition(f'Documento alterado desde a leitura: {self.path}')
+        if hasattr(option, '_exists') and option._exists != (versao is not None):
+            raise gexc.FailedPrecondition(f'Pré-condição exists={option._exists} falhou: {self.path}')
+
+    def get(self, field_paths=None, transaction=None, **kwargs):
+        with self._cliente._lock:
+            dados = self._tabela().get(self.id)
+            if dados is not None and field_paths:
+                dados = {k: v for k, v in dados.items() if k in field_paths}
+            return Snapshot(self, copy.deepcopy(dados))
+
+    def _gravar(self, dados, merge=False):
+        with self._cliente._lock:
+            atual = self._tabela().get(self.id) if merge else None
+            self._tabela()[self.id] = _aplicar_transformacoes(atual, dados, merge)
+            self._cliente._nova_versao(self.path)
+
+    def _criar(self, dados):
+        with self._cliente._lock:
+            if self.id in self._tabela():
+                raise gexc.AlreadyExists(f'Documento já existe: {self.path}')
+            self._tabela()[self.id] = _aplicar_transformacoes(None, dados)
+            self._cliente._nova_versao(self.path)
+
+    def _atualizar(self, dados):
+        with self._cliente._lock:
+            atual = self._tabela().get(self.id)
+            if atual is None:
+                raise gexc.NotFound(f'Documento não encontrado: {self.path}')
+            self._tabela()[self.id] = _aplicar_transformacoes(atual, dados)
+            self._cliente._nova_versao(self.path)
+
+    def _excluir(self):
+        with self._cliente._lock:
+            self._tabela().pop(self.id, None)
+            self._cliente._versoes.pop(self.path, None)
+
+    def set(self, dados, merge=False, **kwargs):
+        self._gravar(dados, merge)
+
+    def create(self, dados, **kwargs):
+        self._criar(dados)
+
+    def update(self, dados, option=None, **kwargs):
+        with self._cliente._lock:
+            self._conferir(option)
+            self._atualizar(dados)
+
+    def delete(self, option=None, **kwargs):
+        with self._cliente._lock:
+            self._conferir(option)
+            self._excluir()
+
+    def collection(self, nome):
+        return Consulta(self._cliente, f'{self.path}/{nome}')
+
+
+_OPERADORES = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a is not None and a != b,
+    '<': lambda a, b: a is not None and a < b,
+    '<=': lambda a, b: a is not None and a <= b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+    'in': lambda a, b: a in b,
+    'not-in': lambda a, b: a is not None and a not in b,
+    'array_contains': lambda a, b: b in (a or []),
+    'array_contains_any': lambda a, b: any(v in (a or []) for v in b),
+}
+
+
+class _ResultadoAgregacao:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class ConsultaAgregada:
+    def __init__(self, consulta):
+        self._consulta = consulta
+        self._agregacoes = []
+
+    def count(self, alias=None):
+        self._agregacoes.append(('count', None, alias or 'count'))
+        return self
+
+    def sum(self, campo, alias=None):
+        self._agregacoes.append(('sum', campo, alias or 'sum'))
+        return self
+
+    def avg(self, campo, alias=None):
+        self._agregacoes.append(('avg', campo, alias or 'avg'))
+        return self
+
+    def get(self, transaction=None, **kwargs):
+        documentos = self._consulta._executar()
+        resultados = []
+        for tipo, campo, alias in self._agregacoes:
+            if tipo == 'count':
+                valor = len(documentos)
+            else:
+                valores = [d[1].get(campo) for d in documentos if isinstance(d[1].get(campo), (int, float))]
+                if tipo == 'sum':
+                    valor = sum(valores)
+                else:
+                    valor = sum(valores) / len(valores) if valores else None
+            resultados.append(_ResultadoAgregacao(alias, valor))
+        return [resultados]
+
+    def stream(self, transaction=None, **kwargs):
+        # Como no AggregationQuery real; é por ele que a instrumentação do app.py reconhece a consulta
+        return FluxoDeDocumentos(iter(self.get(transaction)))
+
+
+class FluxoDeDocumentos:
+    """Iterador que não é um gerador nativo, como o StreamGenerator devolvido pelo stream() real."""
+
+    def __init__(self, gerador):
+        self._gerador = gerador
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._gerador)
+
+
+class Consulta:
+    def __init__(self, cliente, colecao):
+        self._cliente = cliente
+        self._colecao = colecao
+        self._filtros = []
+        self._ordens = []
+        self._limite = None
+        self._cursor = None
+        self._campos = None
+
+    def _copiar(self, **alteracoes):
+        nova = copy.copy(self)
+        nova._filtros = list(self._filtros)
+        nova._ordens = list(self._ordens)
+        for nome, valor in alteracoes.items():
+            setattr(nova, nome, valor)
+        return nova
+
+    @property
+    def id(self):
+        return self._colecao.rsplit('/', 1)[-1]
+
+    def document(self, doc_id=None):
+        return Documento(self._cliente, self._colecao, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, dados, document_id=None, **kwargs):
+        referencia = self.document(document_id)
+        referencia.set(dados)
+        return datetime.now(timezone.utc), referencia
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copiar(_filtros=self._filtros + [(field_path, op_string, value)])
+
+    def order_by(self, campo, direction='ASCENDING'):
+        return self._copiar(_ordens=self._ordens + [(campo, str(direction).upper().endswith('DESCENDING'))])
+
+    def limit(self, quantidade):
+        return self._copiar(_limite=quantidade)
+
+    def start_after(self, cursor):
+        return self._copiar(_cursor=cursor)
+
+    def select(self, campos):
+        return self._copiar(_campos=list(campos))
+
+    def count(self, alias=None):
+        return ConsultaAgregada(self).count(alias)
+
+    def sum(self, campo, alias=None):
+        return ConsultaAgregada(self).sum(campo, alias)
+
+    def avg(self, campo, alias=None):
+        return ConsultaAgregada(self).avg(campo, alias)
+
+    @staticmethod
+    def _valor(documento, campo):
+        return documento[0] if campo == '__name__' else documento[1].get(campo)
+
+    def _chave_ordem(self, documento):
+        # Ordem explícita seguida do ID, como o desempate implícito do Firestore
+        return [self._valor(documento, campo) for campo, _ in self._ordens] + [documento[0]]
+
+    def _depois_do_cursor(self, documento):
+        if hasattr(self._cursor, 'id'):
+            valores_cursor = [self._valor((self._cursor.id, self._cursor.to_dict() or {}), campo)
+                              for campo, _ in self._ordens] + [self._cursor.id]
+            ordens = self._ordens + [('__name__', self._ordens[-1][1] if self._ordens else False)]
+        else:
+            ordens = [(campo, desc) for campo, desc in self._ordens if campo in self._cursor]
+            valores_cursor = [self._cursor[campo] for campo, _ in ordens]
+        for (campo, desc), valor_cursor in zip(ordens, valores_cursor):
+            valor = self._valor(documento, campo)
+            if valor == valor_cursor:
+                continue
+            return valor < valor_cursor if desc else valor > valor_cursor
+        return False
+
+    def _executar(self):
+        with self._cliente._lock:
+            itens = list(self._cliente._colecoes.get(self._colecao, {}).items())
+        documentos = [
+            item for item in itens
+            if all(_OPERADORES[op](item[1].get(campo) if campo != '__name__' else item[0], valor)
+                   for campo, op, valor in self._filtros)
+        ]
+        # Documentos sem o campo de ordenação ficam de fora, como no Firestore
+        documentos = [d for d in documentos if all(c == '__name__' or c in d[1] for c, _ in self._ordens)]
+        documentos.sort(key=lambda d: d[0])
+        for campo, desc in reversed(self._ordens):
+            documentos.sort(key=lambda d, c=campo: self._valor(d, c), reverse=desc)
+        if self._cursor is not None:
+            documentos = [d for d in documentos if self._depois_do_cursor(d)]
+        if self._limite is not None:
+            documentos = documentos[:self._limite]
+        return documentos
+
+    def stream(self, transaction=None, **kwargs):
+        return FluxoDeDocumentos(self._gerar())
+
+    def _gerar(self):
+        documentos = self._executar()
+        for doc_id, dados in documentos:
+            if self._campos is not None:
+                dados = {k: v for k, v in dados.items() if k in self._campos}
+            yield Snapshot(Documento(self._cliente, self._colecao, doc_id), copy.deepcopy(dados))
+
+    def get(self, transaction=None, **kwargs):
+        return list(self.stream())
+
+    def list_documents(self, page_size=None):
+        with self._cliente._lock:
+            ids = list(self._cliente._colecoes.get(self._colecao, {}))
+        return [Documento(self._cliente, self._colecao, doc_id) for doc_id in ids]
+
+    def on_snapshot(self, callback):
+        raise NotImplementedError('O Firestore em memória não suporta listeners.')
+
+
+class Batch:
+    def __init__(self, cliente):
+        self._cliente = cliente
+        self._operacoes = []
+
+    def set(self, referencia, dados, merge=False):
+        self._operacoes.append((referencia, None, lambda: referencia._gravar(dados, merge)))
+
+    def create(self, referencia, dados):
+        self._operacoes.append((referencia, _SEM_DOCUMENTO, lambda: referencia._criar(dados)))
+
+    def update(self, referencia, dados, option=None):
+        self._operacoes.append((referencia, option, lambda: referencia._atualizar(dados)))
+
+    def delete(self, referencia, option=None):
+        self._operacoes.append((referencia, option, referencia._excluir))
+
+    def commit(self, **kwargs):
+        # Atômico: as operações rodam sob o mesmo lock do cliente, e só depois de todas as pré-condições
+        with self._cliente._lock:
+            for referencia, option, _ in self._operacoes:
+                referencia._conferir(option)
+            for _, _, operacao in self._operacoes:
+                operacao()
+        self._operacoes = []
+        return []
+
+    def __len__(self):
+        return len(self._operacoes)
+
+
+class Transacao(Batch):
+    """Transação compatível com @firestore.transactional (leituras com lock e commit atômico)."""
+
+    def __init__(self, cliente, max_attempts=5, read_only=False):
+        super().__init__(cliente)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self.in_progress = False
+
+    def _begin(self, retry_id=None):
+        self._id = uuid.uuid4().bytes
+        self.in_progress = True
+
+    def _clean_up(self):
+        self._operacoes = []
+        self._id = None
+        self.in_progress = False
+
+    def _rollback(self):
+        self._clean_up()
+
+    def _commit(self):
+        self.commit()
+        self._clean_up()
+        return []
+
+    def get(self, referencia_ou_consulta, **kwargs):
+        if isinstance(referencia_ou_consulta, Documento):
+            return referencia_ou_consulta.get()
+        return referencia_ou_consulta.stream()
+
+    def get_all(self, referencias, **kwargs):
+        return self._cliente.get_all(referencias)
+
+
+class ClienteFirestore:
+    """Substituto de firestore.client(); os dados ficam em dicionários protegidos por um RLock."""
+
+    def __init__(self):
+        self._colecoes = {}
+        self._versoes = {} # caminho -> update_time da última escrita
+        self._lock = threading.RLock()
+
+    def _nova_versao(self, caminho):
+        """update_time estritamente crescente, como o do Firestore (usado pelas pré-condições)."""
+        with self._lock:
+            versao = datetime.now(timezone.utc)
+            ultima = self._versoes.get(caminho)
+            if ultima is not None and versao <= ultima:
+                versao = ultima + timedelta(microseconds=1)
+            self._versoes[caminho] = versao
+
+    # Mesmas opções (LastUpdateOption/ExistsOption) do cliente real
+    write_option = staticmethod(_ClienteReal.write_option)
+
+    def collection(self, nome):
+        return Consulta(self, nome)
+
+    def document(self, caminho):
+        colecao, doc_id = caminho.rsplit('/', 1)
+        return Documento(self, colecao, doc_id)
+
+    def batch(self):
+        return Batch(self)
+
+    def transaction(self, max_attempts=5, read_only=False, **kwargs):
+        return Transacao(self, max_attempts=max_attempts, read_only=read_only)
+
+    def get_all(self, referencias, field_paths=None, transaction=None, **kwargs):
+        referencias = list(referencias)
+        with self._lock:
+            for referencia in referencias:
+                dados = referencia._tabela().get(referencia.id)
+                if dados is not None and field_paths:
+                    dados = {k: v for k, v in dados.items() if k in field_paths}
+                yield Snapshot(referencia, copy.deepcopy(dados))
+
+
+class UsuarioFalso:
+    def __init__(self, uid, email, display_name=None, disabled=False):
+        self.uid = uid
+        self.email = email
+        self.display_name = display_name
+        self.disabled = disabled
+
+
+class AuthFalso:
+    """Substituto das funções de firebase_admin.auth usadas pelo app.py."""
+
+    def __init__(self):
+        self._usuarios = {}
+        self._lock = threading.Lock()
+
+    def _nao_encontrado(self, mensagem):
+        from firebase_admin import auth
+        return auth.UserNotFoundError(mensagem)
+
+    def get_user(self, uid, app=None):
+        with self._lock:
+            if uid not in self._usuarios:
+                raise self._nao_encontrado(f'Usuário {uid} não encontrado.')
+            return self._usuarios[uid]
+
+    def get_user_by_email(self, email, app=None):
+        with self._lock:
+            for usuario in self._usuarios.values():
+                if usuario.email == email:
+                    return usuario
+        raise self._nao_encontrado(f'Usuário {email} não encontrado.')
+
+    def create_user(self, uid=None, email=None, password=None, display_name=None, disabled=False, app=None, **kwargs):
+        usuario = UsuarioFalso(uid or uuid.uuid4().hex[:28], email, display_name, disabled)
+        with self._lock:
+            self._usuarios[usuario.uid] = usuario
+        return usuario
+
+    def update_user(self, uid, app=None, **kwargs):
+        usuario = self.get_user(uid)
+        for campo in ('email', 'display_name', 'disabled'):
+            if campo in kwargs:
+                setattr(usuario, campo, kwargs[campo])
+        return usuario
+
+    def delete_user(self, uid, app=None):
+        with self._lock:
+            if self._usuarios.pop(uid, None) is None:
+                raise self._nao_encontrado(f'Usuário {uid} não encontrado.')
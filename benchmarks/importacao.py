@@ -0,0 +1,91 @@
+"""Perfil de import do app.py (python -X importtime) comparado com um orçamento de cold start.
+
+Roda da raiz do projeto:
+
+    python -m benchmarks.importacao                  # mediana de 5 imports, orçamento padrão
+    python -m benchmarks.importacao --orcamento-ms 250 --top 25
+
+Cada medição importa o app.py num processo novo. O comando falha (código 1) se a mediana
+passar do orçamento ou se algum dos módulos pesados que o app carrega sob demanda
+(Firebase, Firestore, gRPC, NumPy) aparecer no import.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+from benchmarks.ambiente import RAIZ
+
+# Carregados só no primeiro uso do 'db'/'auth' (seção 1 do app.py) e da triagem (seção 4.13)
+MODULOS_SOB_DEMANDA = ('firebase_admin', 'grpc', 'google.cloud.firestore', 'google.cloud.firestore_v1', 'google.auth',
+                       'numpy')
+
+_RE_LINHA = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def medir_import():
+    """Importa o app.py num processo novo e devolve [(modulo, proprio_us, acumulado_us, profundidade)].
+
+    Só entram os módulos importados pelo app.py (o -X importtime também lista os do site.py).
+    """
+    ambiente = dict(os.environ, LOG_REQUISICOES='0')
+    # O app.py recusa subir sem credenciais, mas só as lê no primeiro uso do Firebase:
+    # para medir o import, basta que a variável exista
+    ambiente.setdefault('FIREBASE_CREDENTIALS_JSON', '{}')
+    resultado = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=RAIZ, env=ambiente,
+                               capture_output=True, text=True)
+    if resultado.returncode != 0:
+        raise RuntimeError(f'O import do app.py falhou:\n{resultado.stderr[-2000:]}')
+    modulos = []
+    for linha in resultado.stderr.splitlines():
+        casamento = _RE_LINHA.match(linha)
+        if casamento:
+            proprio, acumulado, recuo, nome = casamento.groups()
+            profundidade = (len(recuo) - 1) // 2
+            modulos.append((nome, int(proprio), int(acumulado), profundidade))
+            if profundidade == 0:
+                if nome == 'app':
+                    return modulos
+                modulos = [] # Outro módulo de primeiro nível (listado antes do app)
+    raise RuntimeError('O -X importtime não listou o app.py.')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orcamento-ms', type=float, default=float(os.environ.get('IMPORTACAO_ORCAMENTO_MS', '300')),
+                        help='tempo máximo (mediana) para importar o app.py')
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15, help='módulos listados, pelo tempo acumulado')
+    args = parser.parse_args(argv)
+
+    medicoes = [medir_import() for _ in range(args.repeticoes)]
+    totais = [next(acumulado for nome, _, acumulado, _ in modulos if nome == 'app') / 1000 for modulos in medicoes]
+    total = statistics.median(totais)
+
+    # Tabela da medição mais próxima da mediana: imports diretos do app.py (profundidade 1)
+    modulos = medicoes[min(range(len(totais)), key=lambda i: abs(totais[i] - total))]
+    diretos = sorted((m for m in modulos if m[3] == 1), key=lambda m: m[2], reverse=True)
+    print(f"{'módulo':<40}{'próprio ms':>12}{'acumulado ms':>14}")
+    print('-' * 66)
+    for nome, proprio, acumulado, _ in diretos[:args.top]:
+        print(f"{nome:<40}{proprio / 1000:>12.1f}{acumulado / 1000:>14.1f}")
+
+    print(f"\nimport app: mediana {total:.1f} ms em {args.repeticoes} processo(s) "
+          f"(mín {min(totais):.1f}, máx {max(totais):.1f}); orçamento {args.orcamento_ms:.0f} ms")
+
+    falhas = []
+    if total > args.orcamento_ms:
+        falhas.append(f"import acima do orçamento: {total:.1f} ms > {args.orcamento_ms:.0f} ms")
+    carregados = sorted({nome for nome, _, _, _ in modulos
+                         if any(nome == m or nome.startswith(m + '.') for m in MODULOS_SOB_DEMANDA)})
+    if carregados:
+        falhas.append(f"módulos que deveriam ser carregados sob demanda: {', '.join(carregados[:10])}")
+    for falha in falhas:
+        print(f"FALHA: {falha}")
+    return 1 if falhas else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Disputa de horários: muitos clientes reservando ao mesmo tempo (seção 4.12 do app.py).
+
+Roda da raiz do projeto:
+
+    python -m benchmarks.reservas                              # Firestore em memória
+    python -m benchmarks.reservas --clientes 64 --horarios 8
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python -m benchmarks.reservas
+
+Cada cliente escolhe um horário ao acaso entre poucos (muita disputa), retém e confirma, como
+no fluxo agendamento -> pagamento. No fim, cada horário precisa ter no máximo um agendamento e
+nenhum bloco pode ter duas reservas; a latência das tentativas que ganharam e das que
+perderam (que devem falhar rápido) é comparada.
+"""
+import argparse
+import os
+import random
+import secrets
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from benchmarks import ambiente
+
+
+def _tentar(aplicacao, psicologo_id, data_hora, duracao):
+    """Retém e confirma um horário. Retorna (etapa, segundos): 'reservado', 'retencao' ou 'confirmacao'."""
+    titular = secrets.token_urlsafe(16)
+    inicio = time.perf_counter()
+    if not aplicacao.reter_horario(psicologo_id, data_hora, duracao, titular):
+        return 'retencao', time.perf_counter() - inicio
+    referencia = aplicacao.db.collection('agendamentos').document()
+    dados = {'psicologo_id': psicologo_id, 'status': 'Pendente', 'duracao': duracao, 'dataHoraInicio': data_hora,
+             'usuarioEmail': f'{titular}@bench.psicoajuda'}
+    if not aplicacao.confirmar_reserva(referencia, dados, psicologo_id, data_hora, duracao, titular):
+        return 'confirmacao', time.perf_counter() - inicio
+    return 'reservado', time.perf_counter() - inicio
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clientes', type=int, default=200, help='tentativas de reserva')
+    parser.add_argument('--concorrencia', type=int, default=32, help='tentativas simultâneas')
+    parser.add_argument('--horarios', type=int, default=6, help='horários disputados')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('BENCH_PSICOLOGOS', '1')
+    os.environ.setdefault('BENCH_AGENDAMENTOS', '0')
+    os.environ.setdefault('LOG_REQUISICOES', '0')
+    aplicacao = ambiente.carregar_app()
+
+    # Horários de hora em hora num dia sem agendamentos semeados; sessões de 50 e 80 minutos,
+    # então uma sessão longa também disputa o bloco seguinte
+    dia = (datetime.now(aplicacao.FUSO_BRASILIA) + timedelta(days=90)).replace(minute=0, second=0, microsecond=0)
+    horarios = [dia.replace(hour=8 + i) for i in range(args.horarios)]
+    rnd = random.Random(7)
+    tentativas = [(rnd.choice(horarios), rnd.choice(['50 min', '80 min'])) for _ in range(args.clientes)]
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concorrencia) as executor:
+        resultados = list(executor.map(lambda t: _tentar(aplicacao, ambiente.PSICOLOGO_BENCH, *t), tentativas))
+    duracao = time.perf_counter() - inicio
+
+    por_etapa = {}
+    for etapa, segundos in resultados:
+        por_etapa.setdefault(etapa, []).append(segundos * 1000)
+    print(f"{args.clientes} tentativas em {duracao:.2f}s ({args.concorrencia} simultâneas, "
+          f"{args.horarios} horários, {'emulador' if ambiente.usando_emulador() else 'Firestore em memória'})")
+    for etapa in ('reservado', 'retencao', 'confirmacao'):
+        latencias = por_etapa.get(etapa, [])
+        if latencias:
+            print(f"  {etapa:<12}{len(latencias):>6}   p50 {statistics.median(latencias):7.2f} ms"
+                  f"   máx {max(latencias):7.2f} ms")
+
+    # Conferência: cada bloco reservado aponta para um agendamento, e agendamentos não se sobrepõem
+    falhas = []
+    agendamentos = {doc.id: doc.to_dict() for doc in aplicacao.db.collection('agendamentos')
+                    .where(filter=aplicacao.firestore.FieldFilter('psicologo_id', '==', ambiente.PSICOLOGO_BENCH))
+                    .stream() if doc.to_dict().get('usuarioEmail', '').endswith('@bench.psicoajuda')
+                    and doc.to_dict().get('reservaHorarios')}
+    blocos = {}
+    for doc_id, dados in agendamentos.items():
+        for bloco in dados['reservaHorarios']:
+            if bloco in blocos:
+                falhas.append(f"bloco {bloco} com dois agendamentos: {blocos[bloco]} e {doc_id}")
+            blocos[bloco] = doc_id
+    for bloco, doc_id in blocos.items():
+        reserva = aplicacao.db.collection(aplicacao.COLECAO_RESERVAS).document(bloco).get()
+        if not reserva.exists or reserva.get('agendamento_id') != doc_id:
+            falhas.append(f"bloco {bloco} sem a reserva do agendamento {doc_id}")
+    if len(por_etapa.get('reservado', [])) != len(agendamentos):
+        falhas.append(f"{len(por_etapa.get('reservado', []))} reservas confirmadas, {len(agendamentos)} agendamentos gravados")
+
+    print(f"{len(agendamentos)} agendamentos, {len(blocos)} blocos reservados")
+    for falha in falhas:
+        print(f"FALHA: {falha}")
+    return 1 if falhas else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,7 @@
+"""Entrada do gunicorn para o benchmark: o app.py com o Firestore do benchmark já semeado.
+
+    gunicorn benchmarks.wsgi:app
+"""
+from benchmarks import ambiente
+
+app = ambiente.carregar_app().app
@@ -0,0 +1,63 @@
+"""Configuração do gunicorn (lida automaticamente quando ele é iniciado na raiz do projeto).
+
+Modo de produção: o app é pré-carregado no master (imports e templates compartilhados entre
+os workers por copy-on-write) e cada worker gthread atende várias requisições ao mesmo tempo,
+já que quase todo o tempo de uma requisição é espera pelo Firestore/Auth.
+
+Variáveis de ambiente:
+    WEB_CONCURRENCY   workers (processos); padrão 2
+    GUNICORN_THREADS  threads por worker; padrão 8
+    GUNICORN_PRELOAD  '0' desliga o preload (cada worker importa o app sozinho)
+    RPC_WORKERS       threads do pool de RPCs em paralelo do app.py; padrão 2 x GUNICORN_THREADS
+    AQUECER_WORKER    '1' aquece cada worker (templates, Firestore, diretório) antes de aceitar conexões
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+# Conexões keep-alive ficam com a thread que as atende; um prazo curto libera as threads ociosas
+keepalive = 5
+timeout = 60
+
+# Cada requisição dispara no máximo duas RPCs simultâneas no pool do app (seção 4.7 do app.py)
+os.environ.setdefault('RPC_WORKERS', str(threads * 2))
+
+# Métricas do Prometheus somadas entre os workers: cada processo grava seus valores nesta
+# pasta e o /metrics lê todos. Precisa estar definida antes de o app importar o prometheus_client.
+if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='psicoajuda-metricas-')
+
+
+def on_starting(server):
+    """Descarta arquivos de métricas de uma execução anterior (a pasta pode vir do ambiente)."""
+    pasta = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(pasta, ignore_errors=True)
+    os.makedirs(pasta, exist_ok=True)
+
+
+def post_fork(server, worker):
+    """Com preload, descarta no worker recém-criado conexões e threads herdadas do master.
+
+    O app.py abre o Firebase e o canal gRPC do Firestore no primeiro uso, já dentro do worker.
+    """
+    aplicacao = sys.modules.get('app')
+    if preload_app and aplicacao is not None and hasattr(aplicacao, 'preparar_worker'):
+        aplicacao.preparar_worker()
+
+
+def post_worker_init(worker):
+    """Com AQUECER_WORKER=1, o worker só entra no loop de requisições depois de aquecido."""
+    aplicacao = sys.modules.get('app')
+    if os.environ.get('AQUECER_WORKER', '0') == '1' and aplicacao is not None:
+        aplicacao.aquecer_worker()
+
+
+def child_exit(server, worker):
+    """Remove do gauge 'em andamento' os valores de um worker que terminou."""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,39 @@
+"""Importa o app.py para os testes, sem credenciais reais nem Firestore.
+
+O Firebase Admin é inicializado antes com uma credencial anônima (como em benchmarks/ambiente.py):
+o app.py aceita o app já existente e nenhum teste daqui chega a abrir conexão com o Google.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJETO_TESTE = 'psicoajuda-testes'
+
+os.environ.setdefault('LOG_REQUISICOES', '0')
+os.environ.setdefault('SESSOES_DB', os.path.join(tempfile.mkdtemp(prefix='psicoajuda-testes-'), 'sessoes.sqlite3'))
+
+
+def _inicializar_firebase():
+    import firebase_admin
+    from firebase_admin import credentials
+    from google.auth.credentials import AnonymousCredentials
+
+    class CredencialAnonima(credentials.Base):
+        def get_credential(self):
+            return AnonymousCredentials()
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(CredencialAnonima(), {'projectId': PROJETO_TESTE})
+
+
+@pytest.fixture(scope='session')
+def aplicacao():
+    if RAIZ not in sys.path:
+        sys.path.insert(0, RAIZ)
+    _inicializar_firebase()
+    import app as aplicacao
+    aplicacao.app.config['TESTING'] = True
+    return aplicacao
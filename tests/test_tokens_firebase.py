@@ -0,0 +1,232 @@
+"""Verificação local de ID tokens e cookies de sessão do Firebase (seção 4.10 do app.py).
+
+Os tokens são assinados com chaves RSA geradas aqui; o certificado correspondente é instalado
+no verificador no lugar das chaves públicas do Google.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+from conftest import PROJETO_TESTE
+
+EMISSOR_ID_TOKEN = 'https://securetoken.google.com/{projeto}'
+EMISSOR_COOKIE = 'https://session.firebase.google.com/{projeto}'
+UID = 'psi-teste-01'
+
+
+def _gerar_chave():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def _certificado(chave):
+    """Certificado X.509 autoassinado, no formato publicado pelo Google para o securetoken."""
+    nome = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'securetoken.system.gserviceaccount.com')])
+    agora = datetime.now(timezone.utc)
+    certificado = (x509.CertificateBuilder().subject_name(nome).issuer_name(nome)
+                   .public_key(chave.public_key()).serial_number(x509.random_serial_number())
+                   .not_valid_before(agora - timedelta(days=1)).not_valid_after(agora + timedelta(days=1))
+                   .sign(chave, hashes.SHA256()))
+    return certificado.public_bytes(serialization.Encoding.PEM)
+
+
+@pytest.fixture(scope='module')
+def chave():
+    return _gerar_chave()
+
+
+@pytest.fixture(scope='module')
+def outra_chave():
+    return _gerar_chave()
+
+
+def _claims(emissor=EMISSOR_ID_TOKEN, projeto=PROJETO_TESTE, uid=UID, idade=0, validade=3600):
+    agora = int(time.time()) - idade
+    return {'iss': emissor.format(projeto=projeto), 'aud': projeto, 'sub': uid,
+            'iat': agora, 'auth_time': agora, 'exp': agora + validade}
+
+
+def _assinar(claims, chave, kid='k1', algoritmo='RS256'):
+    return jwt.encode(claims, chave, algorithm=algoritmo, headers={'kid': kid})
+
+
+@pytest.fixture
+def verificador(aplicacao, chave):
+    verificador = aplicacao.VerificadorTokensFirebase(None, EMISSOR_ID_TOKEN)
+    verificador.instalar_chaves({'k1': _certificado(chave)})
+    return verificador
+
+
+def test_token_valido(verificador, chave):
+    claims = verificador.verificar(_assinar(_claims(), chave), projeto=PROJETO_TESTE)
+    assert claims is not None
+    assert claims['uid'] == UID
+
+
+def test_chave_publica_em_pem_tambem_e_aceita(aplicacao, chave):
+    verificador = aplicacao.VerificadorTokensFirebase(None, EMISSOR_ID_TOKEN)
+    publica = chave.public_key().public_bytes(serialization.Encoding.PEM,
+                                              serialization.PublicFormat.SubjectPublicKeyInfo)
+    verificador.instalar_chaves({'k1': publica})
+    assert verificador.verificar(_assinar(_claims(), chave), projeto=PROJETO_TESTE)['uid'] == UID
+
+
+def test_token_expirado(verificador, chave):
+    token = _assinar(_claims(idade=7200, validade=3600), chave)
+    assert verificador.verificar(token, projeto=PROJETO_TESTE) is None
+
+
+def test_publico_de_outro_projeto(verificador, chave):
+    claims = dict(_claims(), aud='outro-projeto')
+    assert verificador.verificar(_assinar(claims, chave), projeto=PROJETO_TESTE) is None
+
+
+def test_emissor_errado(verificador, chave):
+    # Um cookie de sessão não vale como ID token (e vice-versa): os emissores são diferentes
+    token = _assinar(_claims(emissor=EMISSOR_COOKIE), chave)
+    assert verificador.verificar(token, projeto=PROJETO_TESTE) is None
+
+
+@pytest.mark.parametrize('algoritmo', ['RS512', 'HS256', 'none'])
+def test_algoritmo_diferente_de_rs256(verificador, chave, algoritmo):
+    if algoritmo == 'RS512':
+        segredo = chave
+    elif algoritmo == 'HS256':
+        segredo = 'segredo-compartilhado-de-teste-com-32-bytes'
+    else:
+        segredo = None
+    token = _assinar(_claims(), segredo, algoritmo=algoritmo)
+    assert verificador.verificar(token, projeto=PROJETO_TESTE) is None
+
+
+def test_kid_desconhecido(verificador, outra_chave):
+    token = _assinar(_claims(), outra_chave, kid='k2')
+    assert verificador.verificar(token, projeto=PROJETO_TESTE) is None
+
+
+def test_assinatura_de_outra_chave_com_kid_conhecido(verificador, outra_chave):
+    token = _assinar(_claims(), outra_chave, kid='k1')
+    assert verificador.verificar(token, projeto=PROJETO_TESTE) is None
+
+
+def test_sem_token_ou_sem_projeto(verificador, chave):
+    assert verificador.verificar(None, projeto=PROJETO_TESTE) is None
+    assert verificador.verificar('', projeto=PROJETO_TESTE) is None
+    assert verificador.verificar('nao-e-um-jwt', projeto=PROJETO_TESTE) is None
+
+
+def test_kid_desconhecido_busca_as_chaves_de_novo(aplicacao, chave, outra_chave, monkeypatch):
+    """Rotação: um 'kid' novo faz buscar as chaves, no máximo uma vez por INTERVALO_MINIMO_BUSCA."""
+    verificador = aplicacao.VerificadorTokensFirebase('https://chaves.invalid/', EMISSOR_ID_TOKEN)
+    verificador.instalar_chaves({'k1': _certificado(chave)})
+    buscas = []
+
+    def buscar():
+        buscas.append(time.time())
+        verificador._ultima_busca = time.time()
+        verificador.instalar_chaves({'k1': _certificado(chave), 'k2': _certificado(outra_chave)})
+
+    monkeypatch.setattr(verificador, '_buscar_chaves', buscar)
+    assert verificador.verificar(_assinar(_claims(), outra_chave, kid='k2'), projeto=PROJETO_TESTE)['uid'] == UID
+    assert verificador.verificar(_assinar(_claims(), outra_chave, kid='k3'), projeto=PROJETO_TESTE) is None
+    assert len(buscas) == 1
+
+
+# ----------------------------------------------------------
+# Sessões do app no modo 'token'
+# ----------------------------------------------------------
+
+@pytest.fixture
+def modo_token(aplicacao, chave, monkeypatch):
+    """LOGIN_MODO='token' com os verificadores do app usando a chave local."""
+    monkeypatch.setattr(aplicacao, 'LOGIN_MODO', 'token')
+    monkeypatch.setattr(aplicacao, '_projeto_firebase', PROJETO_TESTE)
+    for nome, emissor in (('verificador_id_token', EMISSOR_ID_TOKEN), ('verificador_cookie_sessao', EMISSOR_COOKIE)):
+        verificador = aplicacao.VerificadorTokensFirebase(None, emissor)
+        verificador.instalar_chaves({'k1': _certificado(chave)})
+        monkeypatch.setattr(aplicacao, nome, verificador)
+    return aplicacao
+
+
+def _cliente_de_psicologo(aplicacao, cookie=None):
+    cliente = aplicacao.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['user_role'] = 'psicologo'
+        sessao['psicologo_uid'] = UID
+    if cookie is not None:
+        cliente.set_cookie(aplicacao.COOKIE_SESSAO_FIREBASE, cookie)
+    return cliente
+
+
+def _papel_na_sessao(cliente):
+    with cliente.session_transaction() as sessao:
+        return sessao.get('user_role')
+
+
+def test_cookie_de_sessao_valido_mantem_o_login(modo_token, chave):
+    cliente = _cliente_de_psicologo(modo_token, _assinar(_claims(emissor=EMISSOR_COOKIE), chave))
+    resposta = cliente.get('/login')
+    assert resposta.status_code == 302
+    assert resposta.headers['Location'].endswith('/dashboard')
+    assert _papel_na_sessao(cliente) == 'psicologo'
+
+
+@pytest.mark.parametrize('caso', ['ausente', 'expirado', 'outro_uid', 'chave_revogada', 'id_token'])
+def test_cookie_invalido_encerra_a_sessao(modo_token, chave, outra_chave, caso):
+    """Cookie revogado, vencido ou de outro usuário: a sessão cai e o login volta a aparecer."""
+    cookies = {
+        'ausente': None,
+        'expirado': _assinar(_claims(emissor=EMISSOR_COOKIE, idade=7200, validade=3600), chave),
+        'outro_uid': _assinar(_claims(emissor=EMISSOR_COOKIE, uid='outro-psicologo'), chave),
+        # Chave que saiu da lista publicada: o 'kid' continua, a assinatura não confere mais
+        'chave_revogada': _assinar(_claims(emissor=EMISSOR_COOKIE), outra_chave),
+        'id_token': _assinar(_claims(emissor=EMISSOR_ID_TOKEN), chave),
+    }
+    cliente = _cliente_de_psicologo(modo_token, cookies[caso])
+    resposta = cliente.get('/login')
+    assert resposta.status_code == 200
+    assert _papel_na_sessao(cliente) is None
+
+
+def test_sessao_revogada_ao_criar_o_cookie_volta_ao_login(modo_token, chave, monkeypatch):
+    """ID token válido localmente, mas revogado no Firebase: create_session_cookie recusa e ninguém entra."""
+    from firebase_admin import auth
+
+    def recusar(id_token, expires_in):
+        raise auth.RevokedIdTokenError('O ID token foi revogado.')
+
+    monkeypatch.setattr(auth, 'create_session_cookie', recusar)
+    monkeypatch.setattr(modo_token, 'get_psicologo_by_id', lambda uid: {'id': uid, 'nome': 'Psicóloga Teste'})
+    cliente = modo_token.app.test_client()
+    resposta = cliente.post('/login/sessao', data={'id_token': _assinar(_claims(), chave)})
+    assert resposta.status_code == 302
+    assert resposta.headers['Location'].endswith('/login')
+    assert _papel_na_sessao(cliente) is None
+    assert modo_token.COOKIE_SESSAO_FIREBASE not in resposta.headers.get('Set-Cookie', '')
+
+
+def test_login_sessao_cria_o_cookie(modo_token, chave, monkeypatch):
+    from firebase_admin import auth
+
+    monkeypatch.setattr(auth, 'create_session_cookie', lambda id_token, expires_in: 'cookie-de-sessao')
+    monkeypatch.setattr(modo_token, 'get_psicologo_by_id', lambda uid: {'id': uid, 'nome': 'Psicóloga Teste'})
+    cliente = modo_token.app.test_client()
+    resposta = cliente.post('/login/sessao', data={'id_token': _assinar(_claims(), chave)})
+    assert resposta.status_code == 302
+    assert resposta.headers['Location'].endswith('/dashboard')
+    assert _papel_na_sessao(cliente) == 'psicologo'
+    assert f'{modo_token.COOKIE_SESSAO_FIREBASE}=cookie-de-sessao' in resposta.headers['Set-Cookie']
+
+
+def test_login_com_autenticacao_antiga_e_recusado(modo_token, chave):
+    """O ID token precisa ser de um login recente (IDADE_MAXIMA_LOGIN)."""
+    token = _assinar(_claims(idade=modo_token.IDADE_MAXIMA_LOGIN + 60), chave)
+    cliente = modo_token.app.test_client()
+    resposta = cliente.post('/login/sessao', data={'id_token': token})
+    assert resposta.headers['Location'].endswith('/login')
+    assert _papel_na_sessao(cliente) is None